@@ -0,0 +1,50 @@
+'''
+Time-to-factorize of the tiled Cholesky kernels, run locally.
+
+"inverse" is the previous opcode set: every diagonal factor is inverted
+(INVRS) and the column updates multiply by the inverse. "trsm" drops the
+inverse and solves against the diagonal factor with a triangular solve.
+'''
+import time
+
+import numpy as np
+import scipy.linalg
+
+
+def tiled_cholesky(A, shard_size, use_trsm):
+    n = A.shape[0]
+    L = np.tril(A)
+    idxs = [(s, min(s + shard_size, n)) for s in range(0, n, shard_size)]
+    for i, (s0, e0) in enumerate(idxs):
+        L_bb = np.linalg.cholesky(L[s0:e0, s0:e0])
+        L[s0:e0, s0:e0] = L_bb
+        if (not use_trsm):
+            L_bb_inv = np.linalg.inv(L_bb)
+        for (s1, e1) in idxs[i+1:]:
+            col_block = L[s1:e1, s0:e0]
+            if (use_trsm):
+                L[s1:e1, s0:e0] = scipy.linalg.solve_triangular(L_bb, col_block.T, lower=True).T
+            else:
+                L[s1:e1, s0:e0] = col_block.dot(L_bb_inv.T)
+        for j, (s1, e1) in enumerate(idxs[i+1:]):
+            for (s2, e2) in idxs[i+1:i+2+j]:
+                L[s1:e1, s2:e2] -= L[s1:e1, s0:e0].dot(L[s2:e2, s0:e0].T)
+    return np.tril(L)
+
+
+if __name__ == "__main__":
+    np.random.seed(0)
+    print("{0:>6} {1:>6} {2:>12} {3:>12} {4:>14} {5:>14}".format(
+        "n", "shard", "inverse s", "trsm s", "inverse err", "trsm err"))
+    for n, shard_size in [(2048, 256), (4096, 512), (4096, 1024)]:
+        X = np.random.randn(n, n)
+        A = X.dot(X.T) + 1e-3*np.eye(n)
+        L_ref = np.linalg.cholesky(A)
+        results = []
+        for use_trsm in [False, True]:
+            t = time.time()
+            L = tiled_cholesky(A, shard_size, use_trsm)
+            e = time.time()
+            results.append((e - t, np.max(np.abs(L - L_ref))))
+        print("{0:>6} {1:>6} {2:>12.3f} {3:>12.3f} {4:>14.3e} {5:>14.3e}".format(
+            n, shard_size, results[0][0], results[1][0], results[0][1], results[1][1]))
@@ -0,0 +1,41 @@
+'''
+Achieved bandwidth of binops.add against the number of output blocks per task.
+
+Elementwise ops do one flop per 24 bytes moved, so their runtime is the
+bytes read and written over the object store bandwidth plus the per task
+overhead. Batching small blocks into fewer tasks spreads that overhead.
+The storage ceiling is measured with planner.ExecutorProfile.measure on
+the same executor. Runs on a numpywren.local.LocalExecutor.
+'''
+import multiprocessing
+import sys
+import tempfile
+
+import numpy as np
+
+from numpywren import binops, local, planner
+from numpywren.matrix import BigMatrix, DEFAULT_BUCKET
+from numpywren.matrix_init import shard_matrix
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2048
+    shard_size = int(sys.argv[2]) if len(sys.argv) > 2 else 128
+    local.use_local_storage(tempfile.mkdtemp())
+    workers = multiprocessing.cpu_count()
+    pwex = local.LocalExecutor(workers=workers)
+    profile = planner.ExecutorProfile.measure(pwex, DEFAULT_BUCKET, workers=workers, n=shard_size)
+    np.random.seed(0)
+    X = np.random.randn(n, n)
+    X_sharded = BigMatrix("elemwise_bandwidth_X", shape=X.shape, shard_sizes=[shard_size, shard_size])
+    shard_matrix(X_sharded, X)
+    row = np.random.randn(1, n)
+    print("{0} x {0} add, {1} x {1} blocks".format(n, shard_size))
+    print("{0:>14} {1:>10} {2:>8} {3:>8} {4:>10}".format("tasks_per_job", "operand", "seconds", "GB/s", "of ceiling"))
+    for tasks_per_job in [1, 4, 16, 64]:
+        for name, Y in [("matrix", X_sharded), ("row", row)]:
+            stats = {}
+            out = binops.add(pwex, X_sharded, Y, tasks_per_job=tasks_per_job, profile=profile, stats=stats)
+            out.delete()
+            print("{0:>14} {1:>10} {2:>8.2f} {3:>8.3f} {4:>10.0%}".format(
+                tasks_per_job, name, stats["seconds"], stats["gbytes_per_second"], stats["efficiency"]))
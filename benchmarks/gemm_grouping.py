@@ -0,0 +1,62 @@
+'''
+Bytes read by gemm workers against the shape of the output block groups.
+
+With tasks_per_job > 1 every job computes a group of output blocks and
+downloads each input block its group needs once per reduce step. A group
+covering an r x c patch reads r row panels of X and c column panels of Y
+instead of one of each per output block. Counts the bytes read for groups
+taken from hash ordered blocks (the old behaviour), row major order and
+Hilbert order, then measures Hilbert grouping on a
+numpywren.local.LocalExecutor.
+'''
+import sys
+import tempfile
+
+import numpy as np
+
+from numpywren import binops, local, matrix_utils
+from numpywren.matrix import BigMatrix
+from numpywren.matrix_init import shard_matrix
+
+
+def bytes_read(groups, num_reduce_blocks, block_bytes):
+    total = 0
+    for group in groups:
+        rows = set([i for i, _ in group])
+        cols = set([j for _, j in group])
+        total += (len(rows) + len(cols))*num_reduce_blocks*block_bytes
+    return total
+
+
+if __name__ == "__main__":
+    grid = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    shard_size = 4096
+    block_bytes = shard_size*shard_size*8
+    block_idxs = [(i, j) for i in range(grid) for j in range(grid)]
+    orders = [("hash", list(set(block_idxs))),
+              ("row major", sorted(block_idxs)),
+              ("hilbert", matrix_utils.hilbert_order(block_idxs))]
+    print("{0} x {0} output blocks of {1} x {1}, GB read by all workers".format(grid, shard_size))
+    print("{0:>14} {1:>10} {2:>10} {3:>10}".format("tasks_per_job", *[name for name, _ in orders]))
+    for tasks_per_job in [1, 2, 4, 8, 16, 64]:
+        read = [bytes_read(matrix_utils.chunk(order, tasks_per_job), grid, block_bytes)/1e9 for _, order in orders]
+        print("{0:>14} {1:>10.1f} {2:>10.1f} {3:>10.1f}".format(tasks_per_job, *read))
+
+    print("")
+    print("measured on a local executor, 8 x 8 output blocks of 64 x 64")
+    local.use_local_storage(tempfile.mkdtemp())
+    pwex = local.LocalExecutor()
+    np.random.seed(0)
+    X = np.random.randn(512, 512)
+    X_sharded = BigMatrix("gemm_grouping_X", shape=X.shape, shard_sizes=[64, 64])
+    shard_matrix(X_sharded, X)
+    reduce_idxs = X_sharded._block_idxs(1)
+    print("{0:>14} {1:>10}".format("tasks_per_job", "MB read"))
+    for tasks_per_job in [1, 4, 16]:
+        XY = BigMatrix("gemm_grouping_XY", shape=X.shape, shard_sizes=[64, 64], write_header=True)
+        groups = list(matrix_utils.chunk(matrix_utils.hilbert_order(XY.block_idxs), tasks_per_job))
+        futures = pwex.map(lambda g: binops._gemm_remote_0(g, XY, X_sharded, X_sharded, reduce_idxs=reduce_idxs), groups)
+        read = sum([r for r, _, _ in matrix_utils.wait_all(futures)])
+        assert(np.allclose(XY.numpy(), X.dot(X)))
+        print("{0:>14} {1:>10.1f}".format(tasks_per_job, read/1e6))
+        XY.delete()
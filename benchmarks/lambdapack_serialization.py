@@ -0,0 +1,45 @@
+'''
+Payload size and decode time of LambdaPack programs against DAG size.
+
+Compares the bytes every invocation used to carry (the whole pickled
+program behind the bound pywren_func) with the compact program that is
+now stored once per run, and the (program_id, node_id) invocation payload.
+'''
+import functools
+import pickle
+import time
+
+import cloudpickle
+import numpy as np
+
+from numpywren import lambdapack as lp
+from numpywren.matrix import BigSymmetricMatrix
+
+
+def benchmark(num_blocks, shard_size=1024, bucket=lp.DEFAULT_CONFIG.get('s3', {}).get('bucket', '')):
+    X = BigSymmetricMatrix("lambdapack_serialization_{0}".format(num_blocks),
+                           shape=(num_blocks*shard_size, num_blocks*shard_size),
+                           shard_sizes=(shard_size, shard_size),
+                           bucket=bucket)
+    instructions, L, trailing = lp._chol(X)
+    program = lp.LambdaPackProgram(instructions, pywren_config={'s3': {'bucket': bucket}})
+    legacy_payload = len(cloudpickle.dumps(dict(program.__dict__)))
+    t = time.time()
+    stored = cloudpickle.dumps(program)
+    e = time.time()
+    encode_time = e - t
+    t = time.time()
+    pickle.loads(stored)
+    e = time.time()
+    decode_time = e - t
+    runner = functools.partial(lp.run_program_node, bucket)
+    invocation_payload = len(cloudpickle.dumps((runner, (program.program_id, 0))))
+    L.delete()
+    return len(program.inst_blocks), legacy_payload, len(stored), invocation_payload, encode_time, decode_time
+
+
+if __name__ == "__main__":
+    print("{0:>8} {1:>14} {2:>14} {3:>12} {4:>10} {5:>10}".format(
+        "nodes", "legacy bytes", "stored bytes", "invoke bytes", "encode s", "decode s"))
+    for num_blocks in [2, 4, 8, 16, 32]:
+        print("{0:>8} {1:>14} {2:>14} {3:>12} {4:>10.4f} {5:>10.4f}".format(*benchmark(num_blocks)))
@@ -0,0 +1,61 @@
+'''
+Throughput of the LambdaPack LU factorization.
+
+Factors random matrices on a numpywren.local.LocalExecutor with local
+storage and reports the achieved GFLOP/s (2/3 n^3 flops) next to a single
+call to scipy.linalg.lu_factor. Then predicts the makespan of larger
+factorizations on AWS Lambda with numpywren.simulator.
+'''
+import sys
+import tempfile
+import time
+
+import numpy as np
+import scipy.linalg
+
+from numpywren import local, simulator, uops
+from numpywren.matrix import BigMatrix
+from numpywren.matrix_init import shard_matrix
+
+
+def lu_flops(n):
+    return 2.0/3.0*n**3
+
+
+if __name__ == "__main__":
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    local.use_local_storage(tempfile.mkdtemp())
+    pwex = local.LocalExecutor(workers=workers)
+    np.random.seed(0)
+    print("{0:>6} {1:>6} {2:>10} {3:>10} {4:>10} {5:>10} {6:>12}".format(
+        "n", "shard", "numpywren s", "GFLOP/s", "scipy s", "GFLOP/s", "residual"))
+    for n, shard_size in [(512, 128), (1024, 256), (2048, 512)]:
+        A = np.random.randn(n, n)
+        A_sharded = BigMatrix("lu_throughput_{0}_{1}".format(n, shard_size), shape=A.shape, shard_sizes=[shard_size, shard_size])
+        shard_matrix(A_sharded, A)
+        t = time.time()
+        LU_sharded, perm = uops.lu(pwex, A_sharded)
+        e = time.time()
+        LU = LU_sharded.numpy()
+        L = np.tril(LU, -1) + np.eye(n)
+        residual = np.linalg.norm(A[perm] - L.dot(np.triu(LU)))/np.linalg.norm(A)
+        t_ref = time.time()
+        scipy.linalg.lu_factor(A)
+        e_ref = time.time()
+        print("{0:>6} {1:>6} {2:>10.2f} {3:>10.2f} {4:>10.2f} {5:>10.2f} {6:>12.3e}".format(
+            n, shard_size, e - t, lu_flops(n)/(e - t)/1e9, e_ref - t_ref,
+            lu_flops(n)/(e_ref - t_ref)/1e9, residual))
+        A_sharded.free()
+        LU_sharded.free()
+
+    print("")
+    print("simulated on 1000 workers")
+    cost_model = simulator.CostModel(workers=1000)
+    print("{0:>6} {1:>6} {2:>8} {3:>10} {4:>10} {5:>8}".format(
+        "n", "shard", "blocks", "makespan", "GFLOP/s", "peak"))
+    for n, shard_size in [(65536, 4096), (65536, 8192), (131072, 8192)]:
+        inst_blocks = simulator.lu_instructions(n, shard_size)
+        result = simulator.simulate(inst_blocks, cost_model)
+        print("{0:>6} {1:>6} {2:>8} {3:>10.1f} {4:>10.1f} {5:>8}".format(
+            n, shard_size, len(inst_blocks), result.makespan, lu_flops(n)/result.makespan/1e9,
+            result.peak_concurrency))
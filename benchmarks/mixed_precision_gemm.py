@@ -0,0 +1,58 @@
+'''
+Speed and accuracy of gemm against the precision inputs are stored in,
+the precision blocks are accumulated in and compensated summation.
+
+Lower storage precision halves (float32) or quarters (float16) the bytes
+workers download, the error columns show what that costs against a
+float64 reference. Runs on a numpywren.local.LocalExecutor, so the
+speedup is that of local disk and numpy, on lambda the read bytes
+dominate.
+'''
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from numpywren import binops, local
+from numpywren.matrix import BigMatrix
+from numpywren.matrix_init import shard_matrix
+
+CONFIGS = [(np.float64, np.float64, False),
+           (np.float32, np.float64, False),
+           (np.float32, np.float32, False),
+           (np.float32, np.float32, True),
+           (np.float16, np.float64, False),
+           (np.float16, np.float32, True)]
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1024
+    shard_size = int(sys.argv[2]) if len(sys.argv) > 2 else 128
+    local.use_local_storage(tempfile.mkdtemp())
+    pwex = local.LocalExecutor()
+    np.random.seed(0)
+    X = np.random.rand(n, n)
+    Y = np.random.rand(n, n)
+    exact = X.dot(Y)
+    print("{0} x {0} gemm, {1} x {1} blocks".format(n, shard_size))
+    print("{0:>8} {1:>8} {2:>12} {3:>10} {4:>8} {5:>10} {6:>12}".format(
+        "storage", "compute", "compensated", "MB read", "seconds", "speedup", "max rel err"))
+    baseline = None
+    for storage, compute, compensated in CONFIGS:
+        name = "mixed_precision_{0}".format(np.dtype(storage).name)
+        X_sharded = BigMatrix(name + "_X", shape=X.shape, shard_sizes=[shard_size, shard_size], dtype=storage)
+        Y_sharded = BigMatrix(name + "_Y", shape=Y.shape, shard_sizes=[shard_size, shard_size], dtype=storage)
+        shard_matrix(X_sharded, X.astype(storage))
+        shard_matrix(Y_sharded, Y.astype(storage))
+        stats = {}
+        start = time.time()
+        XY_sharded = binops.gemm(pwex, X_sharded, Y_sharded, worker_memory=64*shard_size*shard_size*8,
+                                 compute_dtype=compute, compensated=compensated, stats=stats)
+        seconds = time.time() - start
+        if (baseline is None):
+            baseline = seconds
+        error = np.max(np.abs(XY_sharded.numpy() - exact)/np.abs(exact))
+        print("{0:>8} {1:>8} {2:>12} {3:>10.1f} {4:>8.2f} {5:>10.2f} {6:>12.2e}".format(
+            np.dtype(storage).name, np.dtype(compute).name, str(compensated), stats["read_bytes"]/1e6,
+            seconds, baseline/seconds, error))
@@ -0,0 +1,47 @@
+'''
+Accuracy versus runtime of uops.randomized_svd.
+
+Builds a matrix with a slowly decaying spectrum, runs the randomized SVD on
+a numpywren.local.LocalExecutor for a range of oversampling and power
+iteration settings, and reports the spectral norm error relative to the
+optimal rank k error (the k + 1st singular value) and the largest relative
+error of the singular values.
+'''
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from numpywren import local, uops
+from numpywren.matrix import BigMatrix
+from numpywren.matrix_init import shard_matrix
+
+
+if __name__ == "__main__":
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    local.use_local_storage(tempfile.mkdtemp())
+    pwex = local.LocalExecutor(workers=workers)
+    np.random.seed(0)
+    m, n, k = 2048, 512, 20
+    U, _ = np.linalg.qr(np.random.randn(m, n))
+    V, _ = np.linalg.qr(np.random.randn(n, n))
+    s = 1.0/np.sqrt(1.0 + np.arange(n))
+    X = (U*s).dot(V.T)
+    X_sharded = BigMatrix("randomized_svd_accuracy_X", shape=X.shape, shard_sizes=[512, 256])
+    shard_matrix(X_sharded, X)
+    print("{0:>10} {1:>12} {2:>10} {3:>14} {4:>16}".format(
+        "oversample", "power iters", "seconds", "error / opt", "max sigma error"))
+    for oversample in [5, 20]:
+        for power_iters in [0, 1, 2, 4]:
+            t = time.time()
+            U_sharded, s_k, V_sharded = uops.randomized_svd(pwex, X_sharded, k, oversample=oversample,
+                                                            power_iters=power_iters)
+            e = time.time()
+            U_k = U_sharded.numpy()
+            V_k = V_sharded.numpy()
+            error = np.linalg.norm(X - (U_k*s_k).dot(V_k.T), 2)
+            print("{0:>10} {1:>12} {2:>10.2f} {3:>14.4f} {4:>16.3e}".format(
+                oversample, power_iters, e - t, error/s[k], np.max(np.abs(s_k - s[:k])/s[:k])))
+            U_sharded.delete()
+            V_sharded.delete()
@@ -0,0 +1,32 @@
+'''
+Predicted cost of the LambdaPack Cholesky for a range of shard sizes.
+
+Runs the numpywren.simulator offline, no AWS resources are used. Pass a
+json file of numpywren.trace records from a real run to calibrate the
+cost model, otherwise the CostModel defaults are used.
+'''
+import json
+import sys
+import time
+
+from numpywren import simulator
+
+
+if __name__ == "__main__":
+    n = 65536
+    workers = 1000
+    if (len(sys.argv) > 1):
+        with open(sys.argv[1]) as f:
+            cost_model = simulator.CostModel.from_trace(json.load(f), workers=workers)
+    else:
+        cost_model = simulator.CostModel(workers=workers)
+    print("{0:>6} {1:>8} {2:>10} {3:>12} {4:>8} {5:>10} {6:>8}".format(
+        "shard", "blocks", "makespan", "invocations", "peak", "requests", "sim s"))
+    for shard_size in [2048, 4096, 8192, 16384]:
+        inst_blocks = simulator.cholesky_instructions(n, shard_size)
+        t = time.time()
+        result = simulator.simulate(inst_blocks, cost_model)
+        e = time.time()
+        print("{0:>6} {1:>8} {2:>10.1f} {3:>12} {4:>8} {5:>10} {6:>8.2f}".format(
+            shard_size, len(inst_blocks), result.makespan, result.invocations,
+            result.peak_concurrency, result.total_requests, e - t))
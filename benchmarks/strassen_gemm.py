@@ -0,0 +1,53 @@
+'''
+Wall clock time and error of Strassen's recursion against plain binops.gemm.
+
+Every level of the recursion trades one of 8 half size products for 18
+quadrant sums that go through the object store, so it only pays off when
+the products below the cutoff are flop bound. The 7 products of a level
+run at the same time, the seconds column is the wall clock time of the
+whole call and speedup is the plain gemm wall clock time over it. Error
+is the max relative difference to a float64 numpy product of the same
+inputs. Runs on a numpywren.local.LocalExecutor.
+'''
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from numpywren import binops, local
+from numpywren.matrix import BigMatrix
+from numpywren.matrix_init import shard_matrix
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2048
+    shard_size = int(sys.argv[2]) if len(sys.argv) > 2 else 256
+    local.use_local_storage(tempfile.mkdtemp())
+    pwex = local.LocalExecutor()
+    np.random.seed(0)
+    X = np.random.randn(n, n)
+    Y = np.random.randn(n, n)
+    exact = X.dot(Y)
+    X_sharded = BigMatrix("strassen_bench_X", shape=X.shape, shard_sizes=[shard_size, shard_size])
+    Y_sharded = BigMatrix("strassen_bench_Y", shape=Y.shape, shard_sizes=[shard_size, shard_size])
+    shard_matrix(X_sharded, X)
+    shard_matrix(Y_sharded, Y)
+    blocks = n//shard_size
+    print("{0} x {0} gemm, {1} x {1} blocks".format(n, shard_size))
+    print("{0:>8} {1:>7} {2:>10} {3:>12} {4:>15} {5:>12}".format(
+        "cutoff", "levels", "products", "wall seconds", "speedup vs gemm", "max rel err"))
+    gemm_seconds = None
+    cutoffs = [None] + [c for c in [8, 4, 2, 1] if c < blocks]
+    for cutoff in cutoffs:
+        stats = {"levels": 0, "leaf_products": 1}
+        start = time.time()
+        XY_sharded = binops.gemm(pwex, X_sharded, Y_sharded, strassen_cutoff=cutoff, tasks_per_job=4, stats=stats)
+        seconds = time.time() - start
+        if (gemm_seconds is None):
+            gemm_seconds = seconds
+        error = np.max(np.abs(XY_sharded.numpy() - exact)/np.abs(exact).max())
+        XY_sharded.delete()
+        print("{0:>8} {1:>7} {2:>10} {3:>12.2f} {4:>15.2f} {5:>12.2e}".format(
+            "gemm" if cutoff is None else cutoff, stats["levels"], stats["leaf_products"],
+            seconds, gemm_seconds/seconds, error))
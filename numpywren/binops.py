@@ -4,6 +4,10 @@ import numpy as np
 from .matrix import BigSymmetricMatrix, BigMatrix
 from .matrix_utils import load_mmap, chunk, generate_key_name_binop, constant_zeros
 from . import matrix_utils
+from . import lambdapack as lp
+from . import uops
+from .planner import plan_gemm_tiles
+from . import planner
 from .matrix_init import local_numpy_init
 import concurrent.futures as fs
 import math
@@ -11,98 +15,411 @@ import os
 import pywren
 from pywren.executor import Executor
 from scipy.linalg import cholesky, solve
+import scipy.linalg.blas
 import time
 
 
-def _gemm_remote_0(block_pairs, XY, X, Y, reduce_idxs=[0], dtype=np.float64, **kwargs):
+def _syrk(block):
+    ''' block block^T with a BLAS SYRK, which only computes one triangle '''
+    syrk = scipy.linalg.blas.get_blas_funcs("syrk", (block,))
+    out = syrk(alpha=1.0, a=block, lower=1)
+    return np.tril(out) + np.tril(out, -1).T
+
+def _symmetric_inputs(XY):
+    # a symmetric output is only made for X X^T or X^T X, so Y[r, j] is X[j, r]^T
+    return isinstance(XY, BigSymmetricMatrix)
+
+class GemmEpilogue(object):
+    '''
+        Work applied to every output block of gemm by the worker that computed it,
+        so the product never has to be written out and read back for it
+            out = ufunc(alpha XY + beta C + row_bias[:, None] + col_bias[None, :])
+        With a reduction the output blocks are not written at all, each worker reduces
+        its blocks along axis and gemm returns the reduction of the whole output.
+        @param alpha - scale of the product
+        @param beta - scale of C
+        @param C - BigMatrix sharded like the output, read only if beta != 0
+        @param row_bias - numpy vector added to every column
+        @param col_bias - numpy vector added to every row
+        @param ufunc - elementwise function applied last
+        @param reduction - None, "sum", "min", "max", "argmin", "argmax" or "topk"
+        @param axis - axis reduced, 1 gives one result per row
+        @param k - number of entries kept by topk
+        @param largest - topk keeps the largest entries, else the smallest
+    '''
+    REDUCTIONS = ["sum", "min", "max", "argmin", "argmax", "topk"]
+
+    def __init__(self, alpha=1.0, beta=0.0, C=None, row_bias=None, col_bias=None, ufunc=None,
+                 reduction=None, axis=1, k=1, largest=True):
+        if (reduction is not None and reduction not in self.REDUCTIONS):
+            raise Exception("Unknown gemm epilogue reduction {0}".format(reduction))
+        if (axis not in [0, 1]):
+            raise Exception("Gemm epilogue reductions are over axis 0 or 1")
+        if (beta != 0 and C is None):
+            raise Exception("beta != 0 needs C")
+        self.alpha = alpha
+        self.beta = beta
+        self.C = C
+        self.row_bias = None if row_bias is None else np.asarray(row_bias).ravel()
+        self.col_bias = None if col_bias is None else np.asarray(col_bias).ravel()
+        self.ufunc = ufunc
+        self.reduction = reduction
+        self.axis = axis
+        self.k = k
+        self.largest = largest
+
+    def apply(self, XY, block, i, j):
+        ''' Elementwise part of the epilogue, returns the block and the bytes read for it '''
+        bytes_read = 0
+        (row_start, row_end), (col_start, col_end) = XY._blocks(0)[i], XY._blocks(1)[j]
+        if (self.alpha != 1.0):
+            block = self.alpha*block
+        if (self.beta != 0):
+            C_block = self.C.get_block(i, j)
+            bytes_read += C_block.nbytes
+            block = block + self.beta*C_block
+        if (self.row_bias is not None):
+            block = block + self.row_bias[row_start:row_end, np.newaxis]
+        if (self.col_bias is not None):
+            block = block + self.col_bias[np.newaxis, col_start:col_end]
+        if (self.ufunc is not None):
+            block = self.ufunc(block)
+        return block, bytes_read
+
+    def _kept_block(self, i, j):
+        return i if self.axis == 1 else j
+
+    def reduce(self, XY, block, i, j):
+        ''' Reduce one output block along axis, indices returned are global '''
+        if (self.axis == 0):
+            block = block.T
+        offset = XY._blocks(self.axis)[j if self.axis == 1 else i][0]
+        if (self.reduction == "sum"):
+            return block.sum(axis=1)
+        elif (self.reduction == "min"):
+            return block.min(axis=1)
+        elif (self.reduction == "max"):
+            return block.max(axis=1)
+        elif (self.reduction in ["argmin", "argmax"]):
+            idxs = block.argmin(axis=1) if self.reduction == "argmin" else block.argmax(axis=1)
+            return block[np.arange(block.shape[0]), idxs], idxs + offset
+        else:
+            k = self.k if self.k < block.shape[1] else block.shape[1]
+            idxs = np.argsort(-block if self.largest else block, axis=1, kind="mergesort")[:, :k]
+            return np.take_along_axis(block, idxs, axis=1), idxs + offset
+
+    def combine(self, XY, partials):
+        '''
+            Combine the per block reductions, partials maps output block indices to
+            the result of reduce
+        '''
+        results = []
+        kept_axis = 0 if self.axis == 1 else 1
+        for p in XY._block_idxs(kept_axis):
+            parts = [v for (idx, v) in sorted(partials.items()) if self._kept_block(*idx) == p]
+            if (self.reduction == "sum"):
+                results.append(np.sum(parts, axis=0))
+            elif (self.reduction == "min"):
+                results.append(np.min(parts, axis=0))
+            elif (self.reduction == "max"):
+                results.append(np.max(parts, axis=0))
+            elif (self.reduction in ["argmin", "argmax"]):
+                values = np.stack([v for v, _ in parts], axis=1)
+                idxs = np.stack([idx for _, idx in parts], axis=1)
+                best = values.argmin(axis=1) if self.reduction == "argmin" else values.argmax(axis=1)
+                results.append(idxs[np.arange(idxs.shape[0]), best])
+            else:
+                values = np.concatenate([v for v, _ in parts], axis=1)
+                idxs = np.concatenate([idx for _, idx in parts], axis=1)
+                order = np.argsort(-values if self.largest else values, axis=1, kind="mergesort")[:, :self.k]
+                results.append((np.take_along_axis(values, order, axis=1), np.take_along_axis(idxs, order, axis=1)))
+        if (self.reduction == "topk"):
+            return np.concatenate([v for v, _ in results]), np.concatenate([idx for _, idx in results])
+        return np.concatenate(results)
+
+def _write_output(XY, block, i, j, epilogue=None, reduced=None):
+    '''
+        Apply the epilogue to an output block and store it, or reduce it into reduced
+        returns bytes read and written
+    '''
+    bytes_read = 0
+    if (epilogue is not None):
+        block, bytes_read = epilogue.apply(XY, block, i, j)
+        if (epilogue.reduction is not None):
+            reduced.append(((i, j), epilogue.reduce(XY, block, i, j)))
+            return bytes_read, 0
+    XY.put_block(block, i, j)
+    return bytes_read, block.size*np.dtype(XY.dtype).itemsize
+
+def _accumulate(sums, errors, key, block, compensated=False):
+    '''
+        sums[key] += block, with compensated (Kahan) summation the rounding error
+        of every addition is carried in errors[key] and fed into the next one
+    '''
+    if (key not in sums):
+        sums[key] = block
+        if (compensated):
+            errors[key] = np.zeros_like(block)
+    elif (not compensated):
+        sums[key] += block
+    else:
+        y = block - errors[key]
+        t = sums[key] + y
+        errors[key] = (t - sums[key]) - y
+        sums[key] = t
+
+def _load(bigm, compute_dtype, *block_idx):
+    ''' A block in compute precision and the bytes its storage precision moved '''
+    block = bigm.get_block(*block_idx)
+    return block.astype(compute_dtype, copy=False), block.nbytes
+
+def _gemm_remote_0(block_pairs, XY, X, Y, reduce_idxs=[0], compute_dtype=np.float64, compensated=False, epilogue=None, **kwargs):
     print(reduce_idxs)
+    # output blocks of a group share input panels, every block a reduce step
+    # needs is downloaded once and reused by all the output blocks in the group
+    rows = sorted(set([bidx_0 for bidx_0, _ in block_pairs]))
+    cols = sorted(set([bidx_1 for _, bidx_1 in block_pairs]))
+    symmetric = _symmetric_inputs(XY)
+    XY_blocks = {}
+    errors = {}
+    bytes_read = 0
+    for r in reduce_idxs:
+        X_blocks = {}
+        Y_blocks = {}
+        for bidx_0 in rows:
+            X_blocks[bidx_0], size = _load(X, compute_dtype, bidx_0, r)
+            bytes_read += size
+        for bidx_1 in cols:
+            if (symmetric and bidx_1 in X_blocks):
+                Y_blocks[bidx_1] = X_blocks[bidx_1].T
+            else:
+                Y_blocks[bidx_1], size = _load(Y, compute_dtype, r, bidx_1)
+                bytes_read += size
+        for bp in block_pairs:
+            bidx_0, bidx_1 = bp
+            if (symmetric and bidx_0 == bidx_1):
+                block = _syrk(X_blocks[bidx_0])
+            else:
+                block = X_blocks[bidx_0].dot(Y_blocks[bidx_1])
+            _accumulate(XY_blocks, errors, bp, block, compensated)
+    bytes_written = 0
+    reduced = []
     for bp in block_pairs:
         bidx_0, bidx_1 = bp
-        XY_block = None
-        X.dtype = dtype
-        Y.dtype = dtype
-        for r in reduce_idxs:
-            block1 = X.get_block(bidx_0, r)
-            block2 = Y.get_block(r, bidx_1)
-            if (XY_block is None):
-                XY_block = block1.dot(block2)
-            else:
-                XY_block += block1.dot(block2)
-        XY.put_block(XY_block, bidx_0, bidx_1)
+        r, w = _write_output(XY, XY_blocks[bp], bidx_0, bidx_1, epilogue, reduced)
+        bytes_read += r
+        bytes_written += w
+    return bytes_read, bytes_written, reduced
 
-def _gemm_remote_1(block_pairs, XY, X, Y, reduce_idxs=[0], dtype=np.float64, **kwargs):
+def _gemm_remote_1(block_pairs, XY, X, Y, reduce_idxs=[0], compute_dtype=np.float64, epilogue=None, **kwargs):
     os.system("sudo mount -o remount,size=50g /dev/shm")
-    X.dtype = dtype
-    Y.dtype = dtype
+    bytes_read = 0
+    bytes_written = 0
+    reduced = []
     for bp in block_pairs:
         bidx_0, bidx_1 = bp
         block0 = matrix_utils.get_row(X, bidx_0, mmap_loc="/dev/shm/block_0")
         block1 = matrix_utils.get_col(Y, bidx_1, mmap_loc="/dev/shm/block_1")
-        XY_block = block0.dot(block1)
-        XY.put_block(XY_block, bidx_0, bidx_1)
+        bytes_read += block0.nbytes + block1.nbytes
+        XY_block = block0.astype(compute_dtype, copy=False).dot(block1.astype(compute_dtype, copy=False))
+        r, w = _write_output(XY, XY_block, bidx_0, bidx_1, epilogue, reduced)
+        bytes_read += r
+        bytes_written += w
+    return bytes_read, bytes_written, reduced
 
-def _gemm_remote_2(block_pairs, XY, X, Y, reduce_idxs=[0], dtype=np.float64, **kwargs):
-    os.system("sudo mount -o remount,size=50g /dev/shm")
-    X.dtype = dtype
-    X.dtype = dtype
-    Y.dtype = dtype
-    block_chunk_size = kwargs.get("block_chunk_size")
+def _gemm_remote_2(block_pairs, XY, X, Y, reduce_idxs=[0], compute_dtype=np.float64, compensated=False, epilogue=None, **kwargs):
+    block_chunk_size = kwargs.get("block_chunk_size", 16)
+    prefetch_depth = kwargs.get("prefetch_depth", 2)
+    bytes_read = 0
+    bytes_written = 0
+    reduced = []
     for bp in block_pairs:
         bidx_0, bidx_1 = bp
-        result = gemm_with_prefetch(X, Y, bidx_0, bidx_1, block_chunk_size=block_chunk_size)
-        XY.put_block(result, bidx_0, bidx_1)
+        result = gemm_with_prefetch(X, Y, bidx_0, bidx_1, block_chunk_size=block_chunk_size, prefetch_depth=prefetch_depth,
+                                    compute_dtype=compute_dtype, compensated=compensated)
+        bytes_read += (result.shape[0]*X.shape[1]*np.dtype(X.dtype).itemsize +
+                       Y.shape[0]*result.shape[1]*np.dtype(Y.dtype).itemsize)
+        r, w = _write_output(XY, result, bidx_0, bidx_1, epilogue, reduced)
+        bytes_read += r
+        bytes_written += w
+    return bytes_read, bytes_written, reduced
 
 _gemms = [_gemm_remote_0, _gemm_remote_1, _gemm_remote_2]
 
 
-def gemm_with_prefetch(X, Y, bidx0, bidx1, block_chunk_size=16):
-    # prefetch first 16 columns 
-    parity = 0
-    executor = fs.ProcessPoolExecutor(32)
-    block_chunk_size = min(block_chunk_size, len(X._block_idxs(1)))
+def _tile_pairs(XY, rows, cols):
+    symmetric = isinstance(XY, BigSymmetricMatrix)
+    return [(i, j) for i in rows for j in cols if not (symmetric and j > i)]
+
+def _gemm_remote_tile(tiles, XY, X, Y, partials=None, epilogue=None, compute_dtype=np.float64, compensated=False, **kwargs):
+    '''
+        Compute a rectangle of output blocks, streaming over the reduction dimension
+        so every input block of the rectangle is downloaded exactly once
+        @param tiles - list of (rows, cols, ks, split) rectangles
+        @param partials - per split output matrices when the reduction dimension is split
+        @param epilogue - GemmEpilogue applied to finished output blocks
+        @param compute_dtype - precision blocks are multiplied and accumulated in
+        @param compensated - Kahan summation over the reduction dimension
+        returns bytes read and written and the epilogue reductions
+    '''
+    bytes_read = 0
+    bytes_written = 0
+    reduced = []
+    symmetric = _symmetric_inputs(XY)
+    for rows, cols, ks, split in tiles:
+        pairs = _tile_pairs(XY, rows, cols)
+        out = {}
+        errors = {}
+        for k in ks:
+            X_blocks = {}
+            Y_blocks = {}
+            for i in rows:
+                X_blocks[i], size = _load(X, compute_dtype, i, k)
+                bytes_read += size
+            for j in cols:
+                if (symmetric and j in X_blocks):
+                    Y_blocks[j] = X_blocks[j].T
+                    continue
+                Y_blocks[j], size = _load(Y, compute_dtype, k, j)
+                bytes_read += size
+            for i, j in pairs:
+                if (symmetric and i == j):
+                    block = _syrk(X_blocks[i])
+                else:
+                    block = X_blocks[i].dot(Y_blocks[j])
+                _accumulate(out, errors, (i, j), block, compensated)
+        for (i, j), block in out.items():
+            if (split is None):
+                r, w = _write_output(XY, block, i, j, epilogue, reduced)
+                bytes_read += r
+                bytes_written += w
+            else:
+                partials[split].put_block(block, i, j)
+                bytes_written += block.size*np.dtype(partials[split].dtype).itemsize
+    return bytes_read, bytes_written, reduced
+
+def _gemm_remote_reduce(tiles, XY, X, Y, partials=None, epilogue=None, prefetch_depth=2, compensated=False, **kwargs):
+    '''
+        Sum the per split partial products of a rectangle of output blocks,
+        the partial blocks are deleted once reduced
+        returns bytes read and written and the epilogue reductions
+    '''
+    bytes_read = 0
+    bytes_written = 0
+    reduced = []
+    for rows, cols, _, _ in tiles:
+        items = [(i, j, split) for i, j in _tile_pairs(XY, rows, cols) for split in range(len(partials))]
+        fetch = lambda item: partials[item[2]].get_block(item[0], item[1])
+        sums = {}
+        errors = {}
+        with matrix_utils.PrefetchPipeline(fetch, items, depth=prefetch_depth) as pipeline:
+            for (i, j, split), block in pipeline:
+                bytes_read += block.nbytes
+                _accumulate(sums, errors, (i, j), block, compensated)
+                if (split < len(partials) - 1):
+                    continue
+                XY_block = sums.pop((i, j))
+                errors.pop((i, j), None)
+                r, w = _write_output(XY, XY_block, i, j, epilogue, reduced)
+                bytes_read += r
+                bytes_written += w
+                [partial.delete_block(i, j) for partial in partials]
+    return bytes_read, bytes_written, reduced
+
+class _PendingGemm(object):
+    '''
+        Jobs of a gemm that are submitted but not waited for yet
+        @param futures - futures of the jobs, or their results if they ran locally
+        @param finish - called with the job results, returns what gemm returns
+    '''
+    def __init__(self, futures, finish, local=False):
+        self.futures = futures
+        self.finish = finish
+        self.local = local
+
+    def result(self):
+        results = self.futures if self.local else matrix_utils.wait_all(self.futures)
+        return self.finish(results)
+
+def _gemm_tiled(pwex, XY, X, Y, plan, tasks_per_job=1, local=False, stats=None, epilogue=None,
+                compute_dtype=np.float64, compensated=False):
+    k_splits = plan["k_splits"]
+    partials = None
+    if (k_splits > 1):
+        # partial products keep the precision they were accumulated in
+        partials = [BigMatrix(generate_key_name_binop(X, Y, "gemm_partial_{0}".format(s)), shape=XY.shape,
+                              bucket=XY.bucket, shard_sizes=XY.shard_sizes, dtype=compute_dtype, write_header=True)
+                    for s in range(k_splits)]
+    print("Tile shape {0}, {1} k splits, {2} tasks, {3} bytes per worker".format(
+        plan["tile_shape"], k_splits, len(plan["tiles"]), plan["tile_memory"]))
+
+    def submit_round(f, tiles):
+        chunked_tiles = list(chunk(tiles, tasks_per_job))
+        def pywren_run(x):
+            return f(x, XY, X, Y, partials=partials, epilogue=epilogue, compute_dtype=compute_dtype, compensated=compensated)
+        if (local):
+            return list(map(pywren_run, chunked_tiles))
+        return pwex.map(pywren_run, chunked_tiles)
+
+    def finish(results):
+        if (k_splits > 1):
+            results += _PendingGemm(submit_round(_gemm_remote_reduce, plan["reduce_tiles"]), list, local=local).result()
+            [p.delete() for p in partials]
+        read_bytes = sum([r for r, _, _ in results])
+        write_bytes = sum([w for _, w, _ in results])
+        print("Predicted bytes read {0} written {1}, actual bytes read {2} written {3}".format(
+            plan["predicted_read_bytes"], plan["predicted_write_bytes"], read_bytes, write_bytes))
+        if (stats is not None):
+            stats.update({"tile_shape": plan["tile_shape"],
+                          "k_splits": k_splits,
+                          "tasks": len(plan["tiles"]) + len(plan["reduce_tiles"]),
+                          "tile_memory": plan["tile_memory"],
+                          "predicted_read_bytes": plan["predicted_read_bytes"],
+                          "predicted_write_bytes": plan["predicted_write_bytes"],
+                          "read_bytes": read_bytes,
+                          "write_bytes": write_bytes})
+        if (epilogue is not None and epilogue.reduction is not None):
+            return epilogue.combine(XY, dict([p for _, _, reduced in results for p in reduced]))
+        return XY
+
+    # the reduce round needs the partial products, it is submitted once they are done
+    return _PendingGemm(submit_round(_gemm_remote_tile, plan["tiles"]), finish, local=local)
+
+
+def gemm_with_prefetch(X, Y, bidx0, bidx1, block_chunk_size=16, prefetch_depth=2, stats=None,
+                       compute_dtype=None, compensated=False):
+    '''
+        One output block of XY, downloading the next chunks of the reduction
+        dimension while the current chunk is multiplied
+        @param block_chunk_size - reduction blocks loaded and multiplied together
+        @param prefetch_depth - chunks kept in flight, see matrix_utils.PrefetchPipeline
+        @param stats - optional dict filled with the pipeline stats
+        @param compute_dtype - precision chunks are multiplied and accumulated in
+        @param compensated - Kahan summation over the chunks
+    '''
+    if (X._block_idxs(1) != Y._block_idxs(0)):
+        raise Exception("X dim 1 blocks must match Y dim 0 blocks")
+    if (compute_dtype is None):
+        compute_dtype = np.result_type(X.dtype, Y.dtype)
+    def fetch(blocks):
+        X_chunk = np.hstack([X.get_block(bidx0, r) for r in blocks]).astype(compute_dtype, copy=False)
+        Y_chunk = np.vstack([Y.get_block(r, bidx1) for r in blocks]).astype(compute_dtype, copy=False)
+        return X_chunk, Y_chunk
+    result = {}
+    errors = {}
     chunked_blocks = list(matrix_utils.chunk(X._block_idxs(1), block_chunk_size))
-    assert(chunked_blocks[0] == list(range(block_chunk_size)))
-    futures0 = matrix_utils.get_matrix_blocks_full_async(X, "/dev/shm/block0_{0}".format(parity), [bidx0], list(range(block_chunk_size)), big_axis=1, executor=executor)
-    futures1 = matrix_utils.get_matrix_blocks_full_async(Y, "/dev/shm/block1_{0}".format(parity), list(range(block_chunk_size)), [bidx1], big_axis=0, executor=executor)
-    assert X._block_idxs(1) == Y._block_idxs(0)
-    chunked_blocks = chunked_blocks[1:]
-    start_x, end_x = X._blocks(0)[bidx0]
-    start_y, end_y = Y._blocks(1)[bidx1]
-    result = np.zeros((end_x - start_x, end_y - start_y), dtype=X.dtype)
-    for blocks in chunked_blocks:
-        t = time.time()
-        fs.wait(futures0)
-        fs.wait(futures1)
-        e = time.time()
-        print("Block Download took effectively {0}".format(e - t))
-        results = [f.result() for f in futures0]
-        b1 = matrix_utils.load_mmap(*results[0])
-        results = [f.result() for f in futures1]
-        b2 = matrix_utils.load_mmap(*results[0])
-        parity = (parity + 1) % 2
-        futures0 = matrix_utils.get_matrix_blocks_full_async(X, "/dev/shm/block0_{0}".format(parity), [bidx0], blocks, big_axis=1, executor=executor)
-        futures1 = matrix_utils.get_matrix_blocks_full_async(Y, "/dev/shm/block1_{0}".format(parity), blocks, [bidx1], big_axis=0, executor=executor)
-        t = time.time()
-        result += b1.dot(b2)
-        e = time.time()
-        print("Block Matmul took effectively {0}".format(e  - t))
-    t = time.time()
-    fs.wait(futures0)
-    fs.wait(futures1)
-    e = time.time()
-    print("Block Download took effectively {0}".format(e - t))
-    results = [f.result() for f in futures0]
-    b1 = matrix_utils.load_mmap(*results[0])
-    results = [f.result() for f in futures1]
-    b2 = matrix_utils.load_mmap(*results[0])
-    t = time.time()
-    result += b1.dot(b2)
-    e = time.time()
-    print("Block Matmul took effectively {0}".format(e  - t))
+    with matrix_utils.PrefetchPipeline(fetch, chunked_blocks, depth=prefetch_depth) as pipeline:
+        for _, (X_chunk, Y_chunk) in pipeline:
+            _accumulate(result, errors, 0, X_chunk.dot(Y_chunk), compensated)
+    result = result[0]
+    if (stats is not None):
+        stats.update(pipeline.stats())
     return result
 
 
-def gemm(pwex, X, Y, out_bucket=None, tasks_per_job=1, local=False, dtype=np.float64, overwrite=True, gemm_impl=0, gemm_chunk_size=16):
+def gemm(pwex, X, Y, out_bucket=None, tasks_per_job=1, local=False, dtype=np.float64, overwrite=True, gemm_impl=0, gemm_chunk_size=16,
+         worker_memory=None, k_splits=1, min_tasks=1, stats=None, epilogue=None, prefetch_depth=2, plan=None,
+         compute_dtype=None, compensated=False, strassen_cutoff=None):
 
     '''
         Compute XY return
@@ -113,22 +430,82 @@ def gemm(pwex, X, Y, out_bucket=None, tasks_per_job=1, local=False, dtype=np.flo
         @param out_bucket - bucket job writes to
         @param num_jobs - how many lambdas to run
         @param local - run locally? #TODO remove once local pywren executor is provided
+        @param dtype - dtype the output is stored in, X and Y are read in the dtype they are stored in
+        @param compute_dtype - dtype blocks are multiplied and accumulated in, defaults to dtype
+        @param compensated - Kahan summation over the reduction dimension, recovers most of
+               the accuracy a low precision accumulator loses on long reductions
+        @param gemm_impl - 0 block by block, 1 whole panels through /dev/shm (standalone pywren only),
+               2 chunks of gemm_chunk_size reduction blocks prefetched prefetch_depth chunks ahead
+        @param worker_memory - if set, each task computes a rectangle of output blocks
+               that fits in this many bytes, see plan_gemm_tiles (overwrite is ignored)
+        @param k_splits - split the reduction dimension into this many ranges whose partial
+               products are summed by a second round of tasks, needs worker_memory
+        @param min_tasks - smallest number of first round tasks the tile planner aims for
+        @param stats - optional dict filled with the predicted and actual bytes moved
+        @param epilogue - GemmEpilogue applied by the workers to every output block,
+               with a reduction the reduced numpy array is returned instead of XY
+        @param plan - planner.GemmPlan, overrides gemm_impl, tasks_per_job, gemm_chunk_size,
+               worker_memory, k_splits and min_tasks and logs its prediction next to the runtime
+        @param strassen_cutoff - if set, multiply with Strassen's recursion until the operands
+               are at most this many blocks on a side, see strassen
+    '''
+    if (strassen_cutoff is not None):
+        if (epilogue is not None or plan is not None):
+            raise Exception("Strassen gemm does not support epilogues or plans")
+        return strassen(pwex, X, Y, out_bucket=out_bucket, cutoff=strassen_cutoff, tasks_per_job=tasks_per_job,
+                        local=local, dtype=dtype, stats=stats, gemm_impl=gemm_impl, gemm_chunk_size=gemm_chunk_size,
+                        worker_memory=worker_memory, k_splits=k_splits, min_tasks=min_tasks,
+                        prefetch_depth=prefetch_depth, compute_dtype=compute_dtype, compensated=compensated)
+    if (plan is not None):
+        if (tuple(plan.shard_sizes) != (X.shard_sizes[0], X.shard_sizes[1], Y.shard_sizes[1])):
+            raise Exception("Plan is for shard sizes {0}, reshard X and Y first".format(plan.shard_sizes))
+        kwargs = plan.gemm_kwargs()
+        start = time.time()
+        XY = gemm(pwex, X, Y, out_bucket=out_bucket, local=local, dtype=dtype, overwrite=overwrite, stats=stats,
+                  epilogue=epilogue, prefetch_depth=prefetch_depth, compute_dtype=compute_dtype,
+                  compensated=compensated, **kwargs)
+        planner.log_plan(plan, time.time() - start)
+        return XY
+    return _gemm_submit(pwex, X, Y, out_bucket=out_bucket, tasks_per_job=tasks_per_job, local=local, dtype=dtype,
+                        overwrite=overwrite, gemm_impl=gemm_impl, gemm_chunk_size=gemm_chunk_size,
+                        worker_memory=worker_memory, k_splits=k_splits, min_tasks=min_tasks, stats=stats,
+                        epilogue=epilogue, prefetch_depth=prefetch_depth, compute_dtype=compute_dtype,
+                        compensated=compensated).result()
+
+def _gemm_submit(pwex, X, Y, out_bucket=None, tasks_per_job=1, local=False, dtype=np.float64, overwrite=True, gemm_impl=0,
+                 gemm_chunk_size=16, worker_memory=None, k_splits=1, min_tasks=1, stats=None, epilogue=None,
+                 prefetch_depth=2, compute_dtype=None, compensated=False):
+    '''
+        Submit the jobs of gemm without waiting for them, returns a _PendingGemm
+        whose result() is what gemm returns. Takes gemm's arguments except plan
+        and strassen_cutoff.
     '''
     # 0 -> 1 or 1 -> 0
 
     reduce_idxs = Y._block_idxs(axis=0)
+    if (compute_dtype is None):
+        compute_dtype = dtype
     if (out_bucket == None):
         out_bucket = X.bucket
 
-    root_key = generate_key_name_binop(X, Y, "gemm")
+    root_key = generate_key_name_binop(X, Y, "gemm" if epilogue is None else "gemm_epilogue")
     if (Y.shard_sizes[0] !=  X.shard_sizes[1]):
         raise Exception("X dim 1 shard size must match Y dim 0 shard size")
-    if (X.key == Y.key and (X.transposed ^ Y.transposed)):
+    # a reducing epilogue never writes the product
+    write_header = epilogue is None or epilogue.reduction is None
+    if (X.key == Y.key and (X.transposed ^ Y.transposed) and epilogue is None):
         XY = BigSymmetricMatrix(root_key, shape=(X.shape[0], X.shape[0]), bucket=out_bucket, shard_sizes=[X.shard_sizes[0], X.shard_sizes[0]], dtype=dtype, write_header=True)
     else:
-        XY = BigMatrix(root_key, shape=(X.shape[0], Y.shape[1]), bucket=out_bucket, shard_sizes=[X.shard_sizes[0], Y.shard_sizes[1]], dtype=dtype, write_header=True)
+        XY = BigMatrix(root_key, shape=(X.shape[0], Y.shape[1]), bucket=out_bucket, shard_sizes=[X.shard_sizes[0], Y.shard_sizes[1]], dtype=dtype, write_header=write_header)
     print(XY.key)
 
+    if (worker_memory is not None):
+        plan = plan_gemm_tiles(X, Y, worker_memory, k_splits=k_splits, min_tasks=min_tasks, dtype=dtype, compute_dtype=compute_dtype,
+                               symmetric=isinstance(XY, BigSymmetricMatrix), epilogue=epilogue)
+        return _gemm_tiled(pwex, XY, X, Y, plan, tasks_per_job=tasks_per_job, local=local, stats=stats, epilogue=epilogue,
+                           compute_dtype=compute_dtype, compensated=compensated)
+    if (k_splits > 1):
+        raise Exception("Splitting the reduction dimension needs worker_memory")
 
     num_out_blocks = len(XY.blocks)
     if (tasks_per_job > num_out_blocks):
@@ -137,86 +514,667 @@ def gemm(pwex, X, Y, out_bucket=None, tasks_per_job=1, local=False, dtype=np.flo
 
     print("Out Shape", XY.shape)
     print("Total number of output blocks", len(XY.block_idxs))
-    print("Total number of output blocks that exist", len(XY.blocks_exist))
+    if (write_header):
+        print("Total number of output blocks that exist", len(XY.blocks_exist))
 
-    if (overwrite):
+    if (overwrite or not write_header):
         block_idxs_to_map = list(set(XY.block_idxs))
     else:
         block_idxs_to_map = list(set(XY.block_idxs_not_exist))
+    # neighbouring output blocks end up in the same job and share input panels
+    block_idxs_to_map = matrix_utils.hilbert_order(block_idxs_to_map)
 
     print("Number of output blocks to generate ", len(block_idxs_to_map))
     chunked_blocks = list(chunk(list(chunk(block_idxs_to_map, tasks_per_job)), num_jobs))
-    if (not isinstance(pwex.invoker, pywren.queues.SQSInvoker) and gemm_impl > 0):
-            raise Exception("GEMM IMPL > 0 only supported for standalone mode pywren")
+    if (gemm_impl == 1 and not isinstance(pwex.invoker, pywren.queues.SQSInvoker)):
+            raise Exception("GEMM IMPL 1 only supported for standalone mode pywren")
 
     print(_gemms[gemm_impl])
     def pywren_run(x):
-        return _gemms[gemm_impl](x, XY, X, Y, reduce_idxs=reduce_idxs, dtype=dtype, block_chunk_size=gemm_chunk_size)
+        return _gemms[gemm_impl](x, XY, X, Y, reduce_idxs=reduce_idxs, compute_dtype=compute_dtype, compensated=compensated,
+                                 block_chunk_size=gemm_chunk_size,
+                                 prefetch_depth=prefetch_depth, epilogue=epilogue)
 
     all_futures = []
     for i, c in enumerate(chunked_blocks):
         print("Submitting job for chunk {0} in axis 0".format(i))
         if (local):
-            list(map(pywren_run, c))
+            all_futures += list(map(pywren_run, c))
         else:
             s = time.time()
             futures = pwex.map(pywren_run, c)
             e = time.time()
             print("Pwex Map Time {0}".format(e - s))
-            all_futures.append((i,futures))
+            all_futures += futures
+
+    def finish(results):
+        if (epilogue is not None and epilogue.reduction is not None):
+            return epilogue.combine(XY, dict([p for _, _, reduced in results for p in reduced]))
+        return XY
+
+    return _PendingGemm(all_futures, finish, local=local)
+
+class _BlockView(BigMatrix):
+    '''
+        rows x cols blocks of parent starting at block (row, col), reads and
+        writes go to the parent's blocks. All blocks must be full.
+    '''
+    def __init__(self, parent, row, col, rows, cols):
+        self.parent = parent
+        self.offset = (row, col)
+        self.bucket = parent.bucket
+        self.prefix = parent.prefix
+        self.key = "{0}_view_{1}_{2}_{3}_{4}".format(str(parent), row, col, rows, cols)
+        self.key_base = os.path.join(self.prefix, self.key)
+        self.dtype = parent.dtype
+        self.transposed = False
+        self.parent_fn = None
+        self.symmetric = False
+        self.shard_sizes = list(parent.shard_sizes)
+        self.shape = (rows*self.shard_sizes[0], cols*self.shard_sizes[1])
 
+    def get_block(self, *block_idx):
+        return self.parent.get_block(block_idx[0] + self.offset[0], block_idx[1] + self.offset[1])
+
+    def put_block(self, block, *block_idx):
+        return self.parent.put_block(block, block_idx[0] + self.offset[0], block_idx[1] + self.offset[1])
+
+def _quadrants(X):
+    n0 = len(X._block_idxs(0))//2
+    n1 = len(X._block_idxs(1))//2
+    return [[_BlockView(X, 0, 0, n0, n1), _BlockView(X, 0, n1, n0, n1)],
+            [_BlockView(X, n0, 0, n0, n1), _BlockView(X, n0, n1, n0, n1)]]
+
+def _strassen_remote_sum(items, **kwargs):
+    '''
+        Write linear combinations of blocks
+        @param items - list of (out, terms, i, j), block (i, j) of out is set to
+               the sum of coefficient*matrix.get_block(i, j) over the (coefficient, matrix) terms
+        returns bytes read and written
+    '''
+    bytes_read = 0
+    bytes_written = 0
+    for out, terms, i, j in items:
+        block = None
+        for coefficient, X in terms:
+            X_block = X.get_block(i, j)
+            bytes_read += X_block.nbytes
+            X_block = X_block if coefficient == 1 else coefficient*X_block
+            block = X_block if block is None else block + X_block
+        out.put_block(block, i, j)
+        bytes_written += block.size*np.dtype(out.dtype).itemsize
+    return bytes_read, bytes_written
+
+def _strassen_sums(pwex, sums, tasks_per_job=1, local=False):
+    ''' Compute every (out, terms) linear combination, one task per tasks_per_job blocks '''
+    items = [(out, terms, i, j) for out, terms in sums for i, j in out._block_idxs()]
+    chunked_items = list(chunk(items, tasks_per_job))
     if (local):
+        results = list(map(_strassen_remote_sum, chunked_items))
+    else:
+        results = matrix_utils.wait_all(pwex.map(_strassen_remote_sum, chunked_items))
+    return sum([r for r, _ in results]), sum([w for _, w in results])
+
+def _strassen_splits(X, Y, cutoff):
+    ''' Can X Y be split into 2 x 2 quadrants of whole square blocks '''
+    n = len(X._block_idxs(0))
+    if (n <= cutoff or n % 2 != 0):
+        return False
+    if (X.shape[0] != X.shape[1] or tuple(X.shape) != tuple(Y.shape)):
+        return False
+    shard_size = X.shard_sizes[0]
+    if (list(X.shard_sizes) != [shard_size, shard_size] or list(Y.shard_sizes) != [shard_size, shard_size]):
+        return False
+    return X.shape[0] % shard_size == 0
+
+# M_i = (sum of A quadrants)(sum of B quadrants) and C quadrants as sums of M_i
+_STRASSEN_PRODUCTS = [([(1, 0, 0), (1, 1, 1)], [(1, 0, 0), (1, 1, 1)]),
+                      ([(1, 1, 0), (1, 1, 1)], [(1, 0, 0)]),
+                      ([(1, 0, 0)], [(1, 0, 1), (-1, 1, 1)]),
+                      ([(1, 1, 1)], [(1, 1, 0), (-1, 0, 0)]),
+                      ([(1, 0, 0), (1, 0, 1)], [(1, 1, 1)]),
+                      ([(1, 1, 0), (-1, 0, 0)], [(1, 0, 0), (1, 0, 1)]),
+                      ([(1, 0, 1), (-1, 1, 1)], [(1, 1, 0), (1, 1, 1)])]
+_STRASSEN_OUTPUTS = [(0, 0, [(1, 0), (1, 3), (-1, 4), (1, 6)]),
+                     (0, 1, [(1, 2), (1, 4)]),
+                     (1, 0, [(1, 1), (1, 3)]),
+                     (1, 1, [(1, 0), (-1, 1), (1, 2), (1, 5)])]
+
+def _strassen(pwex, X, Y, cutoff, level, stats, out_bucket=None, tasks_per_job=1, local=False, dtype=np.float64, **gemm_kwargs):
+    ''' Submit the products of XY, returns a _PendingGemm whose result() is XY '''
+    if (not _strassen_splits(X, Y, cutoff)):
+        stats["leaf_products"] += 1
+        stats["levels"] = max(stats["levels"], level)
+        return _gemm_submit(pwex, X, Y, out_bucket=out_bucket, tasks_per_job=tasks_per_job, local=local, dtype=dtype,
+                            **gemm_kwargs)
+    if (out_bucket is None):
+        out_bucket = X.bucket
+    X_quadrants = _quadrants(X)
+    Y_quadrants = _quadrants(Y)
+    half = (X.shape[0]//2, X.shape[1]//2)
+
+    def operand(terms, quadrants, name):
+        if (len(terms) == 1 and terms[0][0] == 1):
+            return quadrants[terms[0][1]][terms[0][2]], None
+        S = BigMatrix(generate_key_name_binop(X, Y, name), shape=half, bucket=out_bucket,
+                      shard_sizes=X.shard_sizes, dtype=dtype, write_header=True)
+        return S, (S, [(c, quadrants[i][j]) for c, i, j in terms])
+
+    operands = []
+    operand_sums = []
+    for m, (X_terms, Y_terms) in enumerate(_STRASSEN_PRODUCTS):
+        S, S_sum = operand(X_terms, X_quadrants, "strassen_S{0}".format(m))
+        T, T_sum = operand(Y_terms, Y_quadrants, "strassen_T{0}".format(m))
+        operands.append((S, T))
+        operand_sums += [x for x in [S_sum, T_sum] if x is not None]
+    # the operand sums of all 7 products are one round of tasks
+    r, w = _strassen_sums(pwex, operand_sums, tasks_per_job=tasks_per_job, local=local)
+    stats["temp_read_bytes"] += r
+    stats["temp_write_bytes"] += w
+    # every product is submitted before any of them is waited for
+    pending = [_strassen(pwex, S, T, cutoff, level + 1, stats, out_bucket=out_bucket,
+                         tasks_per_job=tasks_per_job, local=local, dtype=dtype, **gemm_kwargs)
+               for S, T in operands]
+
+    def finish(results):
+        products = [p.result() for p in pending]
+        [x.delete() for x, _ in operand_sums]
+        XY = BigMatrix(generate_key_name_binop(X, Y, "strassen"), shape=(X.shape[0], Y.shape[1]), bucket=out_bucket,
+                       shard_sizes=X.shard_sizes, dtype=dtype, write_header=True)
+        XY_quadrants = _quadrants(XY)
+        sums = [(XY_quadrants[i][j], [(c, products[m]) for c, m in terms]) for i, j, terms in _STRASSEN_OUTPUTS]
+        r, w = _strassen_sums(pwex, sums, tasks_per_job=tasks_per_job, local=local)
+        stats["temp_read_bytes"] += r
+        stats["temp_write_bytes"] += w
+        [M.delete() for M in products]
         return XY
 
-    for i, futures, in all_futures:
-        print("waiting")
-        pywren.wait(futures)
-        [f.result() for f in futures]
+    return _PendingGemm([], finish)
 
+def strassen(pwex, X, Y, out_bucket=None, cutoff=1, tasks_per_job=1, local=False, dtype=np.float64, stats=None, **gemm_kwargs):
+    '''
+        Compute XY with Strassen's recursion, 7 half size products per level instead of 8
+        @param pwex - Execution context
+        @param X - rhs matrix
+        @param Y - lhs matrix
+        @param out_bucket - bucket job writes to
+        @param cutoff - operands at most this many blocks on a side are multiplied by gemm,
+               as are operands that are not square, have non square blocks, partial blocks
+               or an odd number of blocks on a side
+        @param tasks_per_job - number of blocks per task for the quadrant sums, passed on to gemm
+        @param dtype - dtype of the output and of the temporary operand sums and products
+        @param stats - optional dict filled with the recursion depth, number of gemm calls
+               and bytes moved by the quadrant sums
+        @param gemm_kwargs - passed on to gemm for the products below the cutoff
+        Every level adds 18 quadrant sums that are stored as temporary BigMatrices and
+        deleted once consumed. The 7 products of a level are submitted together before
+        any is waited for, so the operand sums of a level are all stored until its
+        products are done. The error bound grows by a constant factor per level over
+        the classic product, see benchmarks/strassen_gemm.py.
+    '''
+    if (X.shape[1] != Y.shape[0]):
+        raise Exception("X dim 1 must match Y dim 0")
+    strassen_stats = {"levels": 0, "leaf_products": 0, "temp_read_bytes": 0, "temp_write_bytes": 0}
+    XY = _strassen(pwex, X, Y, cutoff, 0, strassen_stats, out_bucket=out_bucket, tasks_per_job=tasks_per_job,
+                   local=local, dtype=dtype, **gemm_kwargs).result()
+    print("Strassen levels {0}, {1} gemm calls, {2} bytes read and {3} written by quadrant sums".format(
+        strassen_stats["levels"], strassen_stats["leaf_products"],
+        strassen_stats["temp_read_bytes"], strassen_stats["temp_write_bytes"]))
+    if (stats is not None):
+        stats.update(strassen_stats)
     return XY
 
+
+# X's blocks kept by long lived workers between gemv calls
+_GEMV_CACHE = matrix_utils.BlockCache()
+
+def _gemv_remote(rows, X, y, cache_bytes=None, partials=None, dtype=None, **kwargs):
+    '''
+        Multiply row blocks of X by the matching rows of the vector(s)
+        @param rows - list of (i, c, ks), row block i of X restricted to column blocks ks,
+               the c-th chunk of X's column blocks
+        @param y - vector(s) as a numpy array or a BigMatrix, only the rows matching
+               ks are read
+        @param cache_bytes - if set, X's blocks are served from and kept in a worker local
+               cache of this many bytes, X must not change while cached
+        @param partials - if set, the product of chunk c is written to block i of partials[c]
+               instead of being returned
+        @param dtype - if set, the rows of y are cast to this dtype
+        returns the (i, partial product) pairs, bytes read and cache hits
+    '''
+    bytes_read = 0
+    cache_hits = 0
+    if (cache_bytes is not None):
+        _GEMV_CACHE.max_bytes = cache_bytes
+        _GEMV_CACHE.set_scope((X.bucket, X.key_base, X.transposed))
+    y_blocks = {}
+    results = []
+    for i, c, ks in rows:
+        partial = None
+        for k in ks:
+            X_block = _GEMV_CACHE.get(X, i, k) if cache_bytes is not None else None
+            if (X_block is None):
+                X_block = X.get_block(i, k)
+                bytes_read += X_block.nbytes
+                if (cache_bytes is not None):
+                    _GEMV_CACHE.put(X_block, X, i, k)
+            else:
+                cache_hits += 1
+            start = k*X.shard_sizes[1]
+            ranges = [(start, start + X_block.shape[1])] + [(0, n) for n in y.shape[1:]]
+            y_region, region_bytes = _read_region(y, ranges, y_blocks)
+            bytes_read += region_bytes
+            if (dtype is not None):
+                y_region = y_region.astype(dtype, copy=False)
+            block = X_block.dot(y_region)
+            partial = block if partial is None else partial + block
+        if (partials is None):
+            results.append((i, partial))
+        else:
+            partial = partial.astype(partials[c].dtype, copy=False)
+            partials[c].put_block(partial, *([i] + [0 for _ in y.shape[1:]]))
+    return results, bytes_read, cache_hits
+
+def _gemv_remote_reduce(groups, level, next_level, **kwargs):
+    '''
+        One level of the gemv reduction tree
+        @param groups - list of (i, g, members), block i of next_level[g] is set to the
+               sum of block i of the matrices level[m] for m in members, added in order
+        returns bytes read and written
+    '''
+    bytes_read = 0
+    bytes_written = 0
+    for i, g, members in groups:
+        bidx = [i] + [0 for _ in next_level[g].shape[1:]]
+        block = None
+        for m in members:
+            member = level[m].get_block(*bidx)
+            bytes_read += member.nbytes
+            block = member if block is None else block + member
+        block = block.astype(next_level[g].dtype, copy=False)
+        next_level[g].put_block(block, *bidx)
+        bytes_written += block.nbytes
+        [level[m].delete_block(*bidx) for m in members]
+    return bytes_read, bytes_written
+
+def _tree_sum(blocks, arity=2):
+    ''' Sum blocks level by level, arity at a time, returns the sum and the number of levels '''
+    if (arity < 2):
+        raise Exception("The tree arity must be at least 2")
+    levels = 0
+    while (len(blocks) > 1):
+        blocks = [sum(group[1:], group[0]) for group in chunk(blocks, arity)]
+        levels += 1
+    return blocks[0], levels
+
+def _gemv_tree(pwex, XY, partials, arity, tasks_per_job=1, local=False):
+    '''
+        Sum the partial products into XY with a tree of remote tasks, in the
+        order _tree_sum adds them. Every level is one round of tasks that each
+        hold arity blocks, consumed partials are deleted.
+        returns the number of levels, bytes read and written
+    '''
+    if (arity < 2):
+        raise Exception("The tree arity must be at least 2")
+    row_idxs = XY._block_idxs(0)
+    level = partials
+    levels = 0
+    read_bytes = 0
+    write_bytes = 0
+    while (len(level) > 1):
+        groups = list(chunk(list(range(len(level))), arity))
+        if (len(groups) == 1):
+            next_level = [XY]
+        else:
+            next_level = [BigMatrix(generate_key_name_binop(XY, level[group[0]], "gemv_tree_{0}".format(levels)),
+                                    shape=XY.shape, bucket=XY.bucket, shard_sizes=XY.shard_sizes,
+                                    dtype=partials[0].dtype, write_header=True) for group in groups]
+        items = [(i, g, group) for g, group in enumerate(groups) for i in row_idxs]
+        chunked_items = list(chunk(items, tasks_per_job))
+        def pywren_run(x):
+            return _gemv_remote_reduce(x, level, next_level)
+        if (local):
+            results = list(map(pywren_run, chunked_items))
+        else:
+            results = matrix_utils.wait_all(pwex.map(pywren_run, chunked_items))
+        read_bytes += sum([r for r, _ in results])
+        write_bytes += sum([w for _, w in results])
+        [M.delete() for M in level]
+        level = next_level
+        levels += 1
+    return levels, read_bytes, write_bytes
+
 # matrix vector multiply
-# hard
-def gemv(pwex, X, Y, out_bucket=None, tasks_per_job=1):
-    raise NotImplementedError
+def gemv(pwex, X, Y, out_bucket=None, tasks_per_job=1, local=False, dtype=np.float64, arity=2,
+         cache=False, cache_bytes=2**29, inline_bytes=2**20, driver_bytes=2**28, stats=None):
+    '''
+        Compute XY for a vector or a few vectors Y
+        @param pwex - Execution context
+        @param X - matrix, streamed through the workers a row block at a time
+        @param Y - numpy array of shape (n,) or (n, v), or a BigMatrix of that shape
+        @param out_bucket - bucket the product is written to when Y is a BigMatrix
+        @param tasks_per_job - number of X blocks per task, the partial products of the
+               tasks of a row block are summed by a reduction tree
+        @param dtype - dtype of the product
+        @param arity - children per node of the reduction tree
+        @param cache - keep X's blocks in the memory of long lived workers (standalone
+               pywren, warm lambdas) so repeated calls against the same X skip the reads
+        @param cache_bytes - size of the worker cache
+        @param inline_bytes - vectors up to this size travel with the tasks, larger ones
+               are stored once as a single object every task reads
+        @param driver_bytes - partial products up to this size come back with the futures
+               and are summed on the driver
+        @param stats - optional dict filled with the bytes read, cache hits, tree levels
+               and whether the tree ran remotely
+        Returns a numpy array if Y is one, a BigMatrix otherwise. A BigMatrix Y is never
+        gathered on the driver, tasks read the rows of it they need, and its product is
+        summed by a tree of remote tasks that write XY. So are the partial products of a
+        numpy Y when they exceed driver_bytes. Both trees add in a fixed order, repeated
+        calls give bit identical results.
+    '''
+    if (not isinstance(Y, BigMatrix)):
+        Y = np.asarray(Y)
+    if (Y.shape[0] != X.shape[1]):
+        raise Exception("X dim 1 must match Y dim 0")
+    out_shape = (X.shape[0],) + tuple(Y.shape[1:])
+    y = Y
+    y_name = Y
+    y_object = None
+    if (not isinstance(Y, BigMatrix)):
+        y = Y.astype(dtype, copy=False)
+        y_name = "gemv_vector_{0}".format(matrix_utils.hash_array(y))
+        if (y.nbytes > inline_bytes):
+            y_object = BigMatrix(y_name, shape=y.shape, bucket=X.bucket, shard_sizes=list(y.shape), dtype=dtype)
+            y_object.put_block(y, *[0 for _ in y.shape])
+
+    row_idxs = X._block_idxs(0)
+    col_idxs = X._block_idxs(1)
+    col_chunks = list(chunk(col_idxs, max(tasks_per_job, 1)))
+    rows = [(i, c, ks) for i in row_idxs for c, ks in enumerate(col_chunks)]
+    partial_dtype = np.result_type(X.dtype, dtype)
+    partial_bytes = len(col_chunks)*int(np.prod(out_shape))*np.dtype(partial_dtype).itemsize
+    remote = isinstance(Y, BigMatrix) or partial_bytes > driver_bytes
+
+    XY = None
+    partials = None
+    if (remote):
+        if (out_bucket is None):
+            out_bucket = X.bucket
+        shard_sizes = [X.shard_sizes[0]] + list(out_shape[1:])
+        XY = BigMatrix(generate_key_name_binop(X, y_name, "gemv"), shape=out_shape, bucket=out_bucket,
+                       shard_sizes=shard_sizes, dtype=dtype, write_header=True)
+        if (len(col_chunks) == 1):
+            partials = [XY]
+        else:
+            partials = [BigMatrix(generate_key_name_binop(X, y_name, "gemv_partial_{0}".format(c)), shape=out_shape,
+                                  bucket=out_bucket, shard_sizes=shard_sizes, dtype=partial_dtype, write_header=True)
+                        for c in range(len(col_chunks))]
+    def pywren_run(x):
+        return _gemv_remote([x], X, y if y_object is None else y_object, cache_bytes=cache_bytes if cache else None,
+                            partials=partials, dtype=dtype)
+    if (local):
+        results = list(map(pywren_run, rows))
+    else:
+        results = matrix_utils.wait_all(pwex.map(pywren_run, rows))
+    if (y_object is not None):
+        y_object.delete_block(*[0 for _ in y.shape])
+    read_bytes = sum([r for _, r, _ in results])
+    cache_hits = sum([h for _, _, h in results])
+
+    levels = 0
+    tree_read_bytes = 0
+    if (remote):
+        levels, tree_read_bytes, _ = _gemv_tree(pwex, XY, partials, arity, tasks_per_job=tasks_per_job, local=local)
+    else:
+        partials = dict([(i, []) for i in row_idxs])
+        for row_partials, _, _ in results:
+            for i, partial in row_partials:
+                partials[i].append(partial)
+        out_blocks = []
+        for i in row_idxs:
+            block, row_levels = _tree_sum(partials[i], arity)
+            levels = max(levels, row_levels)
+            out_blocks.append(block.astype(dtype, copy=False))
+    print("gemv {0} tasks, {1} bytes read, {2} cache hits, {3} tree levels".format(len(rows), read_bytes, cache_hits, levels))
+    if (stats is not None):
+        stats.update({"tasks": len(rows), "read_bytes": read_bytes, "cache_hits": cache_hits, "levels": levels,
+                      "remote_reduce": remote, "tree_read_bytes": tree_read_bytes})
+    if (isinstance(Y, BigMatrix)):
+        return XY
+    if (remote):
+        # the caller asked for a numpy result, only the product itself is gathered
+        result = XY.numpy()
+        XY.delete()
+        return result
+    return np.concatenate(out_blocks)
+
+def gemv_many(pwex, X, Ys, **kwargs):
+    '''
+        X times every vector of Ys with a single pass over X
+        @param Ys - list of numpy vectors of length X.shape[1]
+        @param kwargs - passed on to gemv
+        returns the list of products
+    '''
+    XY = gemv(pwex, X, np.stack([np.asarray(y) for y in Ys], axis=1), **kwargs)
+    return [XY[:, j] for j in range(XY.shape[1])]
 
 # symmetric rank k update
 # hard
 def syrk(pwex, X, Y, out_bucket=None, tasks_per_job=1):
     raise NotImplementedError
 
-# very hard
-def posv(pwex, X, Y, out_bucket=None, tasks_per_job=1):
-    raise NotImplementedError
+def trsm(pwex, L, B, lower=True, transpose=False, out_bucket=None, tasks_per_job=1, fusion_granularity=1):
+    '''
+        Solve op(L) X = B for triangular L, return X
+        @param pwex - Execution context
+        @param L - triangular matrix with square blocks
+        @param B - right hand sides, rows sharded like L
+        @param lower - L is lower triangular, only that triangle is read
+        @param transpose - solve with L^T instead of L
+        @param out_bucket - bucket job writes to
+    '''
+    instructions, X, trailing = lp._trsm(L, B, lower=lower, transpose=transpose, out_bucket=out_bucket)
+    program = uops._run_program(pwex, instructions, [X], fusion_granularity=fusion_granularity)
+    if (not program.garbage_collect):
+        [t.free() for t in trailing]
+    return X
+
+def posv(pwex, X, Y, out_bucket=None, tasks_per_job=1, fusion_granularity=1):
+    '''
+        Solve X Z = Y for symmetric positive definite X, return Z
+        @param pwex - Execution context
+        @param X - symmetric positive definite matrix
+        @param Y - right hand sides, rows sharded like X
+        @param out_bucket - bucket job writes to
+    '''
+    # cholesky and both substitutions run as one program, each solve
+    # starts on a block as soon as the factors it needs are written
+    chol_instructions, L, chol_trailing = lp._chol(X, out_bucket=out_bucket)
+    forward_instructions, W, forward_trailing = lp._trsm(L, Y, lower=True, transpose=False, out_bucket=out_bucket)
+    back_instructions, Z, back_trailing = lp._trsm(L, W, lower=True, transpose=True, out_bucket=out_bucket)
+    program = uops._run_program(pwex, chol_instructions + forward_instructions + back_instructions, [Z],
+                                fusion_granularity=fusion_granularity)
+    if (not program.garbage_collect):
+        [t.free() for t in chol_trailing[1:] + [L, W] + forward_trailing + back_trailing]
+    return Z
+
+
+
+
+def _broadcast_shape(*shapes):
+    ''' NumPy broadcasting of shapes, trailing axes are aligned and extents of 1 stretch '''
+    ndim = max([len(shape) for shape in shapes])
+    out = []
+    for a in range(ndim):
+        extents = set([shape[a - ndim + len(shape)] for shape in shapes if a - ndim + len(shape) >= 0])
+        extents.discard(1)
+        if (len(extents) > 1):
+            raise Exception("Shapes {0} can not be broadcast together".format(shapes))
+        out.append(extents.pop() if len(extents) > 0 else 1)
+    return tuple(out)
 
+def _operand_ranges(shape, ranges):
+    ''' The part of an operand of the given shape broadcast against the output ranges '''
+    ranges = ranges[len(ranges) - len(shape):]
+    return [(0, 1) if n == 1 else r for n, r in zip(shape, ranges)]
 
+def _read_region(M, ranges, blocks):
+    '''
+        Elements ranges of M, assembled from every block of M they overlap
+        @param blocks - blocks of M already read by this task, updated in place
+        returns the region and the bytes read
+    '''
+    if (not isinstance(M, BigMatrix)):
+        return M[tuple([slice(s, e) for s, e in ranges])], 0
+    axis_blocks = [list(range(s//shard, (e - 1)//shard + 1)) for (s, e), shard in zip(ranges, M.shard_sizes)]
+    bytes_read = 0
+    region = None
+    for bidx in itertools.product(*axis_blocks):
+        key = (id(M), bidx)
+        if (key not in blocks):
+            blocks[key] = M.get_block(*bidx)
+            bytes_read += blocks[key].nbytes
+        block = blocks[key]
+        starts = [b*shard for b, shard in zip(bidx, M.shard_sizes)]
+        if (all([s == start and e - s == n for (s, e), start, n in zip(ranges, starts, block.shape)])):
+            # the region is exactly this block
+            return block, bytes_read
+        if (region is None):
+            region = np.empty([e - s for s, e in ranges], dtype=block.dtype)
+        src = []
+        dst = []
+        for (s, e), start, n in zip(ranges, starts, block.shape):
+            lo, hi = max(s, start), min(e, start + n)
+            src.append(slice(lo - start, hi - start))
+            dst.append(slice(lo - s, hi - s))
+        region[tuple(dst)] = block[tuple(src)]
+    return region, bytes_read
+
+def _elemwise_remote(block_idxs, out, X, Y, f, **kwargs):
+    '''
+        Compute and write a batch of output blocks of f(X, Y)
+        returns bytes read and written
+    '''
+    bytes_read = 0
+    bytes_written = 0
+    blocks = {}
+    for bidx in block_idxs:
+        ranges = [(s, e) for s, e in out.__block_idx_to_real_idx__(bidx)]
+        operands = []
+        for M in [X, Y]:
+            operand, size = _read_region(M, _operand_ranges(M.shape, ranges), blocks)
+            operands.append(operand)
+            bytes_read += size
+        block = np.broadcast_to(f(*operands), [e - s for s, e in ranges])
+        out.put_block(block, *bidx)
+        bytes_written += block.size*np.dtype(out.dtype).itemsize
+    return bytes_read, bytes_written
 
+def _operand_name(M):
+    if (isinstance(M, BigMatrix)):
+        return M
+    if (np.ndim(M) == 0):
+        return str(M)
+    return "array_{0}".format(matrix_utils.hash_array(M))
 
 # easy
-def add(pwex, X, Y, out_bucket=None, tasks_per_job=1):
-    raise NotImplementedError
+def add(pwex, X, Y, out_bucket=None, tasks_per_job=1, **kwargs):
+    return elemwise_binop_func(pwex, X, Y, np.add, out_bucket=out_bucket, tasks_per_job=tasks_per_job, **kwargs)
 
 # easy
-def sub(pwex, X, Y, out_bucket=None, tasks_per_job=1):
-    raise NotImplementedError
+def sub(pwex, X, Y, out_bucket=None, tasks_per_job=1, **kwargs):
+    return elemwise_binop_func(pwex, X, Y, np.subtract, out_bucket=out_bucket, tasks_per_job=tasks_per_job, **kwargs)
 
 # easy
-def mul(pwex, X, Y, out_bucket=None, tasks_per_job=1):
-    raise NotImplementedError
+def mul(pwex, X, Y, out_bucket=None, tasks_per_job=1, **kwargs):
+    return elemwise_binop_func(pwex, X, Y, np.multiply, out_bucket=out_bucket, tasks_per_job=tasks_per_job, **kwargs)
 
 # easy
-def div(pwex, X, Y, out_bucket=None, tasks_per_job=1):
-    raise NotImplementedError
+def div(pwex, X, Y, out_bucket=None, tasks_per_job=1, **kwargs):
+    return elemwise_binop_func(pwex, X, Y, np.true_divide, out_bucket=out_bucket, tasks_per_job=tasks_per_job, **kwargs)
 
-def logical_and(pwex, X, Y, out_bucket=None, tasks_per_job=1):
-    raise NotImplementedError
+def logical_and(pwex, X, Y, out_bucket=None, tasks_per_job=1, **kwargs):
+    return elemwise_binop_func(pwex, X, Y, np.logical_and, out_bucket=out_bucket, tasks_per_job=tasks_per_job, **kwargs)
 
-def logical_or(pwex, X, Y, out_bucket=None, tasks_per_job=1):
-    raise NotImplementedError
+def logical_or(pwex, X, Y, out_bucket=None, tasks_per_job=1, **kwargs):
+    return elemwise_binop_func(pwex, X, Y, np.logical_or, out_bucket=out_bucket, tasks_per_job=tasks_per_job, **kwargs)
 
-def xor(pwex, X, Y, out_bucket=None, tasks_per_job=1):
-    raise NotImplementedError
+def xor(pwex, X, Y, out_bucket=None, tasks_per_job=1, **kwargs):
+    return elemwise_binop_func(pwex, X, Y, np.logical_xor, out_bucket=out_bucket, tasks_per_job=tasks_per_job, **kwargs)
 
-def elemwise_binop_func(pwex, X, Y, f, out_bucket=None, tasks_per_job=1, local=False):
-    raise NotImplementedError
+def elemwise_binop_func(pwex, X, Y, f, out_bucket=None, tasks_per_job=1, local=False, out=None, profile=None, stats=None):
+    '''
+        Compute f(X, Y) block by block with NumPy broadcasting
+        @param pwex - Execution context
+        @param X - BigMatrix, numpy array or scalar
+        @param Y - BigMatrix, numpy array or scalar, at least one of X and Y is a BigMatrix.
+               Shapes broadcast like numpy's, so row (1, n) or (n,) and column (m, 1)
+               vectors stretch over the other operand, and the two may be sharded differently
+        @param f - binary ufunc, or any function of two broadcastable numpy arrays
+        @param out_bucket - bucket job writes to
+        @param tasks_per_job - output blocks per task, raise it for small blocks so the
+               per task overhead is spread over more bytes
+        @param out - BigMatrix to write the result to, e.g. X to compute in place. It must
+               have the output shape, and an operand stored under the same key must be
+               read block for block with the same shard sizes and orientation
+        @param profile - planner.ExecutorProfile, the achieved bandwidth is reported against
+               the object store bandwidth of its workers
+        @param stats - optional dict filled with the bytes moved and the achieved bandwidth
+        Output blocks follow the shard sizes of the first operand that spans each axis.
+        Blocks of an operand are read once per task however many output blocks they cover.
+    '''
+    X, Y = [M if isinstance(M, BigMatrix) else np.asarray(M) for M in [X, Y]]
+    matrices = [M for M in [X, Y] if isinstance(M, BigMatrix)]
+    if (len(matrices) == 0):
+        raise Exception("At least one operand must be a BigMatrix")
+    out_shape = _broadcast_shape(tuple(X.shape), tuple(Y.shape))
+    shard_sizes = []
+    for a, n in enumerate(out_shape):
+        shard_size = None
+        for M in matrices:
+            b = a - len(out_shape) + len(M.shape)
+            if (b >= 0 and M.shape[b] == n):
+                shard_size = M.shard_sizes[b]
+                break
+        shard_sizes.append(shard_size if shard_size is not None else max([max(M.shard_sizes) for M in matrices]))
+    out_dtype = np.asarray(f(np.ones(1, dtype=X.dtype), np.ones(1, dtype=Y.dtype))).dtype
+    if (out is None):
+        if (out_bucket is None):
+            out_bucket = matrices[0].bucket
+        op = getattr(f, "__name__", "elemwise")
+        out = BigMatrix(generate_key_name_binop(_operand_name(X), _operand_name(Y), op), shape=out_shape,
+                        bucket=out_bucket, shard_sizes=shard_sizes, dtype=out_dtype, write_header=True)
+    else:
+        if (tuple(out.shape) != out_shape):
+            raise Exception("out has shape {0}, the result has shape {1}".format(tuple(out.shape), out_shape))
+        for M in matrices:
+            if (M.key == out.key and M.bucket == out.bucket and
+                    (M.transposed != out.transposed or list(M.shard_sizes) != list(out.shard_sizes) or tuple(M.shape) != out_shape)):
+                raise Exception("{0} can not be computed in place into {1}".format(M, out))
 
+    block_idxs = sorted(out.block_idxs)
+    chunked_blocks = list(chunk(block_idxs, max(tasks_per_job, 1)))
+    def pywren_run(x):
+        return _elemwise_remote(x, out, X, Y, f)
+    start = time.time()
+    if (local):
+        results = list(map(pywren_run, chunked_blocks))
+    else:
+        results = matrix_utils.wait_all(pwex.map(pywren_run, chunked_blocks))
+    seconds = time.time() - start
+    read_bytes = sum([r for r, _ in results])
+    write_bytes = sum([w for _, w in results])
+    gbytes_per_second = (read_bytes + write_bytes)/seconds/1e9 if seconds > 0 else 0.0
+    report = {"tasks": len(chunked_blocks), "read_bytes": read_bytes, "write_bytes": write_bytes,
+              "seconds": seconds, "gbytes_per_second": gbytes_per_second}
+    if (profile is not None):
+        ceiling = profile.gbytes_per_second*min(profile.workers, len(chunked_blocks))
+        report["ceiling_gbytes_per_second"] = ceiling
+        report["efficiency"] = gbytes_per_second/ceiling
+        print("{0}: {1:.3f} GB/s of a {2:.3f} GB/s object store ceiling ({3:.0%})".format(
+            out, gbytes_per_second, ceiling, report["efficiency"]))
+    else:
+        print("{0}: {1} bytes read, {2} written, {3:.3f} GB/s".format(out, read_bytes, write_bytes, gbytes_per_second))
+    if (stats is not None):
+        stats.update(report)
+    return out
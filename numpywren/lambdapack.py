@@ -1,10 +1,11 @@
 import numpywren
 import numpywren.matrix
 from .matrix import BigMatrix, BigSymmetricMatrix, Scalar
-from .matrix_utils import load_mmap, chunk, generate_key_name_uop, constant_zeros
+from .matrix_utils import load_mmap, chunk, generate_key_name_uop, generate_key_name_binop, constant_zeros
 import numpy as np
 import pywren
-from numpywren import matrix_utils, uops
+from numpywren import matrix_utils, uops, trace
+from numpywren.local import LocalExecutor
 import pytest
 import numpy as np
 import pywren
@@ -18,7 +19,16 @@ import hashlib
 import copy
 import concurrent.futures as fs
 import sys
+import os
 import botocore
+import cloudpickle
+import collections
+import scipy.linalg
+import scipy.linalg.blas
+import scipy.linalg.lapack
+import functools
+import itertools
+import pickle
 
 try:
   DEFAULT_CONFIG = wc.default()
@@ -26,20 +36,14 @@ except:
   DEFAULT_CONFIG = {}
 
 
-class LocalExecutor(object):
-  def __init__(self, procs=32, config=DEFAULT_CONFIG):
-    self.procs = procs
-    self.executor = fs.ThreadPoolExecutor(max_workers=procs)
-    self.config = DEFAULT_CONFIG
+class _DoneFuture(object):
+  ''' Result of an instruction block run inline by its parent, unlike
+      concurrent.futures.Future it survives being pickled back to the driver '''
+  def __init__(self, value):
+    self.value = value
 
-  def call_async(self, f, *args, **kwargs):
-    return self.executor.submit(f, *args, **kwargs)
-
-  def map(self, f, arg_list, **kwargs):
-    futures = []
-    for a in arg_list:
-      futures.append(self.call_async(f, a))
-    return futures
+  def result(self, timeout=None):
+    return self.value
 
 class RemoteInstructionOpCodes(Enum):
     S3_LOAD = 0
@@ -73,28 +77,35 @@ class RemoteProgramState(object):
     assert isinstance(value, int)
     item = self.key.copy()
     item["val"] = {"N": str(value)}
-    client = boto3.client('dynamodb', region_name='us-west-2')
+    client = matrix_utils.get_dynamodb_client()
+    t = time.time()
     client.put_item(TableName=self.table_name, Item=item)
+    trace.record_state_op(time.time() - t)
 
   def get(self):
-    client = boto3.client('dynamodb', region_name='us-west-2')
+    client = matrix_utils.get_dynamodb_client()
+    t = time.time()
     resp = client.get_item(TableName=self.table_name, Key=self.key, ConsistentRead=True)
+    trace.record_state_op(time.time() - t)
     if "Item" in resp.keys():
       return int(resp["Item"]["val"]["N"])
     else:
       return None
 
   def incr(self, inc=1):
-    client = boto3.client('dynamodb', region_name='us-west-2')
+    client = matrix_utils.get_dynamodb_client()
     assert isinstance(inc, int)
     done = False
     while (not done):
+      t = time.time()
       try:
         old_val = self.get()
+        t = time.time()
         if (old_val is None):
           update_value = {":newval":{"N":str(inc)}}
           update = "ADD val :newval"
-          cond = "attribute_not_exists(Id)"
+          # the key attribute always exists, only a missing val means nobody incremented yet
+          cond = "attribute_not_exists(val)"
           client.update_item(TableName=self.table_name, Key=self.key, UpdateExpression=update, ExpressionAttributeValues=update_value, ConditionExpression=cond)
           final_val = inc
           done = True
@@ -110,8 +121,58 @@ class RemoteProgramState(object):
         # other exceptions.
         if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
           raise
+      finally:
+        trace.record_state_op(time.time() - t)
     return final_val
 
+  def max(self, value):
+    ''' Raise the stored integer to value if it is smaller, returns the new maximum '''
+    client = matrix_utils.get_dynamodb_client()
+    assert isinstance(value, int)
+    while (True):
+      old_val = self.get()
+      if (old_val is not None and old_val >= value):
+        return old_val
+      if (old_val is None):
+        update_value = {":newval":{"N":str(value)}}
+        cond = "attribute_not_exists(val)"
+      else:
+        update_value = {":newval":{"N":str(value)}, ":oldval":{"N":str(old_val)}}
+        cond = "val = :oldval"
+      t = time.time()
+      try:
+        client.update_item(TableName=self.table_name, Key=self.key, UpdateExpression="SET val = :newval", ExpressionAttributeValues=update_value, ConditionExpression=cond)
+        return value
+      except botocore.exceptions.ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+          raise
+      finally:
+        trace.record_state_op(time.time() - t)
+
+  def put_unless(self, value, final):
+    ''' Store value unless the stored integer is final, returns the integer stored afterwards '''
+    client = matrix_utils.get_dynamodb_client()
+    assert isinstance(value, int)
+    while (True):
+      old_val = self.get()
+      if (old_val == final):
+        return old_val
+      if (old_val is None):
+        update_value = {":newval":{"N":str(value)}}
+        cond = "attribute_not_exists(val)"
+      else:
+        update_value = {":newval":{"N":str(value)}, ":oldval":{"N":str(old_val)}}
+        cond = "val = :oldval"
+      t = time.time()
+      try:
+        client.update_item(TableName=self.table_name, Key=self.key, UpdateExpression="SET val = :newval", ExpressionAttributeValues=update_value, ConditionExpression=cond)
+        return value
+      except botocore.exceptions.ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+          raise
+      finally:
+        trace.record_state_op(time.time() - t)
+
 
 
 
@@ -127,6 +188,38 @@ IT = RemoteInstructionTypes
 
 RPS = RemoteProgramState
 
+OpCode = collections.namedtuple("OpCode", ["name", "value"])
+
+# opcode value -> instruction class, used to decode serialized programs
+_INSTRUCTION_TYPES = {}
+
+def register_instruction(opcode):
+    ''' Class decorator that registers a new instruction type.
+        opcode is either a RemoteInstructionOpCodes member or the name of
+        a new opcode, which gets the next free opcode value.
+    '''
+    if (isinstance(opcode, str)):
+        values = [x.value for x in OC] + list(_INSTRUCTION_TYPES.keys())
+        opcode = OpCode(opcode, max(values) + 1)
+    def register(cls):
+        if (_INSTRUCTION_TYPES.get(opcode.value, cls) is not cls):
+            raise Exception("Opcode {0} is already registered".format(opcode.value))
+        cls.i_code = opcode
+        _INSTRUCTION_TYPES[opcode.value] = cls
+        return cls
+    return register
+
+def _writeable(block):
+    '''
+        Private C ordered copy of an input block for in place updates. Loaded blocks
+        are shared with the block cache (its read only views still alias a writeable
+        array), so updating them in place would change what the next node reads.
+    '''
+    return np.array(block, order="C")
+
+# blocks loaded or written by this worker, shared by every node it runs
+_BLOCK_CACHE = matrix_utils.BlockCache()
+
 
 class RemoteInstruction(object):
     def __init__(self, i_id):
@@ -144,6 +237,7 @@ class RemoteInstruction(object):
         return self
 
 
+@register_instruction(OC.S3_LOAD)
 class RemoteLoad(RemoteInstruction):
     def __init__(self, i_id, matrix, *bidxs):
         super().__init__(i_id)
@@ -154,9 +248,13 @@ class RemoteLoad(RemoteInstruction):
 
     def __call__(self):
         self.start_time = time.time()
-        if (self.result == None):
+        if (self.result is None):
+            self.result = _BLOCK_CACHE.get(self.matrix, *self.bidxs)
+            self.size = 0
+        if (self.result is None):
             self.result = self.matrix.get_block(*self.bidxs)
-            self.size = sys.getsizeof(self.result)
+            self.size = self.result.nbytes
+            _BLOCK_CACHE.put(self.result, self.matrix, *self.bidxs)
 
         self.end_time = time.time()
         return self.result
@@ -171,8 +269,9 @@ class RemoteLoad(RemoteInstruction):
         for x in self.bidxs:
             bidxs_str += str(x)
             bidxs_str += " "
-        return "{0} = S3_LOAD {1} {2}".format(self.id, self.matrix, len(self.bidxs), bidxs_str.strip())
+        return "{0} = S3_LOAD {1} {2} {3}".format(self.id, self.matrix, len(self.bidxs), bidxs_str.strip())
 
+@register_instruction(OC.S3_WRITE)
 class RemoteWrite(RemoteInstruction):
     def __init__(self, i_id, matrix, data_instr, *bidxs):
         super().__init__(i_id)
@@ -186,7 +285,9 @@ class RemoteWrite(RemoteInstruction):
         self.start_time = time.time()
         if (self.result == None):
             self.result = self.matrix.put_block(self.data_instr.result, *self.bidxs)
-            self.size = sys.getsizeof(self.data_instr.result)
+            self.size = self.data_instr.result.nbytes
+            # write through so later nodes on this worker skip the load
+            _BLOCK_CACHE.put(self.data_instr.result, self.matrix, *self.bidxs)
             self.ret_code = 0
         self.end_time = time.time()
         return self.result
@@ -201,21 +302,28 @@ class RemoteWrite(RemoteInstruction):
             bidxs_str += " "
         return "{0} = S3_WRITE {1} {2} {3} {4}".format(self.id, self.matrix, len(self.bidxs), bidxs_str.strip(), self.data_instr.id)
 
+@register_instruction(OC.SYRK)
 class RemoteSYRK(RemoteInstruction):
+    ''' C -= A A^T on a diagonal tile, only the lower triangle of C is updated '''
     def __init__(self, i_id, argv_instr):
         super().__init__(i_id)
         self.i_code = OC.SYRK
-        assert len(argv_instr) == 3
+        assert len(argv_instr) == 2
         self.argv = argv_instr
         self.result = None
     def __call__(self):
         self.start_time = time.time()
-        if (self.result == None):
-            old_block = self.argv[0].result
-            block_2 = self.argv[1].result
-            block_1 = self.argv[2].result
-            self.result = old_block - block_2.dot(block_1.T)
-            self.flops = old_block.size + 2*block_2.shape[0]*block_2.shape[1]*block_1.shape[0]
+        if (self.result is None):
+            old_block = _writeable(self.argv[0].result)
+            block = self.argv[1].result
+            syrk = scipy.linalg.blas.get_blas_funcs("syrk", (old_block, block))
+            # old_block.T is fortran ordered so BLAS updates it in place,
+            # the upper triangle of old_block.T is the lower triangle of old_block
+            out = syrk(alpha=-1.0, a=block.T, beta=1.0, c=old_block.T, trans=1, lower=0, overwrite_c=1)
+            if (not np.shares_memory(out, old_block)):
+                old_block = np.ascontiguousarray(out.T)
+            self.result = old_block
+            self.flops = block.shape[0]*(block.shape[0] + 1)*block.shape[1]
             self.ret_code = 0
         self.end_time = time.time()
         return self.result
@@ -225,8 +333,44 @@ class RemoteSYRK(RemoteInstruction):
 
 
     def __str__(self):
-        return "{0} = SYRK {1} {2} {3}".format(self.id, self.argv[0].id,  self.argv[1].id,  self.argv[2].id)
+        return "{0} = SYRK {1} {2}".format(self.id, self.argv[0].id,  self.argv[1].id)
+
+@register_instruction("GEMM")
+class RemoteGEMM(RemoteInstruction):
+    ''' C -= op(A) op(B), updating C in place '''
+    def __init__(self, i_id, argv_instr, trans_a=0, trans_b=1):
+        super().__init__(i_id)
+        assert len(argv_instr) == 3
+        self.argv = argv_instr
+        self.params = (int(trans_a), int(trans_b))
+        self.result = None
+    def __call__(self):
+        self.start_time = time.time()
+        if (self.result is None):
+            trans_a, trans_b = self.params
+            old_block = _writeable(self.argv[0].result)
+            block_a = self.argv[1].result
+            block_b = self.argv[2].result
+            gemm = scipy.linalg.blas.get_blas_funcs("gemm", (old_block, block_a, block_b))
+            # C^T -= op(B)^T op(A)^T on the fortran ordered view of C
+            out = gemm(alpha=-1.0, a=block_b.T, b=block_a.T, beta=1.0, c=old_block.T,
+                       trans_a=trans_b, trans_b=trans_a, overwrite_c=1)
+            if (not np.shares_memory(out, old_block)):
+                old_block = np.ascontiguousarray(out.T)
+            self.result = old_block
+            k = block_a.shape[0] if trans_a else block_a.shape[1]
+            self.flops = 2*old_block.shape[0]*old_block.shape[1]*k
+            self.ret_code = 0
+        self.end_time = time.time()
+        return self.result
 
+    def clear(self):
+        self.result = None
+
+    def __str__(self):
+        return "{0} = GEMM {1} {2} {3} {4} {5}".format(self.id, self.argv[0].id, self.argv[1].id, self.argv[2].id, *self.params)
+
+@register_instruction(OC.TRSM)
 class RemoteTRSM(RemoteInstruction):
     def __init__(self, i_id, argv_instr):
         super().__init__(i_id)
@@ -237,10 +381,11 @@ class RemoteTRSM(RemoteInstruction):
     def __call__(self):
         self.start_time = time.time()
         if (self.result == None):
-            L_bb_inv = self.argv[1].result
+            L_bb = self.argv[1].result
             col_block = self.argv[0].result
-            self.result = col_block.dot(L_bb_inv.T)
-            self.flops = 2*col_block.shape[0]*col_block.shape[1]*L_bb_inv.shape[0]
+            # col_block * L_bb^{-T} without forming the inverse
+            self.result = scipy.linalg.solve_triangular(L_bb, col_block.T, lower=True).T
+            self.flops = col_block.shape[0]*L_bb.shape[0]*L_bb.shape[1]
             self.ret_code = 0
         self.end_time = time.time()
         return self.result
@@ -251,6 +396,34 @@ class RemoteTRSM(RemoteInstruction):
     def __str__(self):
         return "{0} = TRSM {1} {2}".format(self.id, self.argv[0].id,  self.argv[1].id)
 
+@register_instruction("TRTRS")
+class RemoteTriangularSolve(RemoteInstruction):
+    ''' op(A)^{-1} B for a triangular block A, B may hold many right hand sides '''
+    def __init__(self, i_id, argv_instr, lower=1, trans=0):
+        super().__init__(i_id)
+        assert len(argv_instr) == 2
+        self.argv = argv_instr
+        self.params = (int(lower), int(trans))
+        self.result = None
+    def __call__(self):
+        self.start_time = time.time()
+        if (self.result is None):
+            lower, trans = self.params
+            A = self.argv[0].result
+            B = self.argv[1].result
+            self.result = scipy.linalg.solve_triangular(A, B, lower=bool(lower), trans=trans)
+            self.flops = A.shape[0]*A.shape[1]*B.shape[1]
+            self.ret_code = 0
+        self.end_time = time.time()
+        return self.result
+
+    def clear(self):
+        self.result = None
+
+    def __str__(self):
+        return "{0} = TRTRS {1} {2} {3} {4}".format(self.id, self.argv[0].id, self.argv[1].id, *self.params)
+
+@register_instruction(OC.CHOL)
 class RemoteCholesky(RemoteInstruction):
     def __init__(self, i_id, argv_instr):
         super().__init__(i_id)
@@ -276,6 +449,7 @@ class RemoteCholesky(RemoteInstruction):
     def __str__(self):
         return "{0} = CHOL {1}".format(self.id, self.argv[0].id)
 
+@register_instruction(OC.INVRS)
 class RemoteInverse(RemoteInstruction):
     def __init__(self, i_id, argv_instr):
         super().__init__(i_id)
@@ -300,6 +474,258 @@ class RemoteInverse(RemoteInstruction):
         return "{0} = INVRS {1}".format(self.id, self.argv[0].id)
 
 
+@register_instruction("GETRF")
+class RemoteGETRF(RemoteInstruction):
+    ''' Partially pivoted LU of a block column panel, the result is the list
+        [packed diagonal block, L blocks below the diagonal..., row permutation].
+        The permutation is a (1, num_rows) row of global row indices.
+    '''
+    def __init__(self, i_id, argv_instr, num_rows):
+        super().__init__(i_id)
+        self.argv = argv_instr
+        self.params = (int(num_rows),)
+        self.result = None
+    def __call__(self):
+        self.start_time = time.time()
+        if (self.result is None):
+            blocks = [x.result for x in self.argv]
+            panel = np.vstack(blocks)
+            getrf = scipy.linalg.lapack.get_lapack_funcs("getrf", (panel,))
+            lu, piv, info = getrf(panel, overwrite_a=1)
+            if (info != 0):
+                raise Exception("GETRF failed with info {0}, the panel is singular".format(info))
+            num_rows = self.params[0]
+            offset = num_rows - panel.shape[0]
+            perm = np.arange(num_rows)
+            perm[offset:] = offset + _pivots_to_permutation(piv, panel.shape[0])
+            splits = np.cumsum([block.shape[0] for block in blocks])[:-1]
+            self.result = np.split(lu, splits) + [perm.reshape(1, -1)]
+            m, b = panel.shape
+            self.flops = m*b*b - b**3/3.0
+            self.ret_code = 0
+        self.end_time = time.time()
+        return self.result
+
+    def clear(self):
+        self.result = None
+
+    def __str__(self):
+        return "{0} = GETRF {1} {2}".format(self.id, " ".join([str(x.id) for x in self.argv]), *self.params)
+
+@register_instruction("SWAP_TRSM")
+class RemoteSwapTRSM(RemoteInstruction):
+    ''' Apply a panel row permutation to a block column and solve for its U block,
+        argv is [packed diagonal block, permutation, column blocks...] and the result is
+        [U block, permuted blocks below the diagonal...]
+    '''
+    def __init__(self, i_id, argv_instr):
+        super().__init__(i_id)
+        assert len(argv_instr) >= 3
+        self.argv = argv_instr
+        self.result = None
+    def __call__(self):
+        self.start_time = time.time()
+        if (self.result is None):
+            lu_bb = self.argv[0].result
+            perm = self.argv[1].result.ravel()
+            blocks = [x.result for x in self.argv[2:]]
+            col = np.vstack(blocks)
+            offset = perm.shape[0] - col.shape[0]
+            col = col[perm[offset:] - offset]
+            b = blocks[0].shape[0]
+            U = scipy.linalg.solve_triangular(lu_bb, col[:b], lower=True, unit_diagonal=True)
+            splits = np.cumsum([block.shape[0] for block in blocks[1:]])[:-1]
+            self.result = [U] + np.split(col[b:], splits)
+            self.flops = lu_bb.shape[0]*lu_bb.shape[1]*col.shape[1]
+            self.ret_code = 0
+        self.end_time = time.time()
+        return self.result
+
+    def clear(self):
+        self.result = None
+
+    def __str__(self):
+        return "{0} = SWAP_TRSM {1}".format(self.id, " ".join([str(x.id) for x in self.argv]))
+
+@register_instruction("LASWP")
+class RemoteLASWP(RemoteInstruction):
+    ''' Apply the row permutations of later panels to the L blocks of a column,
+        argv is [num_perms permutations in panel order..., L blocks...] and the
+        result is the list of permuted L blocks
+    '''
+    def __init__(self, i_id, argv_instr, num_perms):
+        super().__init__(i_id)
+        self.argv = argv_instr
+        self.params = (int(num_perms),)
+        self.result = None
+    def __call__(self):
+        self.start_time = time.time()
+        if (self.result is None):
+            num_perms = self.params[0]
+            blocks = [x.result for x in self.argv[num_perms:]]
+            rows = np.vstack(blocks)
+            for x in self.argv[:num_perms]:
+                perm = x.result.ravel()
+                offset = perm.shape[0] - rows.shape[0]
+                rows = rows[perm[offset:] - offset]
+            splits = np.cumsum([block.shape[0] for block in blocks])[:-1]
+            self.result = np.split(rows, splits)
+            self.flops = 0
+            self.ret_code = 0
+        self.end_time = time.time()
+        return self.result
+
+    def clear(self):
+        self.result = None
+
+    def __str__(self):
+        return "{0} = LASWP {1} {2}".format(self.id, " ".join([str(x.id) for x in self.argv]), *self.params)
+
+@register_instruction("INDEX")
+class RemoteIndex(RemoteInstruction):
+    ''' Select one entry of the list returned by another instruction '''
+    def __init__(self, i_id, argv_instr, index):
+        super().__init__(i_id)
+        assert len(argv_instr) == 1
+        self.argv = argv_instr
+        self.params = (int(index),)
+        self.result = None
+    def __call__(self):
+        self.start_time = time.time()
+        if (self.result is None):
+            self.result = self.argv[0].result[self.params[0]]
+            self.ret_code = 0
+        self.end_time = time.time()
+        return self.result
+
+    def clear(self):
+        self.result = None
+
+    def __str__(self):
+        return "{0} = INDEX {1} {2}".format(self.id, self.argv[0].id, *self.params)
+
+def _pivots_to_permutation(piv, num_rows):
+    ''' LAPACK pivots (row i was swapped with row piv[i]) as a permutation,
+        row i of the pivoted panel is row perm[i] of the input
+    '''
+    perm = np.arange(num_rows)
+    for i, p in enumerate(piv):
+        perm[i], perm[p] = perm[p], perm[i]
+    return perm
+
+@register_instruction("GEQRF")
+class RemoteGEQRF(RemoteInstruction):
+    ''' Householder QR of vertically stacked blocks, the result is the list
+        [reflectors zero padded to num_rows rows, tau as a row, R]
+    '''
+    def __init__(self, i_id, argv_instr, num_rows):
+        super().__init__(i_id)
+        self.argv = argv_instr
+        self.params = (int(num_rows),)
+        self.result = None
+    def __call__(self):
+        self.start_time = time.time()
+        if (self.result is None):
+            stacked = np.vstack([x.result for x in self.argv])
+            geqrf = scipy.linalg.lapack.get_lapack_funcs("geqrf", (stacked,))
+            qr, tau, work, info = geqrf(stacked)
+            if (info != 0):
+                raise Exception("GEQRF failed with info {0}".format(info))
+            m, b = stacked.shape
+            V = np.zeros((self.params[0], b), dtype=qr.dtype)
+            V[:m] = qr
+            self.result = [V, tau.reshape(1, -1), np.triu(qr[:b])]
+            self.flops = 2.0*m*b*b - 2.0/3.0*b**3
+            self.ret_code = 0
+        self.end_time = time.time()
+        return self.result
+
+    def clear(self):
+        self.result = None
+
+    def __str__(self):
+        return "{0} = GEQRF {1} {2}".format(self.id, " ".join([str(x.id) for x in self.argv]), *self.params)
+
+def _apply_reflectors(V, tau, C, trans):
+    ''' Q C or Q^T C for the Q stored as reflectors by GEQRF '''
+    ormqr = scipy.linalg.lapack.get_lapack_funcs("ormqr", (V, C))
+    lwork = ormqr("L", trans, V, tau, C, -1)[1][0]
+    out, work, info = ormqr("L", trans, V, tau, C, max(1, int(lwork)), overwrite_c=1)
+    if (info != 0):
+        raise Exception("ORMQR failed with info {0}".format(info))
+    return out
+
+@register_instruction("ORMQR")
+class RemoteORMQR(RemoteInstruction):
+    ''' Apply Q^T of a GEQRF to vertically stacked blocks, argv is [reflectors, tau, blocks...].
+        The result is [top rows shaped like R, rows of the second block, ..., rows of the last block]
+    '''
+    def __init__(self, i_id, argv_instr):
+        super().__init__(i_id)
+        assert len(argv_instr) >= 3
+        self.argv = argv_instr
+        self.result = None
+    def __call__(self):
+        self.start_time = time.time()
+        if (self.result is None):
+            blocks = [x.result for x in self.argv[2:]]
+            C = np.vstack(blocks)
+            tau = self.argv[1].result.ravel()
+            V = self.argv[0].result[:C.shape[0]]
+            out = _apply_reflectors(V, tau, C, "T")
+            b = tau.shape[0]
+            splits = np.cumsum([block.shape[0] for block in blocks])[:-1]
+            self.result = [out[:b]] + np.split(out, splits)[1:]
+            self.flops = 4.0*C.shape[0]*C.shape[1]*b - 2.0*C.shape[1]*b*b
+            self.ret_code = 0
+        self.end_time = time.time()
+        return self.result
+
+    def clear(self):
+        self.result = None
+
+    def __str__(self):
+        return "{0} = ORMQR {1}".format(self.id, " ".join([str(x.id) for x in self.argv]))
+
+@register_instruction("ORGQR")
+class RemoteORGQR(RemoteInstruction):
+    ''' Form the thin Q of a GEQRF whose input blocks had the given row counts,
+        argv is [reflectors, tau] or [reflectors, tau, W] to return Q W.
+        The result is Q split into the row blocks of the input.
+    '''
+    def __init__(self, i_id, argv_instr, *rows):
+        super().__init__(i_id)
+        assert len(argv_instr) in [2, 3]
+        self.argv = argv_instr
+        self.params = tuple([int(x) for x in rows])
+        self.result = None
+    def __call__(self):
+        self.start_time = time.time()
+        if (self.result is None):
+            m = sum(self.params)
+            tau = self.argv[1].result.ravel()
+            V = self.argv[0].result[:m]
+            b = tau.shape[0]
+            Q = _apply_reflectors(V, tau, np.eye(m, b, dtype=V.dtype), "N")
+            self.flops = 4.0*m*b*b - 2.0*b**3
+            if (len(self.argv) == 3):
+                W = self.argv[2].result
+                Q = Q.dot(W)
+                self.flops += 2.0*m*b*W.shape[1]
+            self.result = np.split(Q, np.cumsum(self.params)[:-1])
+            self.ret_code = 0
+        self.end_time = time.time()
+        return self.result
+
+    def clear(self):
+        self.result = None
+
+    def __str__(self):
+        return "{0} = ORGQR {1} {2}".format(self.id, " ".join([str(x.id) for x in self.argv]),
+                                           " ".join([str(x) for x in self.params]))
+
+
+@register_instruction(OC.RET)
 class RemoteReturn(RemoteInstruction):
     def __init__(self, i_id, return_loc):
         super().__init__(i_id)
@@ -329,8 +755,25 @@ class InstructionBlock(object):
             self.label = "%{0}".format(InstructionBlock.block_count)
         InstructionBlock.block_count += 1
 
-    def __call__(self):
-        val = [x() for x in self.instrs]
+    def __call__(self, prefetch_depth=1):
+        '''
+            Run the instructions in order, with prefetch_depth > 1 the loads of blocks
+            not written by this block are started ahead on I/O threads
+        '''
+        written = set([inst.matrix.key_base for inst in self.instrs if isinstance(inst, RemoteWrite)])
+        loads = [inst for inst in self.instrs
+                 if isinstance(inst, RemoteLoad) and inst.matrix.key_base not in written]
+        if (prefetch_depth <= 1 or len(loads) <= 1):
+            val = [x() for x in self.instrs]
+            return 0
+        prefetched = set([id(inst) for inst in loads])
+        with matrix_utils.PrefetchPipeline(lambda inst: inst(), loads, depth=prefetch_depth) as pipeline:
+            fetched = iter(pipeline)
+            for x in self.instrs:
+                if (id(x) in prefetched):
+                    next(fetched)
+                else:
+                    x()
         return 0
 
     def __str__(self):
@@ -354,96 +797,297 @@ class LambdaPackProgram(object):
        Maintains global state information
     '''
 
-    def __init__(self, inst_blocks, executor=pywren.default_executor, pywren_config=DEFAULT_CONFIG):
-        pwex = executor(config=pywren_config)
+    def __init__(self, inst_blocks, executor=pywren.default_executor, pywren_config=DEFAULT_CONFIG,
+                 speculation_percentile=None, speculation_min_samples=8,
+                 block_cache_bytes=2**29, inline_time_budget=60, inline_depth_limit=64,
+                 fusion_granularity=1, outputs=None, trace_sink=None, garbage_collect=True,
+                 prefetch_depth=4):
+        '''
+            @param speculation_percentile - relaunch an instruction block once it has been running
+                                            longer than this percentile of completed block run times
+                                            (None disables speculative re-execution)
+            @param speculation_min_samples - number of completed blocks needed before speculating
+            @param block_cache_bytes - size of the worker local cache of loaded and written blocks
+            @param inline_time_budget - seconds an invocation may keep running ready children
+                                        itself instead of handing them to new invocations
+            @param inline_depth_limit - most blocks an invocation runs inline after its own
+            @param fusion_granularity - fuse up to this many instruction blocks into one
+                                        schedulable unit (1 disables fusion)
+            @param outputs - matrices holding the program results, writes to any other
+                             matrix are intermediate and may be elided by fusion
+            @param trace_sink - numpywren.trace.TraceSink every executed instruction block
+                                reports its timings, bytes moved and flops to (None disables tracing)
+            @param garbage_collect - delete intermediate blocks as soon as their last reader has run,
+                                     needs outputs and is off when speculating since a late
+                                     duplicate could read a deleted block
+            @param prefetch_depth - loads of an instruction block started ahead of the
+                                    instruction that uses them (1 loads them in order)
+        '''
+        self.prefetch_depth = prefetch_depth
         self.pywren_config = pywren_config
         self.executor = executor
-        self.bucket = pywren_config['s3']['bucket']
         self.inst_blocks = [copy.copy(x) for x in inst_blocks]
+        self.bucket = pywren_config.get('s3', {}).get('bucket')
+        if (self.bucket == None):
+            # executors without a pywren config store the program next to its matrices
+            self.bucket = next(inst.matrix.bucket for inst_block in self.inst_blocks
+                               for inst in inst_block.instrs if hasattr(inst, "matrix"))
+        if (fusion_granularity > 1):
+            self.inst_blocks = fuse_instruction_blocks(self.inst_blocks, fusion_granularity, outputs=outputs)
+        self.outputs = outputs
+        self.trace_sink = trace_sink
         self.program_string = "\n".join([str(x) for x in inst_blocks])
         program_string = "\n".join([str(x) for x in self.inst_blocks])
+        # the program id only depends on the program text so a
+        # failed run can be picked up again with resume()
         hashed = hashlib.sha1()
         hashed.update(program_string.encode())
-        hashed.update(str(time.time()).encode())
         self.hash = hashed.hexdigest()
-        self.ret_status = RPS(self.hash)
+        self.epoch_status = RPS(self.hash + "_epoch")
         self.children, self.parents = self._io_dependency_analyze(self.inst_blocks)
+        self.garbage_collect = garbage_collect and outputs is not None and speculation_percentile is None
+        self.gc_plan = None
+        if (self.garbage_collect):
+            self.gc_plan = garbage_collection_plan(self.inst_blocks, outputs)
         self.starters = []
         self.terminators = []
         max_i_id = max([inst.id for inst_block in self.inst_blocks for inst in inst_block.instrs])
-        self.remote_return = RemoteReturn(max_i_id + 1, self.ret_status)
+        self.remote_return = RemoteReturn(max_i_id + 1, None)
         self.return_block = InstructionBlock([self.remote_return], label="EXIT")
         self.inst_blocks.append(self.return_block)
 
         self.pc = max_i_id + 1
-        self.block_return_statuses = []
-        self.block_ready_statuses = []
+        self.block_returns = []
         for i, (children, parents, inst_block) in enumerate(zip(self.children, self.parents, self.inst_blocks)):
             if len(children) == 0:
                 self.terminators.append(i)
             if len(parents) == 0:
                 self.starters.append(i)
-            block_hash = hashlib.sha1((self.hash + str(i)).encode()).hexdigest()
-            block_ret_status  = RPS(block_hash)
-            block_return = RemoteReturn(self.pc + 1, block_ret_status)
-            block_ready_hash = block_hash + "_ready"
-            block_ready_status = RPS(block_ready_hash)
+            block_return = RemoteReturn(self.pc + 1, None)
             self.inst_blocks[i].instrs.append(block_return)
-            self.block_return_statuses.append(block_ret_status)
-            self.block_ready_statuses.append(block_ready_status)
+            self.block_returns.append(block_return)
 
         for i in self.terminators:
           self.children[i].append(len(self.inst_blocks) - 1)
         self.children.append([])
         self.parents.append(self.terminators)
+        if (self.gc_plan is not None):
+            self.gc_plan.append([])
+        self.block_returns.append(self.remote_return)
+
+        self.speculation_percentile = speculation_percentile
+        self.speculation_min_samples = speculation_min_samples
+        self.speculative_futures = []
+        self.block_cache_bytes = block_cache_bytes
+        self.inline_time_budget = inline_time_budget
+        self.inline_depth_limit = inline_depth_limit
+        self._invocation_start = None
+        self._bind_state(0)
+
+    def _bind_state(self, epoch):
+        ''' Point all remote state at the given run of this program,
+            every call to start() begins a new run while resume()
+            continues the latest one
+        '''
+        self.epoch = epoch
+        run_hash = "{0}_{1}".format(self.hash, epoch)
+        self.ret_status = RPS(run_hash)
+        self.ret_ready_status = RPS(run_hash + "_ready")
+        self.stored_bytes_status = RPS(run_hash + "_stored_bytes")
+        self.peak_stored_bytes_status = RPS(run_hash + "_peak_stored_bytes")
+        self.written_bytes_status = RPS(run_hash + "_written_bytes")
+        self.attempt_status = RPS(run_hash + "_attempt")
+        self.cache_scope = self.program_id
+        self.block_return_statuses = []
+        self.block_ready_statuses = []
+        self.block_done_statuses = []
+        self.block_time_statuses = []
+        self.block_start_statuses = []
+        for i in range(len(self.inst_blocks) - 1):
+            block_hash = hashlib.sha1((run_hash + str(i)).encode()).hexdigest()
+            self.block_return_statuses.append(RPS(block_hash))
+            self.block_ready_statuses.append(RPS(block_hash + "_ready"))
+            self.block_done_statuses.append(RPS(block_hash + "_done"))
+            self.block_time_statuses.append(RPS(block_hash + "_time"))
+            self.block_start_statuses.append(RPS(block_hash + "_start"))
         self.block_return_statuses.append(self.ret_status)
-        self.ret_ready_status = RPS(self.hash + "_ready")
         self.block_ready_statuses.append(self.ret_ready_status)
-
-
-    def pywren_func(self, i):
-        # 1. check if program has terminated
-        # 2. check if this instruction_block has executed successfully
-        # 3. check if parents are not completed
-        # if any of the above are False -> exit
+        self.block_done_statuses.append(RPS(run_hash + "_done"))
+        self.block_time_statuses.append(RPS(run_hash + "_time"))
+        self.block_start_statuses.append(RPS(run_hash + "_start"))
+        for block_return, status in zip(self.block_returns, self.block_return_statuses):
+            block_return.return_loc = status
+
+    def pywren_func(self, i, enqueue_time=None):
+        '''
+            Run instruction block i, then keep running a ready child on this worker while
+            the inline time and depth budgets last. Blocks run inline come back as finished
+            futures in one flat list next to the futures of the children mapped to new
+            invocations.
+        '''
         try:
-          print("RUNNING " , i)
-          children = self.children[i]
-          parents = self.parents[i]
-          program_status = self.program_status().value
-          if (i == len(self.inst_blocks) - 1):
-            # special case final block
-            print("RETURN BLOCK")
-            pass
-          self.set_inst_block_status(i, EC.RUNNING)
-          if (program_status != EC.RUNNING.value):
-            return i, self.inst_blocks[i], EC.EXCEPTION
-
-          ret_code = self.inst_blocks[i]()
-          self.set_inst_block_status(i, EC(ret_code))
-          self.inst_blocks[i].clear()
-          child_futures = []
-          pwex = self.executor(config=self.pywren_config)
-          ready_children = []
-          for child in children:
-            val = self.block_ready_statuses[child].incr()
-            if (val >= len(self.parents[child])):
-              ready_children.append(child)
-          child_futures = pwex.map(self.pywren_func, ready_children, extra_env={"OMP_NUM_THREADS": "1"})
-          return i, self.inst_blocks[i], child_futures
+          result, local_child = self._run_block(i, enqueue_time)
+          if (local_child == None):
+            return result
+          child_futures = list(result[2])
+          depth = 0
+          while (local_child != None):
+            # this worker already holds the inputs of local_child, run it here
+            depth += 1
+            child_result, local_child = self._run_block(local_child, time.time(), depth)
+            if (isinstance(child_result[2], EC)):
+              child_futures.append(_DoneFuture(child_result))
+            else:
+              child_futures += child_result[2]
+              child_futures.append(_DoneFuture((child_result[0], child_result[1], [])))
+          return result[0], result[1], child_futures
         except Exception as e:
             print("EXCEPTION ", e)
             self.handle_exception(e)
             raise
 
+    def _run_block(self, i, enqueue_time=None, depth=0):
+        # 1. check if program has terminated
+        # 2. check if this instruction_block has executed successfully
+        # 3. check if parents are not completed
+        # if any of the above are False -> exit
+        # returns the (i, block, futures or exit code) result and the child to run inline
+        print("RUNNING " , i)
+        state_seconds, state_requests = trace.state_stats()
+        children = self.children[i]
+        parents = self.parents[i]
+        program_status = self.program_status().value
+        if (i == len(self.inst_blocks) - 1):
+          # special case final block
+          print("RETURN BLOCK")
+          pass
+        start_time = time.time()
+        if (self.speculation_percentile is not None):
+          # stragglers are timed from when a worker picked the block up
+          self.block_start_statuses[i].put(int(1000*start_time))
+        if (self.set_inst_block_status(i, EC.RUNNING) == EC.SUCCESS):
+          # a speculative copy of this block already finished
+          return (i, self.inst_blocks[i], EC.REPLAY), None
+        if (program_status != EC.RUNNING.value):
+          return (i, self.inst_blocks[i], EC.EXCEPTION), None
+
+        ret_code = self.inst_blocks[i](prefetch_depth=self.prefetch_depth)
+        end_time = time.time()
+        self.set_inst_block_status(i, EC(ret_code))
+        # instruction blocks are idempotent so duplicates are safe,
+        # but only the first copy to finish may notify the children
+        replay = self.block_done_statuses[i].incr() > 1
+        if (self.trace_sink != None):
+          record = trace.make_trace_record(self.program_id, i, self.inst_blocks[i], start_time, end_time,
+                                           enqueue_time, state_seconds, state_requests, replay=replay)
+        self.inst_blocks[i].clear()
+        if (replay):
+          if (self.trace_sink != None):
+            self._emit_trace(record)
+          return (i, self.inst_blocks[i], EC.REPLAY), None
+        self.block_time_statuses[i].put(int(1000*(end_time - start_time)))
+        self._account_writes(i)
+        if (self.garbage_collect):
+          self._collect_garbage(i)
+        child_futures = []
+        pwex = self.executor(config=self.pywren_config)
+        ready_children = []
+        for child in children:
+          val = self.block_ready_statuses[child].incr()
+          if (val == len(self.parents[child])):
+            ready_children.append(child)
+        local_child = self._pick_local_child(ready_children, depth)
+        if (local_child != None):
+          ready_children.remove(local_child)
+        child_futures = self._map_nodes(pwex, ready_children)
+        if (self.trace_sink != None):
+          self._emit_trace(record)
+        return (i, self.inst_blocks[i], list(child_futures)), local_child
+
+    def _new_cache_scope(self):
+        # warm workers may still cache blocks of an earlier attempt of this run,
+        # every start() and resume() gets a scope of its own so they are dropped
+        self.cache_scope = "{0}_{1}".format(self.program_id, self.attempt_status.incr())
+
     def start(self):
+        self._bind_state(self.epoch_status.incr())
+        self._new_cache_scope()
+        self._store_program()
         self.ret_status.put(EC.RUNNING.value)
         pwex = self.executor(config=self.pywren_config)
         print(pwex.config)
         print(self.starters)
-        self.futures = pwex.map(self.pywren_func, self.starters, extra_env={"OMP_NUM_THREADS": "1"})
+        self.futures = self._map_nodes(pwex, self.starters)
+        self._reset_speculation(self.starters, [])
         return self.futures
 
+    def resume(self):
+        ''' Restart the latest run of this program, only instruction blocks
+            that have not completed successfully are executed again
+        '''
+        epoch = self.epoch_status.get()
+        if (epoch == None):
+            return self.start()
+        self._bind_state(epoch)
+        if (self.program_status() == EC.SUCCESS):
+            self.futures = []
+            return self.futures
+        completed = set([i for i in range(len(self.inst_blocks)) if self.inst_block_status(i) == EC.SUCCESS])
+        frontier = []
+        for i in range(len(self.inst_blocks)):
+            if (i in completed):
+                continue
+            # recompute the ready counters from the completed parents
+            num_ready = len([p for p in self.parents[i] if p in completed])
+            self.block_ready_statuses[i].put(num_ready)
+            self.block_done_statuses[i].put(0)
+            if (num_ready == len(self.parents[i])):
+                frontier.append(i)
+        print("RESUMING {0} of {1} blocks".format(len(self.inst_blocks) - len(completed), len(self.inst_blocks)))
+        self._new_cache_scope()
+        self._store_program()
+        self.ret_status.put(EC.RUNNING.value)
+        pwex = self.executor(config=self.pywren_config)
+        self.futures = self._map_nodes(pwex, frontier)
+        self._reset_speculation(frontier, completed)
+        return self.futures
+
+    def _account_writes(self, i):
+        written = sum([getattr(inst, "size", 0) for inst in self.inst_blocks[i].instrs if isinstance(inst, RemoteWrite)])
+        if (written > 0):
+            self.written_bytes_status.incr(written)
+            self.peak_stored_bytes_status.max(self.stored_bytes_status.incr(written))
+
+    def _collect_garbage(self, i):
+        ''' Delete the intermediate blocks whose last reader is instruction block i '''
+        dead = []
+        for pos, gc_id, num_readers in self.gc_plan[i]:
+            if (gc_id >= 0):
+                # blocks with several readers are deleted by whichever finishes last
+                readers_done = RPS("{0}_gc_{1}".format(self.program_id, gc_id)).incr()
+                if (readers_done < num_readers):
+                    continue
+            inst = self.inst_blocks[i].instrs[pos]
+            dead.append((inst.matrix, inst.bidxs))
+        if (len(dead) > 0):
+            freed = _GARBAGE.delete(dead)
+            self.stored_bytes_status.incr(-freed)
+
+    def storage_stats(self):
+        ''' Bytes written by the current run of this program, the bytes it currently
+            keeps in the object store and the most it has stored at once
+        '''
+        return {"written_bytes": self.written_bytes_status.get() or 0,
+                "stored_bytes": self.stored_bytes_status.get() or 0,
+                "peak_stored_bytes": self.peak_stored_bytes_status.get() or 0}
+
+    def _reset_speculation(self, frontier, finished):
+        self._frontier = set(frontier)
+        self._finished = set(finished)
+        self._running_since = {}
+        self._run_times = []
+        self._speculated = set()
+
     def handle_exception(self, error):
         e = EC.EXCEPTION.value
         self.ret_status.put(e)
@@ -461,8 +1105,45 @@ class LambdaPackProgram(object):
         status = self.program_status()
         while (status == EC.RUNNING):
             time.sleep(sleep_time)
+            if (self.speculation_percentile is not None):
+                self.speculate()
             status = self.program_status()
 
+    def speculate(self):
+        ''' Poll the blocks that can currently be running and launch a
+            duplicate of every block that has been running for longer than
+            speculation_percentile of the completed block run times.
+            Returns the list of relaunched block indices.
+        '''
+        now = time.time()
+        for i in list(self._frontier):
+            status = self.inst_block_status(i)
+            if (status == EC.RUNNING and i not in self._running_since):
+                started = self.block_start_statuses[i].get()
+                self._running_since[i] = started/1000.0 if started != None else now
+            elif (status == EC.SUCCESS):
+                self._frontier.discard(i)
+                self._finished.add(i)
+                self._running_since.pop(i, None)
+                run_time = self.block_time_statuses[i].get()
+                if (run_time != None):
+                    self._run_times.append(run_time/1000.0)
+                for child in self.children[i]:
+                    if all([p in self._finished for p in self.parents[child]]):
+                        self._frontier.add(child)
+
+        if (len(self._run_times) < self.speculation_min_samples):
+            return []
+        threshold = np.percentile(self._run_times, self.speculation_percentile)
+        stragglers = [i for i, t in self._running_since.items()
+                      if now - t > threshold and i not in self._speculated]
+        if (len(stragglers) > 0):
+            print("SPECULATING ", stragglers)
+            pwex = self.executor(config=self.pywren_config)
+            self.speculative_futures += self._map_nodes(pwex, stragglers)
+            self._speculated.update(stragglers)
+        return stragglers
+
 
     def unwind(self):
       if (self.program_status() != EC.SUCCESS):
@@ -489,70 +1170,490 @@ class LambdaPackProgram(object):
         return EC(status)
 
     def set_inst_block_status(self, i, status):
-        return self.block_return_statuses[i].put(status.value)
+        ''' Update the status of block i unless a copy of it already succeeded, returns the status afterwards '''
+        return EC(self.block_return_statuses[i].put_unless(status.value, EC.SUCCESS.value))
 
     def _io_dependency_analyze(self, instruction_blocks):
-        all_forward_dependencies = [[] for i in range(len(instruction_blocks))]
-        all_backward_dependencies = [[] for i in range(len(instruction_blocks))]
-        for i, inst_0 in enumerate(instruction_blocks):
-            # find all places inst_0 reads
-            deps = []
-            for inst in inst_0.instrs:
-                if isinstance(inst, RemoteLoad):
-                    deps.append(inst)
-            deps_managed = set()
-            for j, inst_1 in enumerate(instruction_blocks):
-                 for inst in inst_1.instrs:
-                    if isinstance(inst, RemoteWrite):
-                        for d in deps:
-                            if (d.matrix == inst.matrix and d.bidxs == inst.bidxs):
-                                # this is a dependency
-                                if d in deps_managed:
-                                    raise Exception("Each load should correspond to exactly one write")
-                                deps_managed.add(d)
-                                all_forward_dependencies[j].append(i)
-                                all_backward_dependencies[i].append(j)
-        return all_forward_dependencies, all_backward_dependencies
+        return io_dependency_analyze(instruction_blocks)
+
+    def __getstate__(self):
+        ''' Compact encoding of the program: integer opcode arrays,
+            a table of the matrices touched and CSR adjacency lists
+        '''
+        state = self.__dict__.copy()
+        for attr in ["inst_blocks", "children", "parents", "program_string", "futures", "speculative_futures",
+                     "block_returns", "remote_return", "return_block",
+                     "ret_status", "ret_ready_status", "block_return_statuses", "block_ready_statuses",
+                     "stored_bytes_status", "peak_stored_bytes_status", "written_bytes_status", "attempt_status", "gc_plan",
+                     "block_done_statuses", "block_time_statuses", "block_start_statuses",
+                     "_invocation_start", "_frontier", "_finished", "_running_since", "_run_times", "_speculated"]:
+            state.pop(attr, None)
+        state["encoded_blocks"] = encode_instruction_blocks(self.inst_blocks[:-1])
+        state["children_csr"] = _to_csr(self.children)
+        if (self.gc_plan is not None):
+            state["gc_plan_csr"] = _to_csr([list(itertools.chain.from_iterable(entries)) for entries in self.gc_plan])
+        return state
+
+    def __setstate__(self, state):
+        encoded_blocks = state.pop("encoded_blocks")
+        children_csr = state.pop("children_csr")
+        gc_plan_csr = state.pop("gc_plan_csr", None)
+        self.__dict__.update(state)
+        self.gc_plan = None
+        if (gc_plan_csr is not None):
+            self.gc_plan = [[tuple(flat[k:k+3]) for k in range(0, len(flat), 3)] for flat in _from_csr(*gc_plan_csr)]
+        self.inst_blocks = decode_instruction_blocks(encoded_blocks)
+        self.children = _from_csr(*children_csr)
+        self.parents = [[] for _ in self.children]
+        for j, children in enumerate(self.children):
+            for i in children:
+                self.parents[i].append(j)
+        self.remote_return = RemoteReturn(self.pc, None)
+        self.return_block = InstructionBlock([self.remote_return], label="EXIT")
+        self.block_returns = []
+        for inst_block in self.inst_blocks:
+            block_return = RemoteReturn(self.pc + 1, None)
+            inst_block.instrs.append(block_return)
+            self.block_returns.append(block_return)
+        self.inst_blocks.append(self.return_block)
+        self.block_returns.append(self.remote_return)
+        self.speculative_futures = []
+        self._invocation_start = None
+        self._bind_state(self.epoch)
+
+    def _pick_local_child(self, ready_children, depth=0):
+        ''' Pick the ready child with the most inputs in the block cache '''
+        if (self._invocation_start == None or len(ready_children) == 0):
+            return None
+        if (time.time() - self._invocation_start > self.inline_time_budget):
+            return None
+        if (depth >= self.inline_depth_limit):
+            return None
+        def cached_inputs(child):
+            return len([inst for inst in self.inst_blocks[child].instrs
+                        if isinstance(inst, RemoteLoad) and _BLOCK_CACHE.contains(inst.matrix, *inst.bidxs)])
+        return max(ready_children, key=cached_inputs)
+
+    @property
+    def program_id(self):
+        return "{0}_{1}".format(self.hash, self.epoch)
+
+    def _store_program(self):
+        ''' Ship the program to the object store once per run, invocations
+            then only carry (program_id, node_id)
+        '''
+        client = matrix_utils.get_s3_client()
+        client.put_object(Bucket=self.bucket,
+                          Key=_program_key(self.program_id),
+                          Body=cloudpickle.dumps(self))
+
+    def _map_nodes(self, pwex, nodes):
+        runner = functools.partial(run_program_node, self.bucket)
+        enqueue_time = time.time()
+        return pwex.map(runner, [(self.program_id, i, enqueue_time, self.cache_scope) for i in nodes],
+                        extra_env={"OMP_NUM_THREADS": "1"})
+
+    def _emit_trace(self, record):
+        # the state store requests made so far by this invocation
+        # of the instruction block, including notifying its children
+        state_seconds, state_requests = trace.state_stats()
+        record["state_seconds"] = state_seconds - record["state_seconds"]
+        record["state_requests"] = state_requests - record["state_requests"]
+        try:
+            self.trace_sink.emit(record)
+        except Exception as e:
+            # tracing must never fail the program
+            print("TRACE EXCEPTION ", e)
 
+    def trace(self):
+        ''' Aggregate the trace records emitted by the current run of this program '''
+        if (self.trace_sink == None):
+            raise Exception("Program was created without a trace_sink")
+        return trace.TraceAggregator(self.trace_sink.read(self.program_id), self.children)
 
     def __str__(self):
         return "\n".join([str(x) for x in self.inst_blocks])
 
 
-def make_column_update(pc, L_out, L_in, L_bb_inv, b0, b1, label=None):
+def io_dependency_analyze(instruction_blocks):
+    ''' Return the children and parents of every instruction block,
+        a block depends on the block that wrote each of the blocks it loads
+    '''
+    all_forward_dependencies = [[] for i in range(len(instruction_blocks))]
+    all_backward_dependencies = [[] for i in range(len(instruction_blocks))]
+    # index every write by the block it stores so each load
+    # can find its producer without scanning the whole program
+    writers = {}
+    for j, inst_1 in enumerate(instruction_blocks):
+        for inst in inst_1.instrs:
+            if isinstance(inst, RemoteWrite):
+                writers.setdefault(_block_key(inst), []).append(j)
+    for i, inst_0 in enumerate(instruction_blocks):
+        # find all places inst_0 reads
+        parents = []
+        for inst in inst_0.instrs:
+            if isinstance(inst, RemoteLoad):
+                producers = writers.get(_block_key(inst), [])
+                if (len(producers) > 1):
+                    raise Exception("Each load should correspond to exactly one write")
+                parents += producers
+        for j in sorted(parents):
+            all_forward_dependencies[j].append(i)
+            all_backward_dependencies[i].append(j)
+    return all_forward_dependencies, all_backward_dependencies
+
+def _block_key(inst):
+    return (id(inst.matrix), tuple(inst.bidxs))
+
+def garbage_collection_plan(inst_blocks, outputs):
+    ''' For every instruction block the intermediate blocks it is the last reader of,
+        as (instruction index, shared counter id, number of readers) tuples.
+        Blocks written to a matrix that is not an output are intermediate,
+        one without readers is deleted as soon as its writer has run.
+        The shared counter id is -1 for blocks with a single reader.
+    '''
+    output_ids = set([id(m) for m in outputs])
+    writers = collections.OrderedDict()
+    for i, inst_block in enumerate(inst_blocks):
+        for pos, inst in enumerate(inst_block.instrs):
+            if (isinstance(inst, RemoteWrite) and id(inst.matrix) not in output_ids):
+                writers[_block_key(inst)] = (i, pos)
+    readers = collections.defaultdict(collections.OrderedDict)
+    for i, inst_block in enumerate(inst_blocks):
+        for pos, inst in enumerate(inst_block.instrs):
+            if (isinstance(inst, RemoteLoad) and _block_key(inst) in writers):
+                readers[_block_key(inst)].setdefault(i, pos)
+    plan = [[] for _ in inst_blocks]
+    gc_id = 0
+    for key, (writer, write_pos) in writers.items():
+        block_readers = readers[key]
+        if (len(block_readers) == 0):
+            plan[writer].append((write_pos, -1, 1))
+            continue
+        shared_id = -1
+        if (len(block_readers) > 1):
+            shared_id = gc_id
+            gc_id += 1
+        for reader, pos in block_readers.items():
+            plan[reader].append((pos, shared_id, len(block_readers)))
+    return plan
+
+def _block_object_key(matrix, bidxs):
+    if (matrix.symmetric):
+        bidxs = matrix._symmetrize_idx(bidxs)
+    return matrix.__shard_idx_to_key__(bidxs)
+
+def _block_nbytes(matrix, bidxs):
+    nbytes = np.dtype(matrix.dtype).itemsize
+    for start, end in matrix.__block_idx_to_real_idx__(bidxs):
+        nbytes *= end - start
+    return int(nbytes)
+
+def _delete_keys(bucket, keys):
+    client = matrix_utils.get_s3_client()
+    client.delete_objects(Bucket=bucket, Delete={"Objects": [{"Key": key} for key in keys], "Quiet": True})
+
+
+class _DeleteQueue(object):
+    ''' Deletes matrix blocks in the background, batched per bucket '''
+    def __init__(self, max_workers=4, batch_size=1000):
+        self.max_workers = max_workers
+        self.batch_size = batch_size
+        self.executor = None
+        self.pid = None
+        self.pending = []
+
+    def _executor(self):
+        # local executor workers are forked, threads do not survive the fork
+        if (self.pid != os.getpid()):
+            self.executor = fs.ThreadPoolExecutor(max_workers=self.max_workers)
+            self.pid = os.getpid()
+            self.pending = []
+        return self.executor
+
+    def delete(self, blocks):
+        ''' Queue (matrix, block index) pairs for deletion, returns the bytes freed '''
+        keys = collections.defaultdict(list)
+        freed = 0
+        for matrix, bidxs in blocks:
+            keys[matrix.bucket].append(_block_object_key(matrix, bidxs))
+            freed += _block_nbytes(matrix, bidxs)
+            _BLOCK_CACHE.discard(matrix, *bidxs)
+        executor = self._executor()
+        for bucket, bucket_keys in keys.items():
+            for batch in matrix_utils.chunk(bucket_keys, self.batch_size):
+                self.pending.append(executor.submit(_delete_keys, bucket, batch))
+        return freed
+
+    def flush(self):
+        pending, self.pending = self.pending, []
+        [f.result() for f in pending]
+
+_GARBAGE = _DeleteQueue()
+
+def _topological_order(children, parents):
+    num_parents = [len(set(p)) for p in parents]
+    order = [i for i, n in enumerate(num_parents) if n == 0]
+    for i in order:
+        for c in set(children[i]):
+            num_parents[c] -= 1
+            if (num_parents[c] == 0):
+                order.append(c)
+    if (len(order) != len(children)):
+        raise Exception("Instruction blocks do not form a DAG")
+    return order
+
+def fuse_instruction_blocks(inst_blocks, granularity, outputs=None):
+    '''
+        Coarsen a DAG of instruction blocks into fewer schedulable units.
+        Chains where a block is the only child of its only parent are
+        contracted first, then blocks at the same depth that share
+        loads are greedily grouped up to granularity blocks per unit.
+        Inside a unit loads are de-duplicated and writes whose readers
+        all sit in the same unit are elided, unless they go to one of
+        the outputs matrices (if outputs is None every write is kept).
+        @param inst_blocks - list of InstructionBlocks
+        @param granularity - max number of blocks (or chains) per fused unit
+        @param outputs - matrices whose blocks must always be written
+    '''
+    children, parents = io_dependency_analyze(inst_blocks)
+    order = _topological_order(children, parents)
+    position = {b: n for n, b in enumerate(order)}
+
+    # contract chains
+    chain_of = list(range(len(inst_blocks)))
+    for b in order:
+        ps = set(parents[b])
+        if (len(ps) == 1):
+            p = ps.pop()
+            if (set(children[p]) == set([b])):
+                chain_of[b] = chain_of[p]
+    chains = {}
+    for b in order:
+        chains.setdefault(chain_of[b], []).append(b)
+    chain_ids = sorted(chains.keys(), key=lambda c: position[c])
+
+    # depth of every chain in the contracted DAG
+    depth = {}
+    for c in chain_ids:
+        parent_chains = set([chain_of[p] for b in chains[c] for p in parents[b]]) - set([c])
+        depth[c] = 1 + max([depth[p] for p in parent_chains]) if parent_chains else 0
+
+    # greedily group chains of equal depth that share loads
+    loads = {c: set([_block_key(inst) for b in chains[c] for inst in inst_blocks[b].instrs
+                     if isinstance(inst, RemoteLoad)]) for c in chain_ids}
+    by_depth = {}
+    for c in chain_ids:
+        by_depth.setdefault(depth[c], []).append(c)
+    units = []
+    for d in sorted(by_depth.keys()):
+        unassigned = list(by_depth[d])
+        while (len(unassigned) > 0):
+            seed = unassigned.pop(0)
+            shared = sorted(unassigned, key=lambda c: -len(loads[c] & loads[seed]))
+            members = [seed] + shared[:granularity - 1]
+            for c in members[1:]:
+                unassigned.remove(c)
+            units.append(sorted([b for c in members for b in chains[c]], key=lambda b: position[b]))
+
+    unit_of = {}
+    for u, unit in enumerate(units):
+        for b in unit:
+            unit_of[b] = u
+    readers = {}
+    for i, inst_block in enumerate(inst_blocks):
+        for inst in inst_block.instrs:
+            if isinstance(inst, RemoteLoad):
+                readers.setdefault(_block_key(inst), set()).add(unit_of[i])
+    output_ids = None if outputs is None else set([id(m) for m in outputs])
+    return [_fuse_unit([inst_blocks[b] for b in unit], u, readers, output_ids) for u, unit in enumerate(units)]
+
+def _fuse_unit(blocks, u, readers, output_ids):
+    if (len(blocks) == 1):
+        return blocks[0]
+    replace = {}
+    loaded = {}
+    written = {}
+    instrs = []
+    for inst_block in blocks:
+        for inst in inst_block.instrs:
+            if isinstance(inst, RemoteLoad):
+                key = _block_key(inst)
+                if (key in written):
+                    replace[id(inst)] = written[key]
+                    continue
+                if (key in loaded):
+                    replace[id(inst)] = loaded[key]
+                    continue
+                new_inst = copy.copy(inst)
+                loaded[key] = new_inst
+            elif isinstance(inst, RemoteWrite):
+                key = _block_key(inst)
+                new_inst = copy.copy(inst)
+                new_inst.data_instr = replace[id(inst.data_instr)]
+                written[key] = new_inst.data_instr
+                replace[id(inst)] = new_inst
+                if (output_ids is not None and id(inst.matrix) not in output_ids
+                        and readers.get(key) == set([u])):
+                    # every consumer is in this unit, skip the round trip to storage
+                    continue
+            else:
+                new_inst = copy.copy(inst)
+                new_inst.argv = [replace[id(x)] for x in inst.argv]
+            replace[id(inst)] = new_inst
+            instrs.append(new_inst)
+    label = "{0}+{1}".format(blocks[0].label, len(blocks) - 1)
+    return InstructionBlock(instrs, label=label)
+
+
+# programs already fetched by this worker, keyed by program id
+_PROGRAM_CACHE = {}
+_PROGRAM_CACHE_SIZE = 8
+
+def _program_key(program_id):
+    return "numpywren.lambdapack/{0}/program".format(program_id)
+
+def _to_csr(lists):
+    indptr = np.zeros(len(lists) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum([len(x) for x in lists])
+    indices = np.fromiter(itertools.chain.from_iterable(lists), dtype=np.int64, count=indptr[-1])
+    return indptr, indices
+
+def _from_csr(indptr, indices):
+    return [indices[s:e].tolist() for s, e in zip(indptr[:-1], indptr[1:])]
+
+def encode_instruction_blocks(inst_blocks):
+    ''' Encode instruction blocks as flat integer arrays plus a matrix table.
+        Return instructions are not encoded, they are rebuilt from program state.
+    '''
+    matrices = []
+    matrix_idxs = {}
+    opcodes, i_ids, matrix_col, bidxs, argvs, params, block_lens = [], [], [], [], [], [], []
+    for inst_block in inst_blocks:
+        count = 0
+        for inst in inst_block.instrs:
+            if (inst.i_code == OC.RET):
+                continue
+            matrix = getattr(inst, "matrix", None)
+            if (matrix is None):
+                matrix_col.append(-1)
+            else:
+                if (id(matrix) not in matrix_idxs):
+                    matrix_idxs[id(matrix)] = len(matrices)
+                    matrices.append(matrix)
+                matrix_col.append(matrix_idxs[id(matrix)])
+            if (isinstance(inst, RemoteWrite)):
+                argv = [inst.data_instr]
+            else:
+                argv = getattr(inst, "argv", [])
+            opcodes.append(inst.i_code.value)
+            i_ids.append(inst.id)
+            bidxs.append(getattr(inst, "bidxs", ()))
+            argvs.append([x.id for x in argv])
+            params.append(getattr(inst, "params", ()))
+            count += 1
+        block_lens.append(count)
+    return {"matrices": matrices,
+            "labels": [x.label for x in inst_blocks],
+            "block_indptr": np.concatenate([[0], np.cumsum(block_lens)]).astype(np.int64),
+            "opcodes": np.array(opcodes, dtype=np.int16),
+            "i_ids": np.array(i_ids, dtype=np.int64),
+            "matrix_idxs": np.array(matrix_col, dtype=np.int32),
+            "bidxs": _to_csr(bidxs),
+            "argvs": _to_csr(argvs),
+            "params": _to_csr(params)}
+
+def decode_instruction_blocks(encoded):
+    matrices = encoded["matrices"]
+    bidxs = _from_csr(*encoded["bidxs"])
+    argvs = _from_csr(*encoded["argvs"])
+    params = _from_csr(*encoded["params"])
+    opcodes = encoded["opcodes"].tolist()
+    i_ids = encoded["i_ids"].tolist()
+    matrix_idxs = encoded["matrix_idxs"].tolist()
+    block_indptr = encoded["block_indptr"].tolist()
+    inst_blocks = []
+    for b, label in enumerate(encoded["labels"]):
+        instrs = []
+        by_id = {}
+        for n in range(block_indptr[b], block_indptr[b+1]):
+            inst_type = _INSTRUCTION_TYPES[opcodes[n]]
+            argv = [by_id[x] for x in argvs[n]]
+            if (inst_type == RemoteLoad):
+                inst = RemoteLoad(i_ids[n], matrices[matrix_idxs[n]], *bidxs[n])
+            elif (inst_type == RemoteWrite):
+                inst = RemoteWrite(i_ids[n], matrices[matrix_idxs[n]], argv[0], *bidxs[n])
+            else:
+                inst = inst_type(i_ids[n], argv, *params[n])
+            by_id[inst.id] = inst
+            instrs.append(inst)
+        inst_blocks.append(InstructionBlock(instrs, label=label))
+    return inst_blocks
+
+def _load_program(bucket, program_id):
+    program = _PROGRAM_CACHE.get(program_id)
+    if (program is None):
+        client = matrix_utils.get_s3_client()
+        body = client.get_object(Bucket=bucket, Key=_program_key(program_id))['Body'].read()
+        program = pickle.loads(body)
+        if (len(_PROGRAM_CACHE) >= _PROGRAM_CACHE_SIZE):
+            _PROGRAM_CACHE.clear()
+        _PROGRAM_CACHE[program_id] = program
+    return program
+
+def run_program_node(bucket, program_node):
+    ''' Entry point of every LambdaPack invocation '''
+    program_id, i = program_node[:2]
+    enqueue_time = program_node[2] if len(program_node) > 2 else None
+    cache_scope = program_node[3] if len(program_node) > 3 else program_id
+    program = _load_program(bucket, program_id)
+    # children launched by this invocation stay in the scope of its attempt
+    program.cache_scope = cache_scope
+    _BLOCK_CACHE.max_bytes = program.block_cache_bytes
+    _BLOCK_CACHE.set_scope(cache_scope)
+    program._invocation_start = time.time()
+    try:
+        return program.pywren_func(i, enqueue_time=enqueue_time)
+    finally:
+        # the invocation may be frozen once it returns, finish deleting first
+        _GARBAGE.flush()
+
+
+def make_column_update(pc, L_out, L_in, b0, b1, label=None):
     L_load = RemoteLoad(pc, L_in, b0, b1)
     pc += 1
-    L_bb_inv_load = RemoteLoad(pc, L_bb_inv, 0, 0)
+    L_bb_load = RemoteLoad(pc, L_out, b1, b1)
     pc += 1
-    trsm = RemoteTRSM(pc, [L_load, L_bb_inv_load])
+    trsm = RemoteTRSM(pc, [L_load, L_bb_load])
     pc += 1
     write = RemoteWrite(pc, L_out, trsm, b0, b1)
-    return InstructionBlock([L_load, L_bb_inv_load, trsm, write], label=label), 4
+    return InstructionBlock([L_load, L_bb_load, trsm, write], label=label), 4
 
 def make_low_rank_update(pc, L_out, L_prev, L_final,  b0, b1, b2, label=None):
     old_block_load = RemoteLoad(pc, L_prev, b1, b2)
     pc += 1
     block_1_load = RemoteLoad(pc, L_final, b1, b0)
     pc += 1
+    if (b1 == b2):
+        update = RemoteSYRK(pc, [old_block_load, block_1_load])
+        pc += 1
+        write = RemoteWrite(pc, L_out, update, b1, b2)
+        return InstructionBlock([old_block_load, block_1_load, update, write], label=label), 4
     block_2_load = RemoteLoad(pc, L_final, b2, b0)
     pc += 1
-    syrk = RemoteSYRK(pc, [old_block_load, block_1_load, block_2_load])
+    update = RemoteGEMM(pc, [old_block_load, block_1_load, block_2_load])
     pc += 1
-    write = RemoteWrite(pc, L_out, syrk, b1, b2)
-    return InstructionBlock([old_block_load, block_1_load, block_2_load, syrk, write], label=label), 5
+    write = RemoteWrite(pc, L_out, update, b1, b2)
+    return InstructionBlock([old_block_load, block_1_load, block_2_load, update, write], label=label), 5
 
-def make_local_cholesky_and_inverse(pc, L_out, L_bb_inv_out, L_in, b0, label=None):
+def make_local_cholesky(pc, L_out, L_in, b0, label=None):
     block_load = RemoteLoad(pc, L_in, b0, b0)
     pc += 1
     cholesky = RemoteCholesky(pc, [block_load])
     pc += 1
-    inverse = RemoteInverse(pc, [cholesky])
-    pc += 1
     write_diag = RemoteWrite(pc, L_out, cholesky, b0, b0)
     pc += 1
-    write_inverse = RemoteWrite(pc, L_bb_inv_out, inverse, 0, 0)
-    pc += 1
-    return InstructionBlock([block_load, cholesky, inverse, write_diag, write_inverse], label=label), 5
+    return InstructionBlock([block_load, cholesky, write_diag], label=label), 3
 
 
 def make_remote_gemm(pc, XY, X, Y, b0, b1, b2, label=None):
@@ -608,39 +1709,34 @@ def _chol(X, out_bucket=None):
     L = BigMatrix(out_key, shape=(X.shape[0], X.shape[0]), bucket=out_bucket, shard_sizes=[X.shard_sizes[0], X.shard_sizes[0]], parent_fn=constant_zeros, write_header=True)
     # generate intermediate matrices
     trailing = [X]
-    cholesky_diag_inverses = []
-    all_blocks = list(L.block_idxs)
-    block_idxs = sorted(X._block_idxs(0))
-
     for i,j0 in enumerate(X._block_idxs(0)):
         L_trailing = BigMatrix(out_key + "_{0}_trailing".format(i),
                        shape=(X.shape[0], X.shape[0]),
                        bucket=out_bucket,
                        shard_sizes=[X.shard_sizes[0], X.shard_sizes[0]],
                        parent_fn=constant_zeros)
-        block_size =  min(X.shard_sizes[0], X.shape[0] - X.shard_sizes[0]*j0)
-        L_bb_inv = BigMatrix(out_key + "_({0},{0})_inv".format(i),
-                             shape=(block_size, block_size),
-                             bucket=out_bucket,
-                             shard_sizes=[block_size, block_size],
-                             parent_fn=constant_zeros)
-
         trailing.append(L_trailing)
-        cholesky_diag_inverses.append(L_bb_inv)
     trailing.append(L)
+    all_instructions = _chol_instructions(trailing)
+    return all_instructions, trailing[-1], trailing[:-1]
+
+def _chol_instructions(trailing):
+    ''' Instruction blocks of a right looking tiled cholesky, trailing[0] is the
+        input, trailing[i] the trailing matrix after i steps and trailing[-1] the output
+    '''
+    block_idxs = sorted(trailing[0]._block_idxs(0))
     all_instructions = []
 
     pc = 0
     par_block = 0
     for i in block_idxs:
-        L_inv = cholesky_diag_inverses[i]
-        instructions, count = make_local_cholesky_and_inverse(pc, trailing[-1], L_inv, trailing[i], i, label="local")
+        instructions, count = make_local_cholesky(pc, trailing[-1], trailing[i], i, label="local")
         all_instructions.append(instructions)
         pc += count
         par_count = 0
         parallel_block = []
         for j in block_idxs[i+1:]:
-            instructions, count = make_column_update(pc, trailing[-1], trailing[i], L_inv, j, i, label="parallel_block_{0}_job_{1}".format(par_block, par_count))
+            instructions, count = make_column_update(pc, trailing[-1], trailing[i], j, i, label="parallel_block_{0}_job_{1}".format(par_block, par_count))
             all_instructions.append(instructions)
             pc += count
             par_count += 1
@@ -656,7 +1752,407 @@ def _chol(X, out_bucket=None):
                 pc += count
                 par_count += 1
         #all_instructions.append(PywrenInstructionBlock(pwex, parallel_block))
-    return all_instructions, trailing[-1], trailing[:-1]
+    return all_instructions
 
 
 
+
+def make_lu_panel(pc, LU, L_panel, perms, T, k, block_idxs, label=None):
+    loads = []
+    for i in block_idxs[k:]:
+        loads.append(RemoteLoad(pc, T, i, k))
+        pc += 1
+    getrf = RemoteGETRF(pc, loads, LU.shape[0])
+    pc += 1
+    instrs = loads + [getrf]
+    for n, i in enumerate(block_idxs[k:]):
+        select = RemoteIndex(pc, [getrf], n)
+        pc += 1
+        # the diagonal block is final, L blocks still see the pivots of later panels
+        write = RemoteWrite(pc, LU if i == k else L_panel, select, i, k)
+        pc += 1
+        instrs += [select, write]
+    select = RemoteIndex(pc, [getrf], len(loads))
+    pc += 1
+    write = RemoteWrite(pc, perms, select, k, 0)
+    instrs += [select, write]
+    return InstructionBlock(instrs, label=label), len(instrs)
+
+def make_lu_row_update(pc, LU, swapped, perms, T, k, j, block_idxs, label=None):
+    diag_load = RemoteLoad(pc, LU, k, k)
+    pc += 1
+    perm_load = RemoteLoad(pc, perms, k, 0)
+    pc += 1
+    loads = []
+    for i in block_idxs[k:]:
+        loads.append(RemoteLoad(pc, T, i, j))
+        pc += 1
+    swap_trsm = RemoteSwapTRSM(pc, [diag_load, perm_load] + loads)
+    pc += 1
+    instrs = [diag_load, perm_load] + loads + [swap_trsm]
+    for n, i in enumerate(block_idxs[k:]):
+        select = RemoteIndex(pc, [swap_trsm], n)
+        pc += 1
+        write = RemoteWrite(pc, LU if i == k else swapped, select, i, j)
+        pc += 1
+        instrs += [select, write]
+    return InstructionBlock(instrs, label=label), len(instrs)
+
+def make_lu_trailing_update(pc, T_out, swapped, L_panel, LU, k, i, j, label=None):
+    old_block_load = RemoteLoad(pc, swapped, i, j)
+    pc += 1
+    L_load = RemoteLoad(pc, L_panel, i, k)
+    pc += 1
+    U_load = RemoteLoad(pc, LU, k, j)
+    pc += 1
+    update = RemoteGEMM(pc, [old_block_load, L_load, U_load], trans_a=0, trans_b=0)
+    pc += 1
+    write = RemoteWrite(pc, T_out, update, i, j)
+    return InstructionBlock([old_block_load, L_load, U_load, update, write], label=label), 5
+
+def make_lu_pivot_fix(pc, LU, L_panel, perms, k, block_idxs, label=None):
+    loads = []
+    for s in block_idxs[k+1:]:
+        loads.append(RemoteLoad(pc, perms, s, 0))
+        pc += 1
+    for i in block_idxs[k+1:]:
+        loads.append(RemoteLoad(pc, L_panel, i, k))
+        pc += 1
+    laswp = RemoteLASWP(pc, loads, len(block_idxs[k+1:]))
+    pc += 1
+    instrs = loads + [laswp]
+    for n, i in enumerate(block_idxs[k+1:]):
+        select = RemoteIndex(pc, [laswp], n)
+        pc += 1
+        write = RemoteWrite(pc, LU, select, i, k)
+        pc += 1
+        instrs += [select, write]
+    return InstructionBlock(instrs, label=label), len(instrs)
+
+def _lu(X, out_bucket=None):
+    '''
+        Tiled right looking LU with partial pivoting, every panel is factored
+        by a single node so pivots are searched over the whole column.
+        Returns the instructions, the packed LU factors, the per panel row
+        permutations and the intermediate matrices.
+    '''
+    if (X.shape[0] != X.shape[1] or X.shard_sizes[0] != X.shard_sizes[1]):
+        raise Exception("LU needs a square matrix with square blocks")
+    if (out_bucket == None):
+        out_bucket = X.bucket
+    out_key = generate_key_name_uop(X, "lu")
+    shape = (X.shape[0], X.shape[0])
+    shard_sizes = [X.shard_sizes[0], X.shard_sizes[0]]
+    num_blocks = len(X._block_idxs(0))
+    LU = BigMatrix(out_key, shape=shape, bucket=out_bucket, shard_sizes=shard_sizes, write_header=True)
+    perms = BigMatrix(out_key + "_perms", shape=(num_blocks, X.shape[0]), bucket=out_bucket,
+                      shard_sizes=[1, X.shape[0]], dtype=np.int64, write_header=True)
+    L_panel = BigMatrix(out_key + "_L_panel", shape=shape, bucket=out_bucket, shard_sizes=shard_sizes)
+    trailing = [X]
+    swapped = []
+    for k in range(num_blocks - 1):
+        trailing.append(BigMatrix(out_key + "_{0}_trailing".format(k + 1), shape=shape, bucket=out_bucket, shard_sizes=shard_sizes))
+        swapped.append(BigMatrix(out_key + "_{0}_swapped".format(k), shape=shape, bucket=out_bucket, shard_sizes=shard_sizes))
+    all_instructions = _lu_instructions(LU, perms, L_panel, trailing, swapped)
+    return all_instructions, LU, perms, [L_panel] + trailing[1:] + swapped
+
+def _lu_instructions(LU, perms, L_panel, trailing, swapped):
+    ''' Instruction blocks of a tiled LU, trailing[k] is the trailing matrix
+        before panel k and swapped[k] holds it after the panel k row swaps
+    '''
+    block_idxs = sorted(trailing[0]._block_idxs(0))
+    all_instructions = []
+    pc = 0
+    for k in block_idxs:
+        instructions, count = make_lu_panel(pc, LU, L_panel, perms, trailing[k], k, block_idxs, label="getrf_{0}".format(k))
+        all_instructions.append(instructions)
+        pc += count
+        for j in block_idxs[k+1:]:
+            instructions, count = make_lu_row_update(pc, LU, swapped[k], perms, trailing[k], k, j, block_idxs,
+                                                     label="swap_trsm_{0}_{1}".format(k, j))
+            all_instructions.append(instructions)
+            pc += count
+        for i in block_idxs[k+1:]:
+            for j in block_idxs[k+1:]:
+                instructions, count = make_lu_trailing_update(pc, trailing[k+1], swapped[k], L_panel, LU, k, i, j,
+                                                              label="gemm_{0}_{1}_{2}".format(k, i, j))
+                all_instructions.append(instructions)
+                pc += count
+    # L blocks are final once every later panel has pivoted
+    for k in block_idxs[:-1]:
+        instructions, count = make_lu_pivot_fix(pc, LU, L_panel, perms, k, block_idxs, label="laswp_{0}".format(k))
+        all_instructions.append(instructions)
+        pc += count
+    return all_instructions
+
+def lu_permutation(perms):
+    ''' Compose the per panel permutations of _lu, X[perm] = L U '''
+    rows = perms.numpy()
+    perm = np.arange(perms.shape[1])
+    for k in range(rows.shape[0]):
+        perm = perm[rows[k]]
+    return perm
+
+def make_triangular_solve(pc, X, L, T, k, c, lower, transpose, label=None):
+    L_load = RemoteLoad(pc, L, k, k)
+    pc += 1
+    rhs_load = RemoteLoad(pc, T, k, c)
+    pc += 1
+    solve = RemoteTriangularSolve(pc, [L_load, rhs_load], lower=lower, trans=transpose)
+    pc += 1
+    write = RemoteWrite(pc, X, solve, k, c)
+    return InstructionBlock([L_load, rhs_load, solve, write], label=label), 4
+
+def make_rhs_update(pc, T_out, T, L, X, k, i, c, transpose, label=None):
+    old_block_load = RemoteLoad(pc, T, i, c)
+    pc += 1
+    # block (i, k) of op(L)
+    if (transpose):
+        L_load = RemoteLoad(pc, L, k, i)
+    else:
+        L_load = RemoteLoad(pc, L, i, k)
+    pc += 1
+    X_load = RemoteLoad(pc, X, k, c)
+    pc += 1
+    update = RemoteGEMM(pc, [old_block_load, L_load, X_load], trans_a=transpose, trans_b=0)
+    pc += 1
+    write = RemoteWrite(pc, T_out, update, i, c)
+    return InstructionBlock([old_block_load, L_load, X_load, update, write], label=label), 5
+
+def _trsm(L, B, lower=True, transpose=False, out_bucket=None):
+    '''
+        Blocked substitution solving op(L) X = B, op(L) is L or L^T.
+        Only the triangle of L selected by lower is read.
+        Returns the instructions, X and the intermediate matrices.
+    '''
+    if (L.shape[0] != L.shape[1] or L.shard_sizes[0] != L.shard_sizes[1]):
+        raise Exception("L must be square with square blocks")
+    if (len(B.shape) != 2):
+        raise Exception("B must be a matrix, store a single right hand side as an n x 1 matrix")
+    if (B.shape[0] != L.shape[0] or B.shard_sizes[0] != L.shard_sizes[0]):
+        raise Exception("B rows must be sharded like L")
+    if (out_bucket == None):
+        out_bucket = B.bucket
+    op = "trsm" + ("" if lower else "_upper") + ("_t" if transpose else "")
+    out_key = generate_key_name_binop(L, B, op)
+    X = BigMatrix(out_key, shape=B.shape, bucket=out_bucket, shard_sizes=B.shard_sizes, dtype=B.dtype, write_header=True)
+    trailing = [B]
+    for k in range(len(L._block_idxs(0)) - 1):
+        trailing.append(BigMatrix(out_key + "_{0}_trailing".format(k + 1), shape=B.shape, bucket=out_bucket,
+                                  shard_sizes=B.shard_sizes, dtype=B.dtype))
+    all_instructions = _trsm_instructions(L, X, trailing, lower, transpose)
+    return all_instructions, X, trailing[1:]
+
+def _trsm_instructions(L, X, trailing, lower, transpose):
+    ''' Instruction blocks of a right looking blocked substitution, trailing[n] is
+        the right hand side after n block rows of X have been eliminated
+    '''
+    block_idxs = sorted(L._block_idxs(0))
+    rhs_idxs = sorted(trailing[0]._block_idxs(1))
+    # forward substitution when op(L) is lower triangular, back substitution otherwise
+    if (bool(lower) == bool(transpose)):
+        block_idxs = block_idxs[::-1]
+    all_instructions = []
+    pc = 0
+    for n, k in enumerate(block_idxs):
+        for c in rhs_idxs:
+            instructions, count = make_triangular_solve(pc, X, L, trailing[n], k, c, lower, transpose,
+                                                        label="trsm_{0}_{1}".format(k, c))
+            all_instructions.append(instructions)
+            pc += count
+        for i in block_idxs[n+1:]:
+            for c in rhs_idxs:
+                instructions, count = make_rhs_update(pc, trailing[n+1], trailing[n], L, X, k, i, c, transpose,
+                                                      label="gemm_{0}_{1}_{2}".format(k, i, c))
+                all_instructions.append(instructions)
+                pc += count
+    return all_instructions
+
+def qr_tree(rows, arity):
+    '''
+        Reduction tree of a TSQR over the given row blocks, arity children per node.
+        Returns the nodes bottom up as (level, children), a child is ("row", i)
+        for an input row block or ("node", n) for an earlier node. The last
+        node is the root, a group left with a single child skips its level.
+    '''
+    if (arity < 2):
+        raise Exception("The tree arity must be at least 2")
+    nodes = []
+    entries = [("row", i) for i in rows]
+    level = 1
+    while (len(nodes) == 0 or len(entries) > 1):
+        next_entries = []
+        for g in range(0, len(entries), arity):
+            group = entries[g:g+arity]
+            if (len(group) == 1 and len(entries) > 1):
+                next_entries.append(group[0])
+                continue
+            nodes.append((level, group))
+            next_entries.append(("node", len(nodes) - 1))
+        entries = next_entries
+        level += 1
+    return nodes
+
+def _tree_leader(nodes, entry):
+    ''' First row block under a tree entry '''
+    while (entry[0] == "node"):
+        entry = nodes[entry[1]][1][0]
+    return entry[1]
+
+def make_qr_factor(pc, nodes, g, T, V, tau, tops, R, k, label=None):
+    level, children = nodes[g]
+    loads = []
+    for c in children:
+        matrix = T if c[0] == "row" else tops
+        loads.append(RemoteLoad(pc, matrix, c[1], k))
+        pc += 1
+    geqrf = RemoteGEQRF(pc, loads, V.shard_sizes[0])
+    pc += 1
+    instrs = loads + [geqrf]
+    outs = [(V, g, 0), (tau, g, 0)]
+    # the root holds the final R, other nodes pass theirs up the tree
+    outs.append((R, k, k) if g == len(nodes) - 1 else (tops, g, k))
+    for n, (matrix, b0, b1) in enumerate(outs):
+        select = RemoteIndex(pc, [geqrf], n)
+        pc += 1
+        write = RemoteWrite(pc, matrix, select, b0, b1)
+        pc += 1
+        instrs += [select, write]
+    return InstructionBlock(instrs, label=label), len(instrs)
+
+def make_qr_update(pc, nodes, g, T, T_next, V, tau, tops, R, k, j, label=None):
+    level, children = nodes[g]
+    V_load = RemoteLoad(pc, V, g, 0)
+    pc += 1
+    tau_load = RemoteLoad(pc, tau, g, 0)
+    pc += 1
+    loads = []
+    for c in children:
+        matrix = T if c[0] == "row" else tops
+        loads.append(RemoteLoad(pc, matrix, c[1], j))
+        pc += 1
+    ormqr = RemoteORMQR(pc, [V_load, tau_load] + loads)
+    pc += 1
+    instrs = [V_load, tau_load] + loads + [ormqr]
+    outs = [(R, k, j) if g == len(nodes) - 1 else (tops, g, j)]
+    # the rows every other child contributed are done with this panel,
+    # they become the trailing matrix rows of the child's first row block
+    outs += [(T_next, _tree_leader(nodes, c), j) for c in children[1:]]
+    for n, (matrix, b0, b1) in enumerate(outs):
+        select = RemoteIndex(pc, [ormqr], n)
+        pc += 1
+        write = RemoteWrite(pc, matrix, select, b0, b1)
+        pc += 1
+        instrs += [select, write]
+    return InstructionBlock(instrs, label=label), len(instrs)
+
+def make_tsqr_expand(pc, nodes, g, X, Q, V, tau, W, label=None):
+    level, children = nodes[g]
+    V_load = RemoteLoad(pc, V, g, 0)
+    pc += 1
+    tau_load = RemoteLoad(pc, tau, g, 0)
+    pc += 1
+    argv = [V_load, tau_load]
+    if (g != len(nodes) - 1):
+        argv.append(RemoteLoad(pc, W, g, 0))
+        pc += 1
+    rows = []
+    for c in children:
+        if (c[0] == "row"):
+            start, end = X._blocks(0)[c[1]]
+            rows.append(end - start)
+        else:
+            rows.append(X.shape[1])
+    orgqr = RemoteORGQR(pc, argv, *rows)
+    pc += 1
+    instrs = argv + [orgqr]
+    for n, c in enumerate(children):
+        select = RemoteIndex(pc, [orgqr], n)
+        pc += 1
+        write = RemoteWrite(pc, Q if c[0] == "row" else W, select, c[1], 0)
+        pc += 1
+        instrs += [select, write]
+    return InstructionBlock(instrs, label=label), len(instrs)
+
+def _qr(X, arity=2, out_bucket=None):
+    '''
+        Householder QR as LambdaPack programs. Each block column panel is reduced
+        with a TSQR tree of the given arity, and every tree node applies its Q^T to
+        the trailing columns (CAQR). A single column block gives a plain TSQR.
+        Returns the instructions, R, the reflectors (V, tau) of every panel and
+        the intermediate matrices.
+    '''
+    m, n = X.shape
+    row_idxs = sorted(X._block_idxs(0))
+    col_idxs = sorted(X._block_idxs(1))
+    if (m < n):
+        raise Exception("QR needs at least as many rows as columns")
+    if (len(col_idxs) == 1):
+        if (X.shard_sizes[0] < n):
+            raise Exception("TSQR row blocks must have at least as many rows as X has columns")
+    elif (X.shard_sizes[0] != X.shard_sizes[1]):
+        raise Exception("Blocked QR needs square blocks")
+    if (out_bucket == None):
+        out_bucket = X.bucket
+    out_key = generate_key_name_uop(X, "qr")
+    b = X.shard_sizes[1]
+    R = BigMatrix(out_key, shape=(n, n), bucket=out_bucket, shard_sizes=[b, b], parent_fn=constant_zeros, write_header=True)
+    # reflectors of a node are stored zero padded to the tallest possible stack
+    num_rows = arity*max(X.shard_sizes[0], b)
+    T = X
+    all_instructions = []
+    reflectors = []
+    intermediates = []
+    pc = 0
+    for k in col_idxs:
+        start, end = X._blocks(1)[k]
+        width = end - start
+        nodes = qr_tree(row_idxs[k:], arity)
+        V = BigMatrix(out_key + "_{0}_reflectors".format(k), shape=(len(nodes)*num_rows, width), bucket=out_bucket,
+                      shard_sizes=[num_rows, width])
+        tau = BigMatrix(out_key + "_{0}_tau".format(k), shape=(len(nodes), width), bucket=out_bucket, shard_sizes=[1, width])
+        tops = BigMatrix(out_key + "_{0}_tops".format(k), shape=(len(nodes)*width, n), bucket=out_bucket, shard_sizes=[width, b])
+        reflectors.append((V, tau))
+        intermediates.append(tops)
+        T_next = None
+        if (k != col_idxs[-1]):
+            T_next = BigMatrix(out_key + "_{0}_trailing".format(k + 1), shape=X.shape, bucket=out_bucket, shard_sizes=X.shard_sizes)
+            intermediates.append(T_next)
+        prefix = "tsqr" if len(col_idxs) == 1 else "qr_{0}".format(k)
+        for g, (level, _) in enumerate(nodes):
+            label = "{0}_level_{1}_node_{2}".format(prefix, level, g)
+            instructions, count = make_qr_factor(pc, nodes, g, T, V, tau, tops, R, k, label=label)
+            all_instructions.append(instructions)
+            pc += count
+            for j in col_idxs[k+1:]:
+                instructions, count = make_qr_update(pc, nodes, g, T, T_next, V, tau, tops, R, k, j,
+                                                     label="{0}_col_{1}".format(label, j))
+                all_instructions.append(instructions)
+                pc += count
+        T = T_next
+    return all_instructions, R, reflectors, intermediates
+
+def _tsqr_q(X, V, tau, arity=2, out_bucket=None):
+    '''
+        Form the thin Q of a TSQR of X from the reflectors stored by _qr, walking
+        the tree from the root down. Returns the instructions, Q and the
+        intermediate matrices.
+    '''
+    if (len(X._block_idxs(1)) != 1):
+        raise Exception("An explicit Q is only formed for a single column block")
+    if (out_bucket == None):
+        out_bucket = X.bucket
+    out_key = generate_key_name_uop(X, "qr") + "_q"
+    n = X.shape[1]
+    nodes = qr_tree(sorted(X._block_idxs(0)), arity)
+    Q = BigMatrix(out_key, shape=X.shape, bucket=out_bucket, shard_sizes=X.shard_sizes, write_header=True)
+    # W of a node is the product of the Q factors above it, restricted to its rows
+    W = BigMatrix(out_key + "_W", shape=(len(nodes)*n, n), bucket=out_bucket, shard_sizes=[n, n])
+    all_instructions = []
+    pc = 0
+    for g in reversed(range(len(nodes))):
+        label = "tsqr_q_level_{0}_node_{1}".format(nodes[g][0], g)
+        instructions, count = make_tsqr_expand(pc, nodes, g, X, Q, V, tau, W, label=label)
+        all_instructions.append(instructions)
+        pc += count
+    return all_instructions, Q, [W]
@@ -0,0 +1,381 @@
+'''
+Run numpywren on a single machine without AWS.
+
+LocalExecutor implements the subset of the pywren executor API numpywren
+uses (map, call_async, futures with result()) on top of a pool of forked
+worker processes. Every worker pins its BLAS to a fixed number of threads.
+
+Setting the NUMPYWREN_LOCAL_STORAGE environment variable (see
+use_local_storage) points every S3 and DynamoDB client numpywren creates at
+directories under that path instead, so BigMatrices and LambdaPack program
+state live on the local disk.
+'''
+import fcntl
+import io
+import json
+import multiprocessing
+import os
+import re
+import threading
+import traceback
+import urllib.parse
+
+import botocore
+import cloudpickle
+from threadpoolctl import threadpool_limits
+
+LOCAL_STORAGE_ENV = "NUMPYWREN_LOCAL_STORAGE"
+_BLAS_ENV_VARS = ["OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"]
+# longest file name LocalS3Client writes, leaves room for temporary file suffixes
+_MAX_NAME = 200
+
+
+def use_local_storage(root):
+    ''' Keep matrices and program state under root, must be called before
+        the first LocalExecutor is created so its workers inherit it
+    '''
+    os.makedirs(root, exist_ok=True)
+    os.environ[LOCAL_STORAGE_ENV] = os.path.abspath(root)
+
+def local_storage_root():
+    return os.environ.get(LOCAL_STORAGE_ENV)
+
+def _client_error(code, operation):
+    return botocore.exceptions.ClientError({"Error": {"Code": code, "Message": code}}, operation)
+
+def _quote(name):
+    return urllib.parse.quote(name, safe='')
+
+
+class LocalS3Client(object):
+    ''' The S3 client calls numpywren makes, one file per object '''
+    def __init__(self, root):
+        self.root = os.path.join(root, "s3")
+
+    def _bucket_dir(self, bucket):
+        bucket_dir = os.path.join(self.root, _quote(bucket))
+        os.makedirs(bucket_dir, exist_ok=True)
+        return bucket_dir
+
+    def _path(self, bucket, key):
+        # keys of nested matrix names outgrow the file name limit, long keys are
+        # split over directories whose names end in "+", which _quote never emits
+        name = _quote(key)
+        parts = [name[i:i + _MAX_NAME] for i in range(0, len(name), _MAX_NAME)]
+        key_dir = os.path.join(self._bucket_dir(bucket), *[part + "+" for part in parts[:-1]])
+        os.makedirs(key_dir, exist_ok=True)
+        return os.path.join(key_dir, parts[-1])
+
+    def get_object(self, Bucket, Key, **kwargs):
+        try:
+            with open(self._path(Bucket, Key), "rb") as f:
+                body = f.read()
+        except FileNotFoundError:
+            raise _client_error("NoSuchKey", "GetObject")
+        return {"Body": io.BytesIO(body), "ContentLength": len(body)}
+
+    def head_object(self, Bucket, Key, **kwargs):
+        try:
+            return {"ContentLength": os.path.getsize(self._path(Bucket, Key))}
+        except FileNotFoundError:
+            raise _client_error("404", "HeadObject")
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        if (hasattr(Body, "read")):
+            Body = Body.read()
+        if (isinstance(Body, str)):
+            Body = Body.encode("utf-8")
+        path = self._path(Bucket, Key)
+        tmp_path = "{0}.{1}.{2}.tmp".format(path, os.getpid(), threading.get_ident())
+        with open(tmp_path, "wb") as f:
+            f.write(Body)
+        # readers never see a partially written object
+        os.replace(tmp_path, path)
+        return {}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        try:
+            os.remove(self._path(Bucket, Key))
+        except FileNotFoundError:
+            pass
+        return {}
+
+    def delete_objects(self, Bucket, Delete, **kwargs):
+        for obj in Delete["Objects"]:
+            self.delete_object(Bucket, obj["Key"])
+        return {"Deleted": [{"Key": obj["Key"]} for obj in Delete["Objects"]]}
+
+    def list_objects(self, Bucket, Prefix="", **kwargs):
+        bucket_dir = self._bucket_dir(Bucket)
+        contents = []
+        for dirpath, _, filenames in os.walk(bucket_dir):
+            rel_dir = os.path.relpath(dirpath, bucket_dir)
+            head = "" if rel_dir == "." else "".join([part[:-1] for part in rel_dir.split(os.sep)])
+            for name in filenames:
+                if (name.endswith(".tmp")):
+                    continue
+                key = urllib.parse.unquote(head + name)
+                if (key.startswith(Prefix)):
+                    contents.append({"Key": key, "Size": os.path.getsize(os.path.join(dirpath, name))})
+        contents.sort(key=lambda x: x["Key"])
+        response = {"IsTruncated": False}
+        if (len(contents) > 0):
+            response["Contents"] = contents
+        return response
+
+
+class LocalDynamoDBClient(object):
+    '''
+        The DynamoDB client calls LambdaPack state makes, one json file per item.
+        Every call holds an exclusive lock on the table so conditional updates
+        are atomic across threads and processes.
+    '''
+    def __init__(self, root):
+        self.root = os.path.join(root, "dynamodb")
+
+    def _table_dir(self, table_name):
+        table_dir = os.path.join(self.root, _quote(table_name))
+        os.makedirs(table_dir, exist_ok=True)
+        return table_dir
+
+    def _locked(self, table_name):
+        return _FileLock(self._table_dir(table_name) + ".lock")
+
+    def _path(self, table_name, key):
+        return os.path.join(self._table_dir(table_name), _quote(json.dumps(key, sort_keys=True)))
+
+    def _read(self, path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _write(self, path, item):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(item, f)
+        os.replace(tmp_path, path)
+
+    def put_item(self, TableName, Item, **kwargs):
+        key = {"id": Item["id"]}
+        with self._locked(TableName):
+            self._write(self._path(TableName, key), Item)
+        return {}
+
+    def get_item(self, TableName, Key, **kwargs):
+        with self._locked(TableName):
+            item = self._read(self._path(TableName, Key))
+        if (item is None):
+            return {}
+        return {"Item": item}
+
+    def delete_item(self, TableName, Key, **kwargs):
+        with self._locked(TableName):
+            try:
+                os.remove(self._path(TableName, Key))
+            except FileNotFoundError:
+                pass
+        return {}
+
+    def update_item(self, TableName, Key, UpdateExpression, ExpressionAttributeValues=None,
+                    ConditionExpression=None, **kwargs):
+        values = ExpressionAttributeValues or {}
+        path = self._path(TableName, Key)
+        with self._locked(TableName):
+            item = self._read(path)
+            if (ConditionExpression is not None and not _check_condition(item, ConditionExpression, values)):
+                raise _client_error("ConditionalCheckFailedException", "UpdateItem")
+            if (item is None):
+                item = dict(Key)
+            _apply_update(item, UpdateExpression, values)
+            self._write(path, item)
+        return {"Attributes": item}
+
+
+def _number(attribute):
+    value = attribute["N"]
+    return float(value) if "." in value else int(value)
+
+def _check_condition(item, expression, values):
+    match = re.match(r"^attribute_not_exists\((\w+)\)$", expression.strip())
+    if (match):
+        return item is None or match.group(1) not in item
+    match = re.match(r"^(\w+) = (:\w+)$", expression.strip())
+    if (match):
+        attr, value = match.groups()
+        return item is not None and attr in item and _number(item[attr]) == _number(values[value])
+    raise NotImplementedError("Condition expression {0} is not supported locally".format(expression))
+
+def _apply_update(item, expression, values):
+    match = re.match(r"^ADD (\w+) (:\w+)$", expression.strip())
+    if (match):
+        attr, value = match.groups()
+        old = _number(item[attr]) if attr in item else 0
+        item[attr] = {"N": str(old + _number(values[value]))}
+        return
+    match = re.match(r"^SET (\w+) = (:\w+)$", expression.strip())
+    if (match):
+        attr, value = match.groups()
+        item[attr] = values[value]
+        return
+    raise NotImplementedError("Update expression {0} is not supported locally".format(expression))
+
+
+class _FileLock(object):
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        self.f = open(self.path, "a")
+        fcntl.flock(self.f, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *args):
+        fcntl.flock(self.f, fcntl.LOCK_UN)
+        self.f.close()
+
+
+class LocalFuture(object):
+    ''' Handle to a task of the process pool, picklable so workers can
+        return the futures of the tasks they launch
+    '''
+    def __init__(self, task_id):
+        self.task_id = task_id
+
+    def result(self, timeout=None):
+        return _get_pool().result(self.task_id, timeout=timeout)
+
+    def done(self):
+        return _get_pool().done(self.task_id)
+
+
+class _ProcessPool(object):
+    def __init__(self, workers, blas_threads):
+        ctx = multiprocessing.get_context("fork")
+        self.owner = os.getpid()
+        self.workers = workers
+        self.blas_threads = blas_threads
+        self.tasks = ctx.Queue()
+        self.results = ctx.Queue()
+        self.next_task_id = ctx.Value('l', 0)
+        self.procs = [ctx.Process(target=_worker_loop, args=(self.tasks, self.results, blas_threads), daemon=True)
+                      for _ in range(workers)]
+        self.finished = {}
+        self.cond = threading.Condition()
+
+    def start(self):
+        for p in self.procs:
+            p.start()
+        # results are only collected in the process that created the pool,
+        # the thread is started after forking so no worker inherits it
+        collector = threading.Thread(target=self._collect, daemon=True)
+        collector.start()
+
+    def submit(self, func, data, extra_env):
+        with self.next_task_id.get_lock():
+            self.next_task_id.value += 1
+            task_id = self.next_task_id.value
+        self.tasks.put(cloudpickle.dumps((task_id, func, data, extra_env or {})))
+        return LocalFuture(task_id)
+
+    def _collect(self):
+        while (True):
+            task_id, success, value = cloudpickle.loads(self.results.get())
+            with self.cond:
+                self.finished[task_id] = (success, value)
+                self.cond.notify_all()
+
+    def done(self, task_id):
+        return task_id in self.finished
+
+    def result(self, task_id, timeout=None):
+        if (os.getpid() != self.owner):
+            raise Exception("LocalFuture results are only available in the process that created the executor")
+        with self.cond:
+            if (not self.cond.wait_for(lambda: task_id in self.finished, timeout=timeout)):
+                raise TimeoutError("Task {0} did not finish in {1} seconds".format(task_id, timeout))
+            success, value = self.finished[task_id]
+        if (not success):
+            raise value
+        return value
+
+    def shutdown(self):
+        for _ in self.procs:
+            self.tasks.put(None)
+        for p in self.procs:
+            p.join()
+
+
+def _worker_loop(tasks, results, blas_threads):
+    for var in _BLAS_ENV_VARS:
+        os.environ[var] = str(blas_threads)
+    while (True):
+        msg = tasks.get()
+        if (msg is None):
+            return
+        task_id, func, data, extra_env = cloudpickle.loads(msg)
+        old_env = dict([(k, os.environ.get(k)) for k in extra_env])
+        os.environ.update(extra_env)
+        try:
+            # forked workers inherit BLAS pools that already read the environment,
+            # so the thread count is set on the loaded libraries as well
+            threads = int(extra_env.get("OMP_NUM_THREADS", blas_threads))
+            with threadpool_limits(limits=threads):
+                value = (task_id, True, func(data))
+        except Exception as e:
+            traceback.print_exc()
+            value = (task_id, False, e)
+        finally:
+            for k, v in old_env.items():
+                if (v is None):
+                    os.environ.pop(k, None)
+                else:
+                    os.environ[k] = v
+        try:
+            payload = cloudpickle.dumps(value)
+        except Exception as e:
+            payload = cloudpickle.dumps((task_id, False, Exception("Unpicklable result: {0}".format(e))))
+        results.put(payload)
+
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+def _get_pool(workers=None, blas_threads=1):
+    global _POOL
+    # workers are forked once _POOL is set, they inherit it and never take the lock
+    if (_POOL is not None):
+        return _POOL
+    with _POOL_LOCK:
+        if (_POOL is None):
+            pool = _ProcessPool(workers or multiprocessing.cpu_count(), blas_threads)
+            _POOL = pool
+            pool.start()
+        return _POOL
+
+
+class LocalExecutor(object):
+    '''
+        pywren executor backed by a pool of local processes.
+
+        Every LocalExecutor of a process shares one pool, created by the first
+        executor with workers processes each pinned to blas_threads BLAS threads.
+        Executors created inside a worker submit to the same pool, so LambdaPack
+        invocations launched by other invocations stay on this machine.
+    '''
+    def __init__(self, config=None, workers=None, blas_threads=1):
+        self.config = config if config is not None else {}
+        self.invoker = None
+        self.pool = _get_pool(workers, blas_threads)
+
+    def call_async(self, func, data, extra_env=None, **kwargs):
+        # workers outlive use_local_storage calls, send the current root with every task
+        root = local_storage_root()
+        if (root is not None):
+            extra_env = dict(extra_env or {})
+            extra_env.setdefault(LOCAL_STORAGE_ENV, root)
+        return self.pool.submit(func, data, extra_env)
+
+    def map(self, func, iterdata, extra_env=None, **kwargs):
+        return [self.call_async(func, data, extra_env=extra_env) for data in iterdata]
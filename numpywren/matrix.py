@@ -238,7 +238,7 @@ class BigMatrix(object):
             X_block = self.parent_fn(self, *block_idx)
         else:
             bio = self.__s3_key_to_byte_io__(key)
-            X_block = np.load(bio).astype(self.dtype)
+            X_block = np.load(bio).astype(self.dtype, copy=False)
         if (self.transposed):
             X_block = X_block.T
         return X_block
@@ -298,7 +298,7 @@ class BigMatrix(object):
         http://boto3.readthedocs.io/en/latest/reference/services/s3.html#S3.Client.delete_object
         """
         key = self.__shard_idx_to_key__(block_idx)
-        client = boto3.client('s3')
+        client = matrix_utils.get_s3_client()
         return client.delete_object(Key=key, Bucket=self.bucket)
 
     def free(self):
@@ -372,7 +372,7 @@ class BigMatrix(object):
             return os.path.join(self.key_base, key_string)
 
     def __read_header__(self):
-        client = boto3.client('s3')
+        client = matrix_utils.get_s3_client()
         try:
             key = os.path.join(self.key_base, "header")
             header = json.loads(client.get_object(Bucket=self.bucket,
@@ -383,7 +383,7 @@ class BigMatrix(object):
 
     def __delete_header__(self):
         key = os.path.join(self.key_base, "header")
-        client = boto3.client('s3')
+        client = matrix_utils.get_s3_client()
         client.delete_object(Bucket=self.bucket, Key=key)
 
     def __block_idx_to_real_idx__(self, block_idx):
@@ -406,7 +406,7 @@ class BigMatrix(object):
         n_tries = 0
         max_n_tries = 5
         bio = None
-        client = boto3.client('s3')
+        client = matrix_utils.get_s3_client()
         while bio is None and n_tries <= max_n_tries:
             try:
                 bio = io.BytesIO(client.get_object(Bucket=self.bucket, Key=key)['Body'].read())
@@ -419,7 +419,7 @@ class BigMatrix(object):
 
     def __save_matrix_to_s3__(self, X, out_key, client=None):
         if (client == None):
-            client = boto3.client('s3')
+            client = matrix_utils.get_s3_client()
         outb = io.BytesIO()
         np.save(outb, X)
         response = client.put_object(Key=out_key,
@@ -430,7 +430,7 @@ class BigMatrix(object):
 
     def __write_header__(self):
         key = os.path.join(self.key_base, "header")
-        client = boto3.client('s3')
+        client = matrix_utils.get_s3_client()
         header = {}
         header['shape'] = self.shape
         header['shard_sizes'] = self.shard_sizes
@@ -563,7 +563,7 @@ class BigSymmetricMatrix(BigMatrix):
             X_block = self.parent_fn(self, *block_idx_sym)
         else:
             bio = self.__s3_key_to_byte_io__(key)
-            X_block = np.load(bio).astype(self.dtype)
+            X_block = np.load(bio).astype(self.dtype, copy=False)
         if (flipped):
             X_block = X_block.T
         if (len(list(set(block_idx))) == 1):
@@ -580,18 +580,18 @@ class BigSymmetricMatrix(BigMatrix):
         current_shape = tuple([e - s for s,e in real_idxs])
         if (block.shape != current_shape):
             raise Exception("Incompatible block size: {0} vs {1}".format(block.shape, current_shape))
-        key = self.__shard_idx_to_key__(block_idx)
+        key = self.__shard_idx_to_key__(block_idx_sym)
         block = block.astype(self.dtype)
         return self.__save_matrix_to_s3__(block, key)
 
 
     def delete_block(self, *block_idx):
-        client = boto3.client('s3')
+        client = matrix_utils.get_s3_client()
         block_idx_sym = self._symmetrize_idx(block_idx)
         if block_idx_sym != block_idx:
             flipped = True
         key = self.__shard_idx_to_key__(block_idx_sym)
-        client = boto3.client('s3')
+        client = matrix_utils.get_s3_client()
         return client.delete_object(Key=key, Bucket=self.bucket)
 
 
@@ -1,7 +1,9 @@
+import collections
 import concurrent.futures as fs
 import io
 import itertools
 import os
+import threading
 import time
 
 import boto3
@@ -10,10 +12,13 @@ import cloudpickle
 import numpy as np
 import hashlib
 import pickle
+import pywren
 import pywren.serialize as serialize
 import inspect
 import multiprocessing
 
+from . import local
+
 cpu_count = multiprocessing.cpu_count()
 
 class MmapArray():
@@ -33,6 +38,154 @@ class MmapArray():
         else:
             return X
 
+class BlockCache(object):
+    '''
+        Byte budgeted LRU cache of matrix blocks local to a worker.
+        Cached blocks are read only, consumers that update a block
+        in place have to copy it first.
+    '''
+    def __init__(self, max_bytes=2**29):
+        self.max_bytes = max_bytes
+        self.scope = None
+        self.blocks = collections.OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def _key(self, bigm, block_idx):
+        return (bigm.bucket, bigm.key_base, bigm.transposed, tuple(block_idx))
+
+    def set_scope(self, scope):
+        ''' Drop every cached block when the worker moves on to a different scope '''
+        with self.lock:
+            if (scope != self.scope):
+                self.blocks.clear()
+                self.size = 0
+                self.scope = scope
+
+    def contains(self, bigm, *block_idx):
+        return self._key(bigm, block_idx) in self.blocks
+
+    def get(self, bigm, *block_idx):
+        key = self._key(bigm, block_idx)
+        with self.lock:
+            block = self.blocks.get(key)
+            if (block is None):
+                self.misses += 1
+                return None
+            self.blocks.move_to_end(key)
+            self.hits += 1
+            return block
+
+    def put(self, block, bigm, *block_idx):
+        if (block.nbytes > self.max_bytes):
+            return
+        key = self._key(bigm, block_idx)
+        block = block.view()
+        block.flags.writeable = False
+        with self.lock:
+            old = self.blocks.pop(key, None)
+            if (old is not None):
+                self.size -= old.nbytes
+            self.blocks[key] = block
+            self.size += block.nbytes
+            while (self.size > self.max_bytes):
+                _, evicted = self.blocks.popitem(last=False)
+                self.size -= evicted.nbytes
+
+    def discard(self, bigm, *block_idx):
+        with self.lock:
+            block = self.blocks.pop(self._key(bigm, block_idx), None)
+            if (block is not None):
+                self.size -= block.nbytes
+
+    def clear(self):
+        with self.lock:
+            self.blocks.clear()
+            self.size = 0
+
+
+class PrefetchPipeline(object):
+    '''
+        Run fetch on the items ahead of their use on a pool of I/O threads.
+        Iterating yields (item, fetch(item)) in order. The next fetch starts once
+        the consumer hands back the current result, so at most depth results,
+        the consumer's included, are in flight or held at once.
+        Use as a context manager or call close() when done.
+
+        Parameters
+        ----------
+        fetch : callable
+            Called with every item on an I/O thread.
+        items : iterable
+            Items to fetch, in the order they are consumed.
+        depth : int
+            Results alive at once counting the one being consumed, 1 fetches synchronously.
+        threads : int, optional
+            Size of the I/O thread pool, defaults to depth.
+    '''
+    def __init__(self, fetch, items, depth=2, threads=None):
+        if (depth < 1):
+            raise Exception("Prefetch depth must be at least 1")
+        self.fetch = fetch
+        self.items = list(items)
+        self.depth = depth
+        self.executor = None
+        if (depth > 1):
+            self.executor = fs.ThreadPoolExecutor(threads or depth)
+        self.io_seconds = 0.0
+        self.wait_seconds = 0.0
+        self.lock = threading.Lock()
+
+    def _timed_fetch(self, item):
+        start = time.time()
+        try:
+            return self.fetch(item)
+        finally:
+            with self.lock:
+                self.io_seconds += time.time() - start
+
+    def __iter__(self):
+        if (self.executor is None):
+            for item in self.items:
+                start = time.time()
+                result = self._timed_fetch(item)
+                self.wait_seconds += time.time() - start
+                yield item, result
+            return
+        pending = collections.deque()
+        items = iter(self.items)
+        for item in itertools.islice(items, self.depth):
+            pending.append((item, self.executor.submit(self._timed_fetch, item)))
+        while (len(pending) > 0):
+            item, future = pending.popleft()
+            start = time.time()
+            result = future.result()
+            self.wait_seconds += time.time() - start
+            yield item, result
+            # the consumer is done with the result, its slot goes to the next fetch
+            del result
+            for next_item in itertools.islice(items, 1):
+                pending.append((next_item, self.executor.submit(self._timed_fetch, next_item)))
+
+    def stats(self):
+        ''' I/O seconds, seconds the consumer waited and the fraction of I/O hidden behind it '''
+        hidden = self.io_seconds - self.wait_seconds
+        return {"io_seconds": self.io_seconds,
+                "wait_seconds": self.wait_seconds,
+                "overlap_efficiency": max(0.0, hidden/self.io_seconds) if self.io_seconds > 0 else 0.0}
+
+    def close(self):
+        if (self.executor is not None):
+            self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
 def hash_string(s):
     return hashlib.sha1(s.encode('utf-8')).hexdigest()
 
@@ -58,17 +211,51 @@ def chunk(l, n):
     for i in range(0, len(l), n):
         yield l[i:i + n]
 
-def generate_key_name_binop(X, Y, op):
-    assert op == "gemm"
-    if (op == "gemm"):
-        key = "gemm({0}, {1})".format(str(X), str(Y))
+def hilbert_index(n, x, y):
+    """Distance of (x, y) along the Hilbert curve filling an n x n grid, n a power of 2"""
+    d = 0
+    s = n // 2
+    while (s > 0):
+        rx = int((x & s) > 0)
+        ry = int((y & s) > 0)
+        d += s * s * ((3 * rx) ^ ry)
+        if (ry == 0):
+            if (rx == 1):
+                x = s - 1 - x
+                y = s - 1 - y
+            x, y = y, x
+        x = x % s
+        y = y % s
+        s = s // 2
+    return d
+
+def hilbert_order(block_idxs):
+    """Sort 2d block indices along a Hilbert curve, so consecutive chunks of the
+    result cover compact patches of the grid"""
+    block_idxs = list(block_idxs)
+    if (len(block_idxs) == 0):
+        return block_idxs
+    n = 1
+    while (n <= max([max(idx) for idx in block_idxs])):
+        n *= 2
+    return sorted(block_idxs, key=lambda idx: hilbert_index(n, idx[0], idx[1]))
+
+# keys of repeatedly composed operations grow without bound, longer ones are hashed
+MAX_KEY_NAME_LENGTH = 256
+
+def _short_key_name(op, key):
+    if (len(key) > MAX_KEY_NAME_LENGTH):
+        key = "{0}({1})".format(op, hash_string(key))
     return key
 
+def generate_key_name_binop(X, Y, op):
+    key = "{0}({1}, {2})".format(op, str(X), str(Y))
+    return _short_key_name(op, key)
+
 def generate_key_name_uop(X, op):
-    assert op == "chol"
-    if (op == "chol"):
-        key = "chol({0})".format(str(X))
-        return key
+    assert op in ["chol", "lu", "qr"]
+    key = "{0}({1})".format(op, str(X))
+    return _short_key_name(op, key)
 
 def generate_key_name_local_matrix(X_local):
     return hash_array(X_local)
@@ -76,8 +263,30 @@ def generate_key_name_local_matrix(X_local):
 def load_mmap(mmap_loc, mmap_shape, mmap_dtype):
     return np.memmap(mmap_loc, dtype=mmap_dtype, mode='r+', shape=mmap_shape)
 
+def get_s3_client():
+    ''' S3 client, backed by the local disk when numpywren.local storage is enabled '''
+    root = local.local_storage_root()
+    if (root != None):
+        return local.LocalS3Client(root)
+    return boto3.client('s3')
+
+def get_dynamodb_client():
+    ''' DynamoDB client for LambdaPack state, backed by the local disk when
+        numpywren.local storage is enabled
+    '''
+    root = local.local_storage_root()
+    if (root != None):
+        return local.LocalDynamoDBClient(root)
+    return boto3.client('dynamodb', region_name='us-west-2')
+
+def wait_all(futures):
+    ''' Wait for pywren or numpywren.local futures and return their results '''
+    if (len(futures) > 0 and not isinstance(futures[0], local.LocalFuture)):
+        pywren.wait(futures)
+    return [f.result() for f in futures]
+
 def list_all_keys(bucket, prefix):
-    client = boto3.client('s3')
+    client = get_s3_client()
     objects = client.list_objects(Bucket=bucket, Prefix=prefix, Delimiter=prefix)
     if (objects.get('Contents') == None):
         return []
@@ -94,7 +303,7 @@ def list_all_keys(bucket, prefix):
 
 def key_exists(bucket, key):
     '''Return true if a key exists in s3 bucket'''
-    client = boto3.client('s3')
+    client = get_s3_client()
     try:
         obj = client.head_object(Bucket=bucket, Key=key)
         return True
@@ -299,6 +508,15 @@ def make_constant_parent(cnst):
         return np.full(current_shape, cnst)
     return constant_parent
 
+def make_normal_parent(seed):
+    ''' Standard normal blocks, each seeded by the matrix seed and its block index
+        so every worker generates the same matrix without storing it '''
+    def normal_parent(bigm, *block_idx):
+        real_idxs = bigm.__block_idx_to_real_idx__(block_idx)
+        current_shape = tuple([e - s for s,e in real_idxs])
+        return np.random.RandomState([seed] + list(block_idx)).standard_normal(current_shape)
+    return normal_parent
+
 
 def constant_zeros(bigm, *block_idx):
     real_idxs = bigm.__block_idx_to_real_idx__(block_idx)
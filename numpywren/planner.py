@@ -0,0 +1,335 @@
+'''
+Cost model driven choice of how binops.gemm runs.
+
+plan_gemm evaluates every gemm strategy (block groups, prefetched chunks,
+whole panels and memory sized tiles) for the shapes and shard sizes of X and Y
+on an ExecutorProfile and returns the cheapest as a GemmPlan, which is passed
+to binops.gemm(plan=...). The predicted runtime is logged next to the actual
+one so the profile can be calibrated.
+'''
+import json
+import logging
+import math
+import multiprocessing
+import time
+import uuid
+
+import numpy as np
+
+from . import matrix_utils
+
+logger = logging.getLogger(__name__)
+
+
+def axis_block_sizes(n, shard_size):
+    ''' Sizes of the blocks of an axis of length n '''
+    return [min(shard_size, n - s) for s in range(0, n, shard_size)]
+
+def _tile_candidates(num_blocks):
+    # only tile sizes that change the number of tiles along the axis are worth trying
+    return sorted(set([int(math.ceil(num_blocks/float(q))) for q in range(1, num_blocks + 1)]))
+
+def _plan_tiles(row_sizes, k_sizes, col_sizes, worker_memory, k_splits=1, min_tasks=1,
+                x_itemsize=8, y_itemsize=8, out_itemsize=8, symmetric=False, final_bytes=8, epilogue_bytes=0):
+    # out_itemsize is the size of accumulators and partial products, final_bytes that of the output
+    k_splits = int(np.clip(k_splits, 1, len(k_sizes)))
+    k_ranges = [list(r) for r in np.array_split(np.arange(len(k_sizes)), k_splits)]
+    k_ranges = [[int(k) for k in r] for r in k_ranges]
+    k_range_sizes = [sum([k_sizes[k] for k in r]) for r in k_ranges]
+
+    def tile_memory(tr, tc):
+        accumulators = out_itemsize*tr*max(row_sizes)*tc*max(col_sizes)
+        inputs = max(k_sizes)*(x_itemsize*tr*max(row_sizes) + y_itemsize*tc*max(col_sizes))
+        if (k_splits > 1):
+            # the reduction holds a running sum block, a partial and the next one being prefetched
+            return max(accumulators + inputs, 3*out_itemsize*max(row_sizes)*max(col_sizes))
+        return accumulators + inputs
+
+    best = None
+    for tr in _tile_candidates(len(row_sizes)):
+        for tc in _tile_candidates(len(col_sizes)):
+            memory = tile_memory(tr, tc)
+            if (memory > worker_memory):
+                continue
+            tiles = []
+            read_bytes = 0
+            write_bytes = 0
+            for r0 in range(0, len(row_sizes), tr):
+                rows = list(range(r0, min(r0 + tr, len(row_sizes))))
+                for c0 in range(0, len(col_sizes), tc):
+                    cols = list(range(c0, min(c0 + tc, len(col_sizes))))
+                    if (symmetric and cols[0] > rows[-1]):
+                        continue
+                    out_elements = sum([row_sizes[i]*col_sizes[j] for i in rows for j in cols if not (symmetric and j > i)])
+                    for split, ks in enumerate(k_ranges):
+                        tiles.append((rows, cols, ks, split if k_splits > 1 else None))
+                        # X X^T reuses the X blocks of the tile rows for the columns
+                        read_bytes += k_range_sizes[split]*(x_itemsize*sum([row_sizes[i] for i in rows]) +
+                                                            y_itemsize*sum([col_sizes[j] for j in cols if not (symmetric and j in rows)]))
+                        write_bytes += (out_itemsize if k_splits > 1 else final_bytes)*out_elements
+                    if (k_splits > 1):
+                        read_bytes += k_splits*out_itemsize*out_elements
+                        write_bytes += final_bytes*out_elements
+                    read_bytes += epilogue_bytes*out_elements
+            score = (max(0, min_tasks - len(tiles)), read_bytes, -len(tiles))
+            if (best is None or score < best[0]):
+                best = (score, {"tile_shape": (tr, tc),
+                                "k_splits": k_splits,
+                                "k_ranges": k_ranges,
+                                "symmetric": symmetric,
+                                "tiles": tiles,
+                                "reduce_tiles": [t for t in tiles if t[3] in (0, None)] if k_splits > 1 else [],
+                                "tile_memory": memory,
+                                "worker_memory": worker_memory,
+                                "predicted_read_bytes": read_bytes,
+                                "predicted_write_bytes": write_bytes})
+    if (best is None):
+        raise Exception("worker_memory of {0} bytes cannot hold a single output block and its inputs ({1} bytes)".format(
+            worker_memory, tile_memory(1, 1)))
+    return best[1]
+
+def plan_gemm_tiles(X, Y, worker_memory, k_splits=1, min_tasks=1, dtype=np.float64, symmetric=None, epilogue=None,
+                    compute_dtype=None):
+    '''
+        Pick the output rectangle (in blocks) each worker computes for XY.
+        A worker holds its rectangle of accumulators plus one block column of X and one
+        block row of Y at a time, so the rectangle must fit in worker_memory bytes.
+        Among the rectangles that fit the one moving the fewest bytes is chosen,
+        preferring rectangles that give at least min_tasks tasks.
+        With k_splits > 1 the reduction dimension is split into k_splits ranges whose
+        partial products are summed by a second round of tasks.
+        @param X - lhs matrix
+        @param Y - rhs matrix
+        @param worker_memory - bytes available to a worker for blocks
+        @param k_splits - number of ranges the reduction dimension is split into
+        @param min_tasks - smallest number of tasks worth running in the first round
+        @param dtype - dtype of the output
+        @param compute_dtype - dtype of the accumulators and partial products, defaults to dtype
+        @param symmetric - only compute the lower triangle, defaults to X == Y^T
+        @param epilogue - GemmEpilogue, only used to predict its reads and writes
+        returns a dict describing the tiles and the predicted bytes moved
+    '''
+    if (Y.shard_sizes[0] != X.shard_sizes[1]):
+        raise Exception("X dim 1 shard size must match Y dim 0 shard size")
+    if (symmetric is None):
+        symmetric = X.key == Y.key and (X.transposed ^ Y.transposed)
+    out_itemsize = np.dtype(dtype if compute_dtype is None else compute_dtype).itemsize
+    # bytes per output element the last write and the epilogue move
+    final_bytes = np.dtype(dtype).itemsize
+    epilogue_bytes = 0
+    if (epilogue is not None):
+        final_bytes = 0 if epilogue.reduction is not None else final_bytes
+        epilogue_bytes = np.dtype(epilogue.C.dtype).itemsize if epilogue.beta != 0 else 0
+    return _plan_tiles([e - s for s, e in X._blocks(0)], [e - s for s, e in X._blocks(1)], [e - s for s, e in Y._blocks(1)],
+                       worker_memory, k_splits=k_splits, min_tasks=min_tasks,
+                       x_itemsize=np.dtype(X.dtype).itemsize, y_itemsize=np.dtype(Y.dtype).itemsize,
+                       out_itemsize=out_itemsize, symmetric=symmetric, final_bytes=final_bytes, epilogue_bytes=epilogue_bytes)
+
+
+class ExecutorProfile(object):
+    '''
+        What one worker of an executor can do.
+        @param memory - bytes a worker can hold blocks in
+        @param cores - cores of a worker
+        @param gbytes_per_second - object store bandwidth of a worker
+        @param gflops_per_second - matrix multiply throughput of a worker
+        @param workers - number of workers running at once
+        @param task_overhead - seconds to start a task and load its arguments
+        @param standalone - standalone pywren, needed by gemm_impl 1
+    '''
+    def __init__(self, memory=1.5e9, cores=1, gbytes_per_second=0.08, gflops_per_second=20.0, workers=1000,
+                 task_overhead=0.5, standalone=False):
+        self.memory = memory
+        self.cores = cores
+        self.gbytes_per_second = gbytes_per_second
+        self.gflops_per_second = gflops_per_second
+        self.workers = workers
+        self.task_overhead = task_overhead
+        self.standalone = standalone
+
+    @classmethod
+    def measure(cls, pwex, bucket, memory=1.5e9, workers=1000, n=1024, task_overhead=0.5, standalone=False):
+        ''' Time a matrix multiply and an object store round trip on a worker of pwex '''
+        def probe(_):
+            A = np.random.randn(n, n)
+            start = time.time()
+            A.dot(A)
+            gflops = 2.0*n**3/(time.time() - start)/1e9
+            client = matrix_utils.get_s3_client()
+            key = "numpywren.profile/{0}".format(uuid.uuid4().hex)
+            body = A.tobytes()
+            start = time.time()
+            client.put_object(Bucket=bucket, Key=key, Body=body)
+            client.get_object(Bucket=bucket, Key=key)['Body'].read()
+            gbytes = 2.0*len(body)/(time.time() - start)/1e9
+            client.delete_object(Bucket=bucket, Key=key)
+            return gflops, gbytes, multiprocessing.cpu_count()
+        gflops, gbytes, cores = matrix_utils.wait_all(pwex.map(probe, [0]))[0]
+        return cls(memory=memory, cores=cores, gbytes_per_second=gbytes, gflops_per_second=gflops, workers=workers,
+                   task_overhead=task_overhead, standalone=standalone)
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+
+class GemmPlan(object):
+    '''
+        One way of running gemm and its predicted cost, see plan_gemm.
+        candidates holds every plan that was considered, cheapest first.
+    '''
+    def __init__(self, strategy, shard_sizes, tasks, predicted_seconds, predicted_read_bytes, predicted_write_bytes,
+                 memory, gemm_impl=0, tasks_per_job=1, gemm_chunk_size=16, worker_memory=None, k_splits=1, min_tasks=1):
+        self.strategy = strategy
+        self.shard_sizes = tuple(shard_sizes)
+        self.tasks = tasks
+        self.predicted_seconds = predicted_seconds
+        self.predicted_read_bytes = predicted_read_bytes
+        self.predicted_write_bytes = predicted_write_bytes
+        self.memory = memory
+        self.gemm_impl = gemm_impl
+        self.tasks_per_job = tasks_per_job
+        self.gemm_chunk_size = gemm_chunk_size
+        self.worker_memory = worker_memory
+        self.k_splits = k_splits
+        self.min_tasks = min_tasks
+        self.profile = None
+        self.candidates = []
+
+    def gemm_kwargs(self):
+        ''' Arguments of binops.gemm that run this plan '''
+        return {"gemm_impl": self.gemm_impl,
+                "tasks_per_job": self.tasks_per_job,
+                "gemm_chunk_size": self.gemm_chunk_size,
+                "worker_memory": self.worker_memory,
+                "k_splits": self.k_splits,
+                "min_tasks": self.min_tasks}
+
+    def to_dict(self):
+        return {"strategy": self.strategy,
+                "shard_sizes": list(self.shard_sizes),
+                "tasks": self.tasks,
+                "predicted_seconds": self.predicted_seconds,
+                "predicted_read_bytes": self.predicted_read_bytes,
+                "predicted_write_bytes": self.predicted_write_bytes,
+                "memory": self.memory,
+                "gemm_kwargs": self.gemm_kwargs()}
+
+    def __str__(self):
+        return "GemmPlan({0}, shards {1}, {2} tasks, {3:.1f}s predicted, {4:.2f} GB read, {5})".format(
+            self.strategy, self.shard_sizes, self.tasks, self.predicted_seconds, self.predicted_read_bytes/1e9,
+            self.gemm_kwargs())
+
+
+def _patch_shape(tasks_per_job):
+    # Hilbert ordered groups of 2^p blocks are 2^ceil(p/2) x 2^floor(p/2) patches
+    p = int(math.ceil(math.log(tasks_per_job, 2)))
+    return 2**((p + 1)//2), 2**(p//2)
+
+def _gemm_candidates(shape, shard_sizes, profile, in_itemsize, out_itemsize, symmetric, prefetch_depth=2):
+    M, K, N = shape
+    row_sizes = axis_block_sizes(M, shard_sizes[0])
+    k_sizes = axis_block_sizes(K, shard_sizes[1])
+    col_sizes = axis_block_sizes(N, shard_sizes[2])
+    b0, bk, b1 = max(row_sizes), max(k_sizes), max(col_sizes)
+    out_blocks = len(row_sizes)*len(col_sizes)
+    if (symmetric):
+        out_blocks = len(row_sizes)*(len(row_sizes) + 1)//2
+    out_fraction = out_blocks/float(len(row_sizes)*len(col_sizes))
+    flops = 2.0*M*N*K*out_fraction
+    write_bytes = out_itemsize*M*N*out_fraction
+    bandwidth = profile.gbytes_per_second*1e9
+    gflops = profile.gflops_per_second*1e9
+
+    def makespan(tasks, task_seconds):
+        return int(math.ceil(tasks/float(profile.workers)))*task_seconds
+
+    candidates = []
+    tasks_per_job = 1
+    while (tasks_per_job <= out_blocks):
+        tasks = int(math.ceil(out_blocks/float(tasks_per_job)))
+        r, c = _patch_shape(tasks_per_job)
+        r, c = min(r, len(row_sizes)), min(c, len(col_sizes))
+        memory = out_itemsize*tasks_per_job*b0*b1 + in_itemsize*(r*b0 + c*b1)*bk
+        read = in_itemsize*K*(r*b0 + c*b1)
+        seconds = profile.task_overhead + read/bandwidth + flops/tasks/gflops + write_bytes/tasks/bandwidth
+        candidates.append(GemmPlan("blocks", shard_sizes, tasks, makespan(tasks, seconds), read*tasks, write_bytes,
+                                   memory, gemm_impl=0, tasks_per_job=tasks_per_job))
+        tasks_per_job *= 2
+
+    read = in_itemsize*K*(b0 + b1)
+    for chunk_size in sorted(set([min(c, len(k_sizes)) for c in [1, 4, 16]])):
+        memory = out_itemsize*b0*b1 + in_itemsize*prefetch_depth*chunk_size*bk*(b0 + b1)
+        first_chunk = in_itemsize*chunk_size*bk*(b0 + b1)/bandwidth
+        # every chunk after the first downloads while the previous one is multiplied
+        seconds = (profile.task_overhead + first_chunk + max((read/bandwidth - first_chunk), flops/out_blocks/gflops) +
+                   write_bytes/out_blocks/bandwidth)
+        candidates.append(GemmPlan("prefetch", shard_sizes, out_blocks, makespan(out_blocks, seconds), read*out_blocks,
+                                   write_bytes, memory, gemm_impl=2, gemm_chunk_size=chunk_size))
+
+    if (profile.standalone):
+        memory = in_itemsize*K*(b0 + b1) + out_itemsize*b0*b1
+        seconds = profile.task_overhead + read/bandwidth + flops/out_blocks/gflops + write_bytes/out_blocks/bandwidth
+        candidates.append(GemmPlan("panels", shard_sizes, out_blocks, makespan(out_blocks, seconds), read*out_blocks,
+                                   write_bytes, memory, gemm_impl=1))
+
+    for k_splits in sorted(set([min(k, len(k_sizes)) for k in [1, 2, 4]])):
+        try:
+            tiles = _plan_tiles(row_sizes, k_sizes, col_sizes, profile.memory, k_splits=k_splits, min_tasks=profile.workers,
+                                x_itemsize=in_itemsize, y_itemsize=in_itemsize, out_itemsize=out_itemsize, symmetric=symmetric,
+                                final_bytes=out_itemsize)
+        except Exception:
+            continue
+        tasks = len(tiles["tiles"])
+        reduce_read = (k_splits*write_bytes) if k_splits > 1 else 0
+        seconds = makespan(tasks, profile.task_overhead + (tiles["predicted_read_bytes"] - reduce_read)/tasks/bandwidth +
+                           flops/tasks/gflops + (write_bytes*k_splits)/tasks/bandwidth)
+        if (k_splits > 1):
+            reduce_tasks = len(tiles["reduce_tiles"])
+            seconds += makespan(reduce_tasks, profile.task_overhead + (reduce_read + write_bytes)/reduce_tasks/bandwidth)
+            tasks += reduce_tasks
+        candidates.append(GemmPlan("tiled", shard_sizes, tasks, seconds, tiles["predicted_read_bytes"],
+                                   tiles["predicted_write_bytes"], tiles["tile_memory"], worker_memory=profile.memory,
+                                   k_splits=k_splits, min_tasks=profile.workers))
+    return [c for c in candidates if c.memory <= profile.memory]
+
+def plan_gemm(X, Y, profile, shard_sizes=None, dtype=np.float64, symmetric=None):
+    '''
+        Pick how gemm computes XY on an executor described by profile
+        @param X - lhs matrix
+        @param Y - rhs matrix
+        @param profile - ExecutorProfile of the executor gemm runs on
+        @param shard_sizes - square shard sizes to consider besides the current ones,
+                             a plan with other shard sizes needs X and Y resharded
+        @param dtype - dtype blocks are computed and stored in, X and Y are read in their own dtype
+        @param symmetric - only the lower triangle is computed, defaults to X == Y^T
+        returns the cheapest GemmPlan
+    '''
+    if (Y.shard_sizes[0] != X.shard_sizes[1]):
+        raise Exception("X dim 1 shard size must match Y dim 0 shard size")
+    if (symmetric is None):
+        symmetric = X.key == Y.key and (X.transposed ^ Y.transposed)
+    shape = (X.shape[0], X.shape[1], Y.shape[1])
+    all_shard_sizes = [(X.shard_sizes[0], X.shard_sizes[1], Y.shard_sizes[1])]
+    all_shard_sizes += [(s, s, s) for s in (shard_sizes or []) if (s, s, s) not in all_shard_sizes]
+    in_itemsize = max(np.dtype(X.dtype).itemsize, np.dtype(Y.dtype).itemsize)
+    out_itemsize = np.dtype(dtype).itemsize
+    candidates = []
+    for s in all_shard_sizes:
+        candidates += _gemm_candidates(shape, s, profile, in_itemsize, out_itemsize, symmetric)
+    if (len(candidates) == 0):
+        raise Exception("No gemm strategy fits in {0} bytes of worker memory".format(profile.memory))
+    candidates = sorted(candidates, key=lambda c: (c.predicted_seconds, c.predicted_read_bytes))
+    plan = candidates[0]
+    plan.candidates = candidates
+    plan.profile = profile
+    return plan
+
+def log_plan(plan, seconds):
+    ''' Record a plan next to the runtime it achieved, one json document per line '''
+    record = plan.to_dict()
+    record["seconds"] = seconds
+    if (plan.profile is not None):
+        record["profile"] = plan.profile.to_dict()
+    print("Planned {0:.2f}s for {1}, took {2:.2f}s".format(plan.predicted_seconds, plan.strategy, seconds))
+    logger.info(json.dumps(record))
+    return record
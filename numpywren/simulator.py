@@ -0,0 +1,421 @@
+import collections
+import heapq
+
+import numpy as np
+import scipy.optimize
+
+from .matrix import BigMatrix
+from . import lambdapack as lp
+from . import trace
+
+# state store requests made by pywren_func for every instruction block
+# (program status, block status, RUNNING, final status, done counter, run time,
+# written, stored and peak stored bytes) and for every child it notifies
+# (one ready counter increment)
+STATE_REQUESTS_PER_BLOCK = 13
+STATE_REQUESTS_PER_CHILD = 2
+
+_FLOP_MODELS = {}
+
+def register_flop_model(opcode_name, flop_fn):
+    ''' Register the static flop count of an opcode, flop_fn is called with
+        the instruction and a function mapping an instruction to its result shape
+    '''
+    _FLOP_MODELS[opcode_name] = flop_fn
+
+register_flop_model("CHOL", lambda inst, shape: shape(inst.argv[0])[0]**3/3.0)
+register_flop_model("INVRS", lambda inst, shape: 2.0*shape(inst.argv[0])[0]**3/3.0)
+register_flop_model("TRSM", lambda inst, shape: shape(inst.argv[0])[0]*shape(inst.argv[1])[0]**2)
+register_flop_model("SYRK", lambda inst, shape: shape(inst.argv[0])[0]*(shape(inst.argv[0])[0] + 1)*shape(inst.argv[1])[1])
+register_flop_model("GEMM", lambda inst, shape: 2.0*shape(inst.argv[0])[0]*shape(inst.argv[0])[1]*shape(inst.argv[1])[1 - inst.params[0]])
+
+def _getrf_flops(inst, shape):
+    m = sum([shape(x)[0] for x in inst.argv])
+    b = shape(inst.argv[0])[1]
+    return m*b*b - b**3/3.0
+
+register_flop_model("GETRF", _getrf_flops)
+register_flop_model("TRTRS", lambda inst, shape: shape(inst.argv[0])[0]**2*shape(inst.argv[1])[1])
+register_flop_model("GEQRF", lambda inst, shape: 2.0*sum([shape(x)[0] for x in inst.argv])*shape(inst.argv[0])[1]**2
+                    - 2.0/3.0*shape(inst.argv[0])[1]**3)
+register_flop_model("ORMQR", lambda inst, shape: 4.0*sum([shape(x)[0] for x in inst.argv[2:]])*shape(inst.argv[2])[1]*shape(inst.argv[0])[1])
+register_flop_model("ORGQR", lambda inst, shape: 4.0*sum(inst.params)*shape(inst.argv[0])[1]**2)
+register_flop_model("SWAP_TRSM", lambda inst, shape: shape(inst.argv[0])[0]**2*shape(inst.argv[2])[1])
+
+
+class SymbolicMatrix(BigMatrix):
+    ''' A BigMatrix that never touches the object store, used to build programs offline '''
+    def __init__(self, key, shape, shard_sizes, dtype=np.float64):
+        BigMatrix.__init__(self, key, shape=shape, shard_sizes=shard_sizes, bucket="simulated", dtype=dtype)
+
+    def __read_header__(self):
+        return None
+
+    def __write_header__(self):
+        pass
+
+    def get_block(self, *block_idx):
+        raise Exception("SymbolicMatrix {0} has no data".format(self.key))
+
+    def put_block(self, block, *block_idx):
+        raise Exception("SymbolicMatrix {0} has no data".format(self.key))
+
+
+def cholesky_instructions(n, shard_size, dtype=np.float64):
+    ''' The instruction blocks lambdapack._chol builds for an n x n matrix '''
+    X = SymbolicMatrix("X", shape=(n, n), shard_sizes=(shard_size, shard_size), dtype=dtype)
+    trailing = [X]
+    for i in range(len(X._block_idxs(0))):
+        trailing.append(SymbolicMatrix("X_chol_{0}_trailing".format(i), shape=(n, n),
+                                       shard_sizes=(shard_size, shard_size), dtype=dtype))
+    trailing.append(SymbolicMatrix("X_chol", shape=(n, n), shard_sizes=(shard_size, shard_size), dtype=dtype))
+    return lp._chol_instructions(trailing)
+
+def lu_instructions(n, shard_size, dtype=np.float64):
+    ''' The instruction blocks lambdapack._lu builds for an n x n matrix '''
+    shard_sizes = (shard_size, shard_size)
+    X = SymbolicMatrix("X", shape=(n, n), shard_sizes=shard_sizes, dtype=dtype)
+    num_blocks = len(X._block_idxs(0))
+    LU = SymbolicMatrix("X_lu", shape=(n, n), shard_sizes=shard_sizes, dtype=dtype)
+    perms = SymbolicMatrix("X_lu_perms", shape=(num_blocks, n), shard_sizes=(1, n), dtype=np.int64)
+    L_panel = SymbolicMatrix("X_lu_L_panel", shape=(n, n), shard_sizes=shard_sizes, dtype=dtype)
+    trailing = [X]
+    swapped = []
+    for k in range(num_blocks - 1):
+        trailing.append(SymbolicMatrix("X_lu_{0}_trailing".format(k + 1), shape=(n, n), shard_sizes=shard_sizes, dtype=dtype))
+        swapped.append(SymbolicMatrix("X_lu_{0}_swapped".format(k), shape=(n, n), shard_sizes=shard_sizes, dtype=dtype))
+    return lp._lu_instructions(LU, perms, L_panel, trailing, swapped)
+
+
+class CostModel(object):
+    '''
+        Costs of running a LambdaPack program on a serverless fleet.
+
+        Parameters
+        ----------
+        flop_rates : dict, optional
+            Flops per second of a single worker for each opcode name.
+        default_flop_rate : float
+            Flops per second of opcodes missing from flop_rates.
+        bandwidth : float
+            Bytes per second between a worker and the object store.
+        request_latency : float
+            Seconds per object store request.
+        state_latency : float
+            Seconds per state store request.
+        invoke_overhead : float
+            Seconds between launching an invocation and it starting to run.
+        workers : int
+            Maximum number of concurrent invocations.
+        inline_time_budget : float
+            Seconds an invocation may keep running ready children itself.
+        inline_depth_limit : int
+            Most children an invocation runs inline after its first block.
+        cache_bytes : int
+            Size of the worker block cache.
+    '''
+    def __init__(self, flop_rates=None, default_flop_rate=5e9, bandwidth=60e6,
+                 request_latency=0.02, state_latency=0.005, invoke_overhead=1.0,
+                 workers=1000, inline_time_budget=60, cache_bytes=2**29, inline_depth_limit=64):
+        self.flop_rates = dict(flop_rates) if flop_rates is not None else {}
+        self.default_flop_rate = default_flop_rate
+        self.bandwidth = bandwidth
+        self.request_latency = request_latency
+        self.state_latency = state_latency
+        self.invoke_overhead = invoke_overhead
+        self.workers = workers
+        self.inline_time_budget = inline_time_budget
+        self.inline_depth_limit = inline_depth_limit
+        self.cache_bytes = cache_bytes
+
+    def compute_seconds(self, opcode, flops):
+        return flops/self.flop_rates.get(opcode, self.default_flop_rate)
+
+    def io_seconds(self, nbytes):
+        return self.request_latency + nbytes/self.bandwidth
+
+    @classmethod
+    def from_trace(cls, records, **kwargs):
+        '''
+            Calibrate a cost model from numpywren.trace records of a real run,
+            keyword arguments override the fitted values.
+        '''
+        records = [r for r in records if not r["replay"]]
+        params = {}
+        # flop rates can only be attributed to blocks with a single compute opcode
+        flops = collections.defaultdict(float)
+        seconds = collections.defaultdict(float)
+        for r in records:
+            compute_ops = set([op for op in r["opcodes"] if op not in ("S3_LOAD", "S3_WRITE", "RET")])
+            if (len(compute_ops) == 1 and r["compute_seconds"] > 0):
+                op = compute_ops.pop()
+                flops[op] += r["flops"]
+                seconds[op] += r["compute_seconds"]
+        params["flop_rates"] = dict([(op, flops[op]/seconds[op]) for op in flops if flops[op] > 0])
+        if (sum(flops.values()) > 0):
+            params["default_flop_rate"] = sum(flops.values())/sum(seconds.values())
+        # io_seconds = request_latency*requests + bytes/bandwidth, the two can only
+        # be told apart when the trace holds blocks of different sizes
+        io_records = [r for r in records if r["io_seconds"] > 0]
+        if (len(io_records) >= 2):
+            A = np.array([[r["object_store_requests"], r["read_bytes"] + r["write_bytes"]] for r in io_records],
+                         dtype=np.float64)
+            b = np.array([r["io_seconds"] for r in io_records])
+            (latency, inv_bandwidth), _ = scipy.optimize.nnls(A, b)
+            params["request_latency"] = latency
+            if (inv_bandwidth > 0):
+                params["bandwidth"] = 1.0/inv_bandwidth
+        state_requests = sum([r["state_requests"] for r in records])
+        if (state_requests > 0):
+            params["state_latency"] = sum([r["state_seconds"] for r in records])/state_requests
+        # children run inline by their parent barely wait, only
+        # waits of real invocations say anything about the overhead
+        waits = [r["queue_wait"] for r in records if r["queue_wait"] > 1e-3]
+        if (len(waits) > 0):
+            params["invoke_overhead"] = float(np.median(waits))
+        params.update(kwargs)
+        return cls(**params)
+
+
+class _BlockCost(object):
+    ''' Static description of the work in one instruction block '''
+    def __init__(self, inst_block, shape):
+        self.loads = []
+        self.writes = []
+        self.compute = []
+        for inst in inst_block.instrs:
+            if (isinstance(inst, lp.RemoteLoad)):
+                self.loads.append((lp._block_key(inst), shape.nbytes(inst)))
+            elif (isinstance(inst, lp.RemoteWrite)):
+                self.writes.append((lp._block_key(inst), shape.nbytes(inst)))
+            elif (isinstance(inst, lp.RemoteReturn)):
+                continue
+            else:
+                name = inst.i_code.name
+                flop_fn = _FLOP_MODELS.get(name)
+                self.compute.append((name, flop_fn(inst, shape) if flop_fn is not None else 0.0))
+
+
+class _Shapes(object):
+    ''' Memoized result shape of an instruction, every compute opcode
+        returns a block shaped like its first argument
+    '''
+    def __init__(self):
+        self.shapes = {}
+        self.block_shapes = {}
+
+    def block_shape(self, inst):
+        key = lp._block_key(inst)
+        if (key not in self.block_shapes):
+            matrix = inst.matrix
+            self.block_shapes[key] = tuple([min(shard_size, dim - idx*shard_size) for idx, dim, shard_size
+                                            in zip(inst.bidxs, matrix.shape, matrix.shard_sizes)])
+        return self.block_shapes[key]
+
+    def nbytes(self, inst):
+        shape = self.block_shape(inst)
+        nbytes = np.dtype(inst.matrix.dtype).itemsize
+        for dim in shape:
+            nbytes *= dim
+        return nbytes
+
+    def __call__(self, inst):
+        if (id(inst) not in self.shapes):
+            if (isinstance(inst, (lp.RemoteLoad, lp.RemoteWrite))):
+                self.shapes[id(inst)] = self.block_shape(inst)
+            else:
+                self.shapes[id(inst)] = self(inst.argv[0])
+        return self.shapes[id(inst)]
+
+
+class _Worker(object):
+    def __init__(self, worker_id, start_time, cache_bytes):
+        self.worker_id = worker_id
+        self.start_time = start_time
+        self.inlined = 0
+        self.cache = collections.OrderedDict()
+        self.cache_bytes = cache_bytes
+        self.cached_bytes = 0
+
+    def contains(self, key):
+        return key in self.cache
+
+    def put(self, key, nbytes):
+        if (key in self.cache):
+            self.cache.move_to_end(key)
+            return
+        self.cache[key] = nbytes
+        self.cached_bytes += nbytes
+        while (self.cached_bytes > self.cache_bytes and len(self.cache) > 0):
+            _, evicted = self.cache.popitem(last=False)
+            self.cached_bytes -= evicted
+
+
+class SimulationResult(object):
+    ''' Predicted execution of a LambdaPack program '''
+    def __init__(self, records, children, makespan, invocations, peak_concurrency,
+                 object_store_requests, state_requests):
+        self.records = records
+        self.makespan = makespan
+        self.children = children
+        self.invocations = invocations
+        self.peak_concurrency = peak_concurrency
+        self.object_store_requests = object_store_requests
+        self.state_requests = state_requests
+
+    @property
+    def total_requests(self):
+        return self.object_store_requests + self.state_requests
+
+    def aggregator(self):
+        ''' The simulated run as a numpywren.trace.TraceAggregator '''
+        return trace.TraceAggregator(self.records, self.children)
+
+    def summary(self):
+        summary = self.aggregator().summary()
+        summary.update({"makespan": self.makespan,
+                        "invocations": self.invocations,
+                        "peak_concurrency": self.peak_concurrency,
+                        "object_store_requests": self.object_store_requests,
+                        "state_requests": self.state_requests,
+                        "total_requests": self.total_requests})
+        return summary
+
+
+def simulate(inst_blocks, cost_model=None, fusion_granularity=1, outputs=None):
+    '''
+        Replay the scheduling of a LambdaPackProgram offline.
+
+        Starter blocks are invoked at time zero, a finished block notifies its
+        children, runs the ready child with the most cached inputs itself and
+        invokes the others. Invocations queue once cost_model.workers are busy.
+
+        Parameters
+        ----------
+        inst_blocks : list of InstructionBlock
+            The program, as passed to LambdaPackProgram.
+        cost_model : CostModel, optional
+        fusion_granularity : int
+            Fuse instruction blocks like LambdaPackProgram before simulating.
+        outputs : list of BigMatrix, optional
+            Program outputs, see lambdapack.fuse_instruction_blocks.
+
+        Returns
+        -------
+        result : SimulationResult
+    '''
+    if (cost_model is None):
+        cost_model = CostModel()
+    if (fusion_granularity > 1):
+        inst_blocks = lp.fuse_instruction_blocks(inst_blocks, fusion_granularity, outputs=outputs)
+    children, parents = lp.io_dependency_analyze(inst_blocks)
+    shape = _Shapes()
+    costs = [_BlockCost(inst_block, shape) for inst_block in inst_blocks]
+    ready_counts = [0 for _ in inst_blocks]
+
+    records = []
+    events = []
+    waiting = collections.deque()
+    seq = [0]
+    stats = {"makespan": 0.0, "active": 0, "peak": 0, "invocations": 0, "object_store_requests": 0, "state_requests": 0}
+
+    def push(time, kind, payload):
+        heapq.heappush(events, (time, seq[0], kind, payload))
+        seq[0] += 1
+
+    def run(node, worker, now, enqueue_time):
+        cost = costs[node]
+        io_seconds = 0.0
+        requests = 0
+        read_bytes = 0
+        write_bytes = 0
+        for key, nbytes in cost.loads:
+            if (worker.contains(key)):
+                continue
+            io_seconds += cost_model.io_seconds(nbytes)
+            read_bytes += nbytes
+            requests += 1
+            worker.put(key, nbytes)
+        for key, nbytes in cost.writes:
+            io_seconds += cost_model.io_seconds(nbytes)
+            write_bytes += nbytes
+            requests += 1
+            worker.put(key, nbytes)
+        compute_seconds = sum([cost_model.compute_seconds(op, flops) for op, flops in cost.compute])
+        state_requests = STATE_REQUESTS_PER_BLOCK + STATE_REQUESTS_PER_CHILD*len(children[node])
+        state_seconds = state_requests*cost_model.state_latency
+        stats["state_requests"] += state_requests
+        stats["object_store_requests"] += requests
+        end_time = now + io_seconds + compute_seconds
+        records.append({"program_id": "simulated",
+                        "node": node,
+                        "label": inst_blocks[node].label,
+                        "opcodes": [inst.i_code.name for inst in inst_blocks[node].instrs],
+                        "worker": "worker_{0}".format(worker.worker_id),
+                        "thread": 0,
+                        "enqueue_time": enqueue_time,
+                        "start_time": now,
+                        "end_time": end_time,
+                        "queue_wait": now - enqueue_time,
+                        "read_bytes": read_bytes,
+                        "write_bytes": write_bytes,
+                        "io_seconds": io_seconds,
+                        "object_store_requests": requests,
+                        "flops": sum([flops for _, flops in cost.compute]),
+                        "compute_seconds": compute_seconds,
+                        "state_seconds": state_seconds,
+                        "state_requests": state_requests,
+                        "replay": False})
+        push(end_time + state_seconds, "finish", (node, worker))
+
+    def start_invocation(node, now, enqueue_time):
+        worker = _Worker(stats["invocations"], now, cost_model.cache_bytes)
+        stats["invocations"] += 1
+        stats["active"] += 1
+        stats["peak"] = max(stats["peak"], stats["active"])
+        run(node, worker, now, enqueue_time)
+
+    def launch(node, now):
+        push(now + cost_model.invoke_overhead, "arrive", (node, now))
+
+    for node in range(len(inst_blocks)):
+        if (len(parents[node]) == 0):
+            launch(node, 0.0)
+
+    while (len(events) > 0):
+        now, _, kind, payload = heapq.heappop(events)
+        if (kind == "arrive"):
+            node, enqueue_time = payload
+            if (stats["active"] < cost_model.workers):
+                start_invocation(node, now, enqueue_time)
+            else:
+                waiting.append((node, enqueue_time))
+            continue
+        node, worker = payload
+        stats["makespan"] = now
+        ready_children = []
+        for child in children[node]:
+            ready_counts[child] += 1
+            if (ready_counts[child] == len(parents[child])):
+                ready_children.append(child)
+        local_child = None
+        if (len(ready_children) > 0 and now - worker.start_time <= cost_model.inline_time_budget and
+                worker.inlined < cost_model.inline_depth_limit):
+            local_child = max(ready_children,
+                              key=lambda c: len([k for k, _ in costs[c].loads if worker.contains(k)]))
+            ready_children.remove(local_child)
+        for child in ready_children:
+            launch(child, now)
+        if (local_child is not None):
+            worker.inlined += 1
+            run(local_child, worker, now, now)
+        else:
+            stats["active"] -= 1
+            if (len(waiting) > 0):
+                waiting_node, enqueue_time = waiting.popleft()
+                start_invocation(waiting_node, now, enqueue_time)
+
+    if (len(records) != len(inst_blocks)):
+        raise Exception("Simulation finished {0} of {1} instruction blocks".format(len(records), len(inst_blocks)))
+    return SimulationResult(records, children, stats["makespan"], stats["invocations"], stats["peak"],
+                            stats["object_store_requests"], stats["state_requests"])
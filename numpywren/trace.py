@@ -0,0 +1,289 @@
+import json
+import logging
+import os
+import re
+import socket
+import threading
+import uuid
+
+import numpy as np
+
+from . import matrix_utils
+
+# per thread accounting of state store requests made by LambdaPack workers
+_STATE_STATS = threading.local()
+
+def record_state_op(seconds):
+    _STATE_STATS.seconds = getattr(_STATE_STATS, "seconds", 0.0) + seconds
+    _STATE_STATS.requests = getattr(_STATE_STATS, "requests", 0) + 1
+
+def state_stats():
+    return getattr(_STATE_STATS, "seconds", 0.0), getattr(_STATE_STATS, "requests", 0)
+
+def worker_id():
+    ''' Identify the container a node ran on '''
+    stream = os.environ.get("AWS_LAMBDA_LOG_STREAM_NAME")
+    if (stream != None):
+        return stream
+    return "{0}:{1}".format(socket.gethostname(), os.getpid())
+
+def make_trace_record(program_id, node, inst_block, start_time, end_time, enqueue_time,
+                      state_seconds, state_requests, replay=False):
+    '''
+        Summarize one execution of an instruction block.
+        Must be called before the block results are cleared.
+    '''
+    from .lambdapack import RemoteLoad, RemoteWrite, RemoteReturn
+    record = {"program_id": program_id,
+              "node": node,
+              "label": inst_block.label,
+              "opcodes": [inst.i_code.name for inst in inst_block.instrs],
+              "worker": worker_id(),
+              "thread": threading.get_ident(),
+              "enqueue_time": enqueue_time,
+              "start_time": start_time,
+              "end_time": end_time,
+              "queue_wait": max(0.0, start_time - enqueue_time) if enqueue_time != None else 0.0,
+              "read_bytes": 0,
+              "write_bytes": 0,
+              "io_seconds": 0.0,
+              "object_store_requests": 0,
+              "flops": 0,
+              "compute_seconds": 0.0,
+              "state_seconds": state_seconds,
+              "state_requests": state_requests,
+              "replay": replay}
+    for inst in inst_block.instrs:
+        if (inst.start_time == None or inst.end_time == None or isinstance(inst, RemoteReturn)):
+            continue
+        elapsed = inst.end_time - inst.start_time
+        if (isinstance(inst, RemoteLoad)):
+            # blocks served by the worker cache have size 0
+            record["read_bytes"] += int(getattr(inst, "size", 0))
+            record["object_store_requests"] += int(getattr(inst, "size", 0) > 0)
+            record["io_seconds"] += elapsed
+        elif (isinstance(inst, RemoteWrite)):
+            record["write_bytes"] += int(getattr(inst, "size", 0))
+            record["object_store_requests"] += 1
+            record["io_seconds"] += elapsed
+        else:
+            record["flops"] += int(getattr(inst, "flops", 0))
+            record["compute_seconds"] += elapsed
+    return record
+
+
+class TraceSink(object):
+    ''' Destination of LambdaPack trace records '''
+    def emit(self, record):
+        raise NotImplementedError
+
+    def read(self, program_id):
+        raise NotImplementedError
+
+
+_LIST_SINKS = {}
+
+def _lookup_list_sink(sink_id):
+    if (sink_id not in _LIST_SINKS or _LIST_SINKS[sink_id].pid != os.getpid()):
+        raise Exception("ListTraceSink {0} only collects records in the process that created it".format(sink_id))
+    return _LIST_SINKS[sink_id]
+
+
+class ListTraceSink(TraceSink):
+    ''' Keep records in memory, only useful when workers share the driver process '''
+    def __init__(self):
+        self.records = []
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+        self.sink_id = uuid.uuid4().hex
+        _LIST_SINKS[self.sink_id] = self
+
+    def emit(self, record):
+        with self.lock:
+            self.records.append(record)
+
+    def read(self, program_id):
+        return [r for r in self.records if r["program_id"] == program_id]
+
+    def __reduce__(self):
+        # copies of the program made in this process report to the same list
+        return (_lookup_list_sink, (self.sink_id,))
+
+
+class LoggingTraceSink(TraceSink):
+    ''' Write records to a logger, one json document per line '''
+    def __init__(self, logger_name=__name__):
+        self.logger_name = logger_name
+
+    def emit(self, record):
+        logging.getLogger(self.logger_name).info(json.dumps(record))
+
+
+class S3TraceSink(TraceSink):
+    ''' Store every record as its own S3 object under prefix/program_id/ '''
+    def __init__(self, bucket, prefix="numpywren.trace/"):
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def emit(self, record):
+        key = os.path.join(self.prefix, record["program_id"],
+                           "{0}_{1}_{2}".format(record["node"], record["start_time"], record["worker"].replace("/", "_")))
+        client = matrix_utils.get_s3_client()
+        client.put_object(Bucket=self.bucket, Key=key, Body=json.dumps(record))
+
+    def read(self, program_id):
+        client = matrix_utils.get_s3_client()
+        records = []
+        for key in matrix_utils.list_all_keys(self.bucket, os.path.join(self.prefix, program_id) + "/"):
+            body = client.get_object(Bucket=self.bucket, Key=key)['Body'].read()
+            records.append(json.loads(body.decode('utf-8')))
+        return records
+
+
+class TraceAggregator(object):
+    '''
+        Driver side view of the trace records of one program run.
+
+        Parameters
+        ----------
+        records : list of dict
+            Records emitted by the workers.
+        children : list of list of int, optional
+            Program DAG, needed for the critical path.
+    '''
+    def __init__(self, records, children=None):
+        self.records = sorted(records, key=lambda r: r["start_time"])
+        self.children = children
+
+    @property
+    def makespan(self):
+        if (len(self.records) == 0):
+            return 0.0
+        start = min([r["start_time"] for r in self.records])
+        end = max([r["end_time"] for r in self.records])
+        return end - start
+
+    def critical_path(self):
+        ''' Length in seconds and nodes of the longest path through the DAG '''
+        durations = {}
+        for r in self.records:
+            if (not r["replay"]):
+                durations[r["node"]] = r["end_time"] - r["start_time"]
+        if (self.children is None):
+            raise Exception("The program DAG is needed to compute the critical path")
+        longest = {}
+        successor = {}
+        # post order depth first search gives a reverse topological order
+        order = []
+        visited = set()
+        for root in range(len(self.children)):
+            if (root in visited):
+                continue
+            stack = [(root, False)]
+            while (len(stack) > 0):
+                node, expanded = stack.pop()
+                if (expanded):
+                    order.append(node)
+                    continue
+                if (node in visited):
+                    continue
+                visited.add(node)
+                stack.append((node, True))
+                for c in self.children[node]:
+                    if (c not in visited):
+                        stack.append((c, False))
+        for node in order:
+            best, best_child = 0.0, None
+            for c in self.children[node]:
+                if (longest[c] > best):
+                    best, best_child = longest[c], c
+            longest[node] = durations.get(node, 0.0) + best
+            successor[node] = best_child
+        if (len(longest) == 0):
+            return 0.0, []
+        node = max(longest, key=longest.get)
+        length = longest[node]
+        path = []
+        while (node != None):
+            path.append(node)
+            node = successor[node]
+        return length, path
+
+    def summary(self):
+        makespan = self.makespan
+        flops = sum([r["flops"] for r in self.records])
+        io_bytes = sum([r["read_bytes"] + r["write_bytes"] for r in self.records])
+        summary = {"nodes": len(set([r["node"] for r in self.records])),
+                   "executions": len(self.records),
+                   "replays": len([r for r in self.records if r["replay"]]),
+                   "workers": len(set([r["worker"] for r in self.records])),
+                   "makespan": makespan,
+                   "flops": flops,
+                   "io_bytes": io_bytes,
+                   "compute_seconds": sum([r["compute_seconds"] for r in self.records]),
+                   "io_seconds": sum([r["io_seconds"] for r in self.records]),
+                   "state_seconds": sum([r["state_seconds"] for r in self.records]),
+                   "state_requests": sum([r["state_requests"] for r in self.records]),
+                   "mean_queue_wait": float(np.mean([r["queue_wait"] for r in self.records])) if self.records else 0.0,
+                   "gflops_per_second": flops/makespan/1e9 if makespan > 0 else 0.0,
+                   "gbytes_per_second": io_bytes/makespan/1e9 if makespan > 0 else 0.0}
+        if (self.children is not None):
+            critical_path_seconds, path = self.critical_path()
+            summary["critical_path_seconds"] = critical_path_seconds
+            summary["critical_path_nodes"] = len(path)
+            summary["critical_path_utilization"] = critical_path_seconds/makespan if makespan > 0 else 0.0
+        return summary
+
+    def by_label(self, prefix):
+        ''' Records whose block label starts with prefix '''
+        return [r for r in self.records if r["label"] != None and r["label"].startswith(prefix)]
+
+    def by_level(self, prefix):
+        ''' Timing of every level of a reduction tree whose block labels are "{prefix}_level_{level}_..." '''
+        pattern = re.compile(r"^{0}_level_(\d+)_".format(re.escape(prefix)))
+        levels = {}
+        for r in self.records:
+            match = pattern.match(r["label"] or "")
+            if (match != None):
+                levels.setdefault(int(match.group(1)), []).append(r)
+        summary = {}
+        for level, records in sorted(levels.items()):
+            start = min([r["start_time"] for r in records])
+            end = max([r["end_time"] for r in records])
+            summary[level] = {"nodes": len(records),
+                              "start_time": start,
+                              "end_time": end,
+                              "seconds": end - start,
+                              "compute_seconds": sum([r["compute_seconds"] for r in records]),
+                              "io_seconds": sum([r["io_seconds"] for r in records]),
+                              "flops": sum([r["flops"] for r in records])}
+        return summary
+
+    def to_chrome_trace(self):
+        ''' Chrome trace / Perfetto json, one process per worker '''
+        if (len(self.records) == 0):
+            return {"traceEvents": []}
+        t0 = min([r["start_time"] for r in self.records])
+        pids = {}
+        events = []
+        for r in self.records:
+            if (r["worker"] not in pids):
+                pids[r["worker"]] = len(pids)
+                events.append({"name": "process_name", "ph": "M", "pid": pids[r["worker"]],
+                               "args": {"name": r["worker"]}})
+            args = dict([(k, r[k]) for k in ["node", "opcodes", "read_bytes", "write_bytes", "object_store_requests", "flops",
+                                              "io_seconds", "compute_seconds", "state_seconds",
+                                              "queue_wait", "replay"]])
+            events.append({"name": r["label"] or str(r["node"]),
+                           "cat": "replay" if r["replay"] else "node",
+                           "ph": "X",
+                           "ts": 1e6*(r["start_time"] - t0),
+                           "dur": 1e6*(r["end_time"] - r["start_time"]),
+                           "pid": pids[r["worker"]],
+                           "tid": r["thread"],
+                           "args": args})
+        return {"traceEvents": events}
+
+    def save_chrome_trace(self, path):
+        with open(path, "w") as f:
+            json.dump(self.to_chrome_trace(), f)
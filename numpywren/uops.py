@@ -3,6 +3,7 @@ import itertools
 import numpy as np
 from .matrix import BigSymmetricMatrix, BigMatrix
 from .matrix_utils import load_mmap, chunk, generate_key_name_uop, constant_zeros
+from . import matrix_utils
 from .matrix_init import local_numpy_init
 import concurrent.futures as fs
 import math
@@ -13,6 +14,7 @@ import pywren
 from scipy.linalg import cholesky, solve
 import time
 from . import lambdapack as lp
+from .local import LocalExecutor
 
 # this one is hard
 def reshard(pwex, X, new_shard_sizes, out_bucket=None, tasks_per_job=1):
@@ -99,24 +101,167 @@ def elemwise_uop_func(pwex, X, f, out_bucket=None, tasks_per_job=1):
 def power(pwex, X, k, out_bucket=None, tasks_per_job=1):
     raise NotImplementedError
 
-def chol(pwex, X, out_bucket=None, tasks_per_job=1):
-    instructions,L_sharded,trailing = lp._chol(X)
+def _run_program(pwex, instructions, outputs, speculation_percentile=None, resume=False, fusion_granularity=1,
+                 trace_sink=None):
     config = pwex.config
-    if (isinstance(pwex.invoker, pywren.queues.SQSInvoker)):
+    if (isinstance(pwex, LocalExecutor)):
+        executor = LocalExecutor
+    elif (isinstance(pwex.invoker, pywren.queues.SQSInvoker)):
         executor = pywren.standalone_executor
     else:
         executor = pywren.lambda_executor
-    program = lp.LambdaPackProgram(instructions, executor=executor, pywren_config=config)
-    futures = program.start()
+    program = lp.LambdaPackProgram(instructions, executor=executor, pywren_config=config, speculation_percentile=speculation_percentile,
+                                   fusion_granularity=fusion_granularity, outputs=outputs, trace_sink=trace_sink)
+    if (resume):
+        futures = program.resume()
+    else:
+        futures = program.start()
     [f.result() for f in futures]
     program.wait()
     if (program.program_status() != lp.EC.SUCCESS):
         program.unwind()
         raise Exception("Lambdapack Exception : {0}".format(program.program_status()))
+    return program
 
-    # delete all intermediate information
-    [t.free() for t in trailing]
+def chol(pwex, X, out_bucket=None, tasks_per_job=1, speculation_percentile=None, resume=False, fusion_granularity=1):
+    instructions,L_sharded,trailing = lp._chol(X)
+    program = _run_program(pwex, instructions, [L_sharded], speculation_percentile=speculation_percentile,
+                           resume=resume, fusion_granularity=fusion_granularity)
+    if (not program.garbage_collect):
+        # delete all intermediate information
+        [t.free() for t in trailing]
     return L_sharded
 
+def lu(pwex, X, out_bucket=None, tasks_per_job=1, speculation_percentile=None, resume=False, fusion_granularity=1):
+    '''
+        LU factorization with partial pivoting, X[perm] = L U
+        @param pwex - Execution context
+        @param X - square matrix to factor
+        Returns the packed factors (unit lower triangular L below the diagonal,
+        U on and above it) and perm, a numpy array of row indices
+    '''
+    instructions, LU_sharded, perms, intermediates = lp._lu(X, out_bucket=out_bucket)
+    program = _run_program(pwex, instructions, [LU_sharded, perms], speculation_percentile=speculation_percentile,
+                           resume=resume, fusion_granularity=fusion_granularity)
+    if (not program.garbage_collect):
+        [t.free() for t in intermediates]
+    perm = lp.lu_permutation(perms)
+    return LU_sharded, perm
+
+def qr(pwex, X, arity=2, out_bucket=None, tasks_per_job=1, fusion_granularity=1, trace_sink=None):
+    '''
+        R factor of a Householder QR, every block column panel is reduced by a TSQR tree
+        @param pwex - Execution context
+        @param X - matrix with square blocks, or a single column block
+        @param arity - children per node of the reduction trees
+        @param trace_sink - receives the trace records, TraceAggregator.by_level("qr_<panel>") times each tree level
+    '''
+    instructions, R, reflectors, intermediates = lp._qr(X, arity=arity, out_bucket=out_bucket)
+    program = _run_program(pwex, instructions, [R], fusion_granularity=fusion_granularity, trace_sink=trace_sink)
+    if (not program.garbage_collect):
+        [t.free() for t in intermediates + [x for pair in reflectors for x in pair]]
+    return R
+
+def tsqr(pwex, X, arity=2, q=None, out_bucket=None, tasks_per_job=1, fusion_granularity=1, trace_sink=None):
+    '''
+        Tall skinny QR over the row blocks of X
+        @param pwex - Execution context
+        @param X - matrix with a single column block
+        @param arity - children per node of the reduction tree
+        @param q - None for R only, "implicit" to also return the (V, tau) reflectors
+                   of the tree for tsqr_q, "explicit" to also return Q
+        @param trace_sink - receives the trace records, TraceAggregator.by_level("tsqr") times each tree level
+    '''
+    if (len(X._block_idxs(1)) != 1):
+        raise Exception("TSQR needs a single column block, use qr")
+    if (q not in [None, "implicit", "explicit"]):
+        raise Exception("q must be None, implicit or explicit")
+    instructions, R, reflectors, intermediates = lp._qr(X, arity=arity, out_bucket=out_bucket)
+    V, tau = reflectors[0]
+    outputs = [R]
+    if (q == "implicit"):
+        outputs += [V, tau]
+    else:
+        intermediates += [V, tau]
+    if (q == "explicit"):
+        q_instructions, Q, q_intermediates = lp._tsqr_q(X, V, tau, arity=arity, out_bucket=out_bucket)
+        instructions += q_instructions
+        intermediates += q_intermediates
+        outputs.append(Q)
+    program = _run_program(pwex, instructions, outputs, fusion_granularity=fusion_granularity, trace_sink=trace_sink)
+    if (not program.garbage_collect):
+        [t.free() for t in intermediates]
+    if (q == "implicit"):
+        return R, (V, tau)
+    if (q == "explicit"):
+        return R, Q
+    return R
+
+def tsqr_q(pwex, X, reflectors, arity=2, out_bucket=None, fusion_granularity=1, trace_sink=None):
+    '''
+        Form Q from the reflectors returned by tsqr(..., q="implicit")
+        @param X - the matrix that was factored
+        @param reflectors - (V, tau) returned by tsqr
+        @param arity - the arity tsqr used
+    '''
+    V, tau = reflectors
+    instructions, Q, intermediates = lp._tsqr_q(X, V, tau, arity=arity, out_bucket=out_bucket)
+    program = _run_program(pwex, instructions, [Q], fusion_granularity=fusion_granularity, trace_sink=trace_sink)
+    if (not program.garbage_collect):
+        [t.free() for t in intermediates]
+    return Q
 
+def _range_basis(pwex, Y, arity=2):
+    R, Q = tsqr(pwex, Y, arity=arity, q="explicit")
+    R.delete()
+    return Q
 
+def randomized_svd(pwex, X, k, oversample=10, power_iters=2, seed=0, out_bucket=None, tasks_per_job=1):
+    '''
+        Rank k approximation X ~ U diag(s) V^T with a randomized range finder
+        @param pwex - Execution context
+        @param X - matrix to approximate, its blocks must have at least k + oversample rows and columns
+        @param k - number of singular triplets
+        @param oversample - extra columns of the random sketch
+        @param power_iters - subspace iterations, improve the accuracy when the spectrum decays slowly
+        @param seed - seed of the sketch, its blocks are generated by the workers that read them
+        Returns U (m x k BigMatrix), s (numpy array) and V (n x k BigMatrix)
+    '''
+    from . import binops
+    from .matrix_init import shard_matrix
+    m, n = X.shape
+    l = k + oversample
+    if (l > m or l > n):
+        raise Exception("k + oversample must not exceed the smaller dimension of X")
+    if (X.shard_sizes[0] < l or X.shard_sizes[1] < l):
+        raise Exception("Blocks of X must have at least k + oversample rows and columns")
+    sketch = BigMatrix("randomized_svd_sketch({0}, {1}, {2})".format(str(X), l, seed), shape=(n, l),
+                       shard_sizes=[X.shard_sizes[1], l], parent_fn=matrix_utils.make_normal_parent(seed))
+    Y = binops.gemm(pwex, X, sketch, out_bucket=out_bucket, tasks_per_job=tasks_per_job)
+    for i in range(power_iters):
+        # orthonormalize between products so small singular values are not lost to rounding
+        Q = _range_basis(pwex, Y)
+        Y.delete()
+        Z = binops.gemm(pwex, X.T, Q, out_bucket=out_bucket, tasks_per_job=tasks_per_job)
+        Q.delete()
+        Q = _range_basis(pwex, Z)
+        Z.delete()
+        Y = binops.gemm(pwex, X, Q, out_bucket=out_bucket, tasks_per_job=tasks_per_job)
+        Q.delete()
+    Q = _range_basis(pwex, Y)
+    Y.delete()
+    # B = Q^T X is only formed transposed, its TSQR leaves a small l x l problem for the driver
+    B_T = binops.gemm(pwex, X.T, Q, out_bucket=out_bucket, tasks_per_job=tasks_per_job)
+    R_B, Q_B = tsqr(pwex, B_T, q="explicit")
+    B_T.delete()
+    U_small, s, V_small_T = np.linalg.svd(R_B.numpy().T)
+    R_B.delete()
+    factors = []
+    for basis, small in [(Q, U_small[:, :k]), (Q_B, V_small_T[:k].T)]:
+        small_sharded = BigMatrix("randomized_svd_factor({0})".format(matrix_utils.hash_array(small)), shape=small.shape,
+                                  shard_sizes=[l, k], write_header=True)
+        shard_matrix(small_sharded, small)
+        factors.append(binops.gemm(pwex, basis, small_sharded, out_bucket=out_bucket, tasks_per_job=tasks_per_job))
+        basis.delete()
+        small_sharded.delete()
+    return factors[0], s[:k], factors[1]
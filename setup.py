@@ -23,7 +23,8 @@ setup(
     install_requires=[
         'Click', 'boto3', 'PyYAML',
         'enum34', 'flaky', 'glob2',
-        'watchtower', 'tblib', 'pywren' # it's nuts that we need both botos
+        'watchtower', 'tblib', 'pywren', # it's nuts that we need both botos
+        'threadpoolctl'
     ],
     tests_requires=[
         'pytest', 'numpy',
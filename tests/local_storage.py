@@ -0,0 +1,32 @@
+import os
+import tempfile
+from numpywren import local, lambdapack as lp
+import unittest
+
+
+class InProcessExecutor(object):
+    ''' Runs every task in the calling process, so programs run with it share
+        this process's block cache and can report to a trace.ListTraceSink
+    '''
+    def __init__(self, config=None):
+        self.config = config
+
+    def map(self, func, iterdata, extra_env=None):
+        return [lp._DoneFuture(func(x)) for x in iterdata]
+
+
+class LocalStorageTestCase(unittest.TestCase):
+    ''' Runs the tests of a class against a fresh local object store
+        and restores the previous storage setting afterwards
+    '''
+    @classmethod
+    def setUpClass(cls):
+        cls.old_storage = local.local_storage_root()
+        local.use_local_storage(tempfile.mkdtemp())
+
+    @classmethod
+    def tearDownClass(cls):
+        if (cls.old_storage is None):
+            os.environ.pop(local.LOCAL_STORAGE_ENV)
+        else:
+            os.environ[local.LOCAL_STORAGE_ENV] = cls.old_storage
@@ -0,0 +1,95 @@
+from numpywren import local
+from numpywren.matrix import BigMatrix
+from numpywren import binops, planner
+from numpywren.matrix_init import shard_matrix
+from tests.local_storage import LocalStorageTestCase
+import numpy as np
+
+
+class ElemwiseTestClass(LocalStorageTestCase):
+    def shard(self, key, X, shard_sizes):
+        X_sharded = BigMatrix(key, shape=X.shape, shard_sizes=shard_sizes, dtype=X.dtype)
+        shard_matrix(X_sharded, X)
+        return X_sharded
+
+    def test_binops(self):
+        np.random.seed(0)
+        X = np.random.randn(40, 24)
+        Y = np.random.randn(40, 24)
+        X_sharded = self.shard("elemwise_X", X, [8, 8])
+        Y_sharded = self.shard("elemwise_Y", Y, [8, 8])
+        pwex = local.LocalExecutor(workers=2)
+        for op, f in [(binops.add, np.add), (binops.sub, np.subtract),
+                      (binops.mul, np.multiply), (binops.div, np.true_divide)]:
+            XY_sharded = op(pwex, X_sharded, Y_sharded, tasks_per_job=4)
+            assert(np.allclose(XY_sharded.numpy(), f(X, Y)))
+        A = self.shard("elemwise_A", X > 0, [8, 8])
+        B = self.shard("elemwise_B", Y > 0, [8, 8])
+        for op, f in [(binops.logical_and, np.logical_and), (binops.logical_or, np.logical_or),
+                      (binops.xor, np.logical_xor)]:
+            AB_sharded = op(pwex, A, B)
+            assert(AB_sharded.dtype == np.bool_)
+            assert(np.all(AB_sharded.numpy() == f(X > 0, Y > 0)))
+
+    def test_different_shards(self):
+        np.random.seed(1)
+        X = np.random.randn(30, 20)
+        Y = np.random.randn(30, 20)
+        X_sharded = self.shard("elemwise_shards_X", X, [8, 8])
+        Y_sharded = self.shard("elemwise_shards_Y", Y, [6, 5])
+        pwex = local.LocalExecutor(workers=2)
+        stats = {}
+        XY_sharded = binops.add(pwex, X_sharded, Y_sharded, tasks_per_job=3, stats=stats)
+        assert(XY_sharded.shard_sizes == [8, 8])
+        assert(np.allclose(XY_sharded.numpy(), X + Y))
+        # every block of X and Y is read once per task that needs it
+        assert(stats["read_bytes"] >= 2*X.nbytes)
+        assert(stats["write_bytes"] == X.nbytes)
+        XT_sharded = binops.sub(pwex, X_sharded.T, self.shard("elemwise_shards_YT", Y.T.copy(), [7, 9]))
+        assert(np.allclose(XT_sharded.numpy(), X.T - Y.T))
+
+    def test_broadcast(self):
+        np.random.seed(2)
+        X = np.random.randn(32, 24)
+        row = np.random.randn(1, 24)
+        col = np.random.randn(32, 1)
+        X_sharded = self.shard("elemwise_bcast_X", X, [8, 8])
+        row_sharded = self.shard("elemwise_bcast_row", row, [1, 16])
+        col_sharded = self.shard("elemwise_bcast_col", col, [8, 1])
+        pwex = local.LocalExecutor(workers=2)
+        assert(np.allclose(binops.sub(pwex, X_sharded, row_sharded).numpy(), X - row))
+        assert(np.allclose(binops.div(pwex, X_sharded, col_sharded).numpy(), X/col))
+        # outer sum of a column and a row vector
+        outer = binops.add(pwex, col_sharded, row_sharded)
+        assert(tuple(outer.shape) == (32, 24))
+        assert(np.allclose(outer.numpy(), col + row))
+        # vectors and scalars kept in memory
+        assert(np.allclose(binops.mul(pwex, X_sharded, row[0]).numpy(), X*row[0]))
+        assert(np.allclose(binops.mul(pwex, 2.0, X_sharded).numpy(), 2.0*X))
+        with self.assertRaises(Exception):
+            binops.add(pwex, X_sharded, np.ones(5))
+
+    def test_in_place(self):
+        np.random.seed(3)
+        X = np.random.randn(24, 24)
+        Y = np.random.randn(24, 24)
+        X_sharded = self.shard("elemwise_inplace_X", X, [8, 8])
+        Y_sharded = self.shard("elemwise_inplace_Y", Y, [8, 8])
+        pwex = local.LocalExecutor(workers=2)
+        stats = {}
+        profile = planner.ExecutorProfile(gbytes_per_second=1.0, workers=2)
+        out = binops.add(pwex, X_sharded, Y_sharded, out=X_sharded, profile=profile, stats=stats)
+        assert(out is X_sharded)
+        assert(np.allclose(X_sharded.numpy(), X + Y))
+        assert(stats["ceiling_gbytes_per_second"] == 2.0)
+        # other tasks read the blocks a transposed operand would overwrite
+        with self.assertRaises(Exception):
+            binops.add(pwex, X_sharded, X_sharded.T, out=X_sharded)
+
+
+if __name__ == "__main__":
+    tests = ElemwiseTestClass()
+    tests.test_binops()
+    tests.test_different_shards()
+    tests.test_broadcast()
+    tests.test_in_place()
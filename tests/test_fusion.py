@@ -0,0 +1,92 @@
+from numpywren import local, simulator, lambdapack as lp
+from numpywren.matrix import BigSymmetricMatrix
+from numpywren.matrix_init import shard_matrix
+from tests.local_storage import LocalStorageTestCase
+import numpy as np
+from numpy.linalg import cholesky
+import unittest
+
+
+def symbolic_cholesky(n, shard_size):
+    X = simulator.SymbolicMatrix("X", shape=(n, n), shard_sizes=(shard_size, shard_size))
+    trailing = [X]
+    for i in range(len(X._block_idxs(0))):
+        trailing.append(simulator.SymbolicMatrix("X_chol_{0}_trailing".format(i), shape=(n, n),
+                                                 shard_sizes=(shard_size, shard_size)))
+    L = simulator.SymbolicMatrix("X_chol", shape=(n, n), shard_sizes=(shard_size, shard_size))
+    trailing.append(L)
+    return lp._chol_instructions(trailing), X, L
+
+def block_keys(inst_blocks, inst_type):
+    keys = []
+    for inst_block in inst_blocks:
+        keys += [lp._block_key(inst) for inst in inst_block.instrs if isinstance(inst, inst_type)]
+    return keys
+
+
+class FusionTestClass(unittest.TestCase):
+    def test_fused_block_count(self):
+        counts = []
+        for granularity in [1, 2, 4, 8]:
+            inst_blocks, X, L = symbolic_cholesky(256, 32)
+            fused = lp.fuse_instruction_blocks(inst_blocks, granularity, outputs=[L])
+            assert(len(fused) <= len(inst_blocks))
+            counts.append(len(fused))
+        for coarse, fine in zip(counts[1:], counts[:-1]):
+            assert(coarse < fine)
+
+    def test_fused_units(self):
+        inst_blocks, X, L = symbolic_cholesky(256, 32)
+        written = set(block_keys(inst_blocks, lp.RemoteWrite))
+        L_written = set([k for k in written if k[0] == id(L)])
+        assert(len(L_written) == 8*9//2)
+        fused = lp.fuse_instruction_blocks(inst_blocks, 4, outputs=[L])
+        assert(len(fused) < len(inst_blocks))
+        for inst_block in fused:
+            # a unit never loads the same block twice
+            loads = [lp._block_key(inst) for inst in inst_block.instrs if isinstance(inst, lp.RemoteLoad)]
+            assert(len(loads) == len(set(loads)))
+
+        fused_written = set(block_keys(fused, lp.RemoteWrite))
+        fused_loaded = set(block_keys(fused, lp.RemoteLoad))
+        elided = written - fused_written
+        assert(len(elided) > 0)
+        # every block of L is still written, only intermediates are elided
+        assert(L_written <= fused_written)
+        for key in elided:
+            assert(key[0] != id(L))
+            assert(key not in fused_loaded)
+        # and every block a unit loads is written by some unit
+        for key in fused_loaded:
+            assert(key[0] == id(X) or key in fused_written)
+
+        children, parents = lp.io_dependency_analyze(fused)
+        order = lp._topological_order(children, parents)
+        assert(sorted(order) == list(range(len(fused))))
+
+    def test_no_outputs_keeps_writes(self):
+        inst_blocks, X, L = symbolic_cholesky(256, 32)
+        written = set(block_keys(inst_blocks, lp.RemoteWrite))
+        fused = lp.fuse_instruction_blocks(inst_blocks, 4)
+        assert(set(block_keys(fused, lp.RemoteWrite)) == written)
+
+
+class FusedCholeskyTestClass(LocalStorageTestCase):
+    def test_fused_cholesky(self):
+        np.random.seed(0)
+        X = np.random.randn(128, 128)
+        A = X.dot(X.T) + np.eye(X.shape[0])
+        A_sharded = BigSymmetricMatrix("fused_cholesky_test_A", shape=A.shape, shard_sizes=[32, 32])
+        shard_matrix(A_sharded, A)
+        instructions, L_sharded, trailing = lp._chol(A_sharded)
+        program = lp.LambdaPackProgram(instructions, executor=local.LocalExecutor, pywren_config={},
+                                       fusion_granularity=4, outputs=[L_sharded])
+        assert(len(program.inst_blocks) < len(instructions) + 1)
+        program.start()
+        program.wait(0.1)
+        assert(program.program_status() == lp.EC.SUCCESS)
+        assert(np.allclose(L_sharded.numpy(), cholesky(A)))
+
+
+if __name__ == "__main__":
+    unittest.main()
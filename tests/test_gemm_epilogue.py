@@ -0,0 +1,63 @@
+from numpywren import local
+from numpywren.matrix import BigMatrix
+from numpywren import binops
+from numpywren.matrix_init import shard_matrix
+from tests.local_storage import LocalStorageTestCase
+import numpy as np
+
+
+class GemmEpilogueTestClass(LocalStorageTestCase):
+    def setUp(self):
+        np.random.seed(0)
+        self.X = np.random.randn(72, 24)
+        self.Y = np.random.randn(40, 24)
+        self.X_sharded = BigMatrix("gemm_epilogue_X", shape=self.X.shape, shard_sizes=[16, 8])
+        self.Y_sharded = BigMatrix("gemm_epilogue_Y", shape=self.Y.shape, shard_sizes=[16, 8])
+        shard_matrix(self.X_sharded, self.X)
+        shard_matrix(self.Y_sharded, self.Y)
+        self.pwex = local.LocalExecutor(workers=2)
+        self.row_norms = np.sum(self.X**2, axis=1)
+        self.col_norms = np.sum(self.Y**2, axis=1)
+        self.distances = self.row_norms[:, np.newaxis] - 2*self.X.dot(self.Y.T) + self.col_norms[np.newaxis, :]
+
+    def test_scale_bias_ufunc(self):
+        C = np.random.randn(72, 40)
+        C_sharded = BigMatrix("gemm_epilogue_C", shape=C.shape, shard_sizes=[16, 16])
+        shard_matrix(C_sharded, C)
+        epilogue = binops.GemmEpilogue(alpha=-2.0, beta=0.5, C=C_sharded, row_bias=self.row_norms,
+                                       col_bias=self.col_norms, ufunc=np.abs)
+        XY_sharded = binops.gemm(self.pwex, self.X_sharded, self.Y_sharded.T, tasks_per_job=2, epilogue=epilogue)
+        assert(np.allclose(XY_sharded.numpy(), np.abs(self.distances + 0.5*C)))
+
+    def test_nearest_neighbor(self):
+        # the distance matrix is reduced by the workers and never written
+        epilogue = binops.GemmEpilogue(alpha=-2.0, row_bias=self.row_norms, col_bias=self.col_norms,
+                                       reduction="argmin", axis=0)
+        argmins = binops.gemm(self.pwex, self.X_sharded, self.Y_sharded.T, epilogue=epilogue)
+        assert(np.all(argmins == np.argmin(self.distances, axis=0)))
+
+    def test_reductions(self):
+        XYT = self.X.dot(self.Y.T)
+        for reduction, expected in [("sum", XYT.sum(axis=1)), ("min", XYT.min(axis=1)),
+                                    ("max", XYT.max(axis=1)), ("argmax", XYT.argmax(axis=1))]:
+            epilogue = binops.GemmEpilogue(reduction=reduction)
+            result = binops.gemm(self.pwex, self.X_sharded, self.Y_sharded.T, epilogue=epilogue)
+            assert(np.allclose(result, expected))
+
+    def test_topk(self):
+        epilogue = binops.GemmEpilogue(alpha=-2.0, row_bias=self.row_norms, col_bias=self.col_norms,
+                                       reduction="topk", k=5, largest=False)
+        values, idxs = binops.gemm(self.pwex, self.X_sharded, self.Y_sharded.T, tasks_per_job=3, epilogue=epilogue)
+        expected = np.argsort(self.distances, axis=1)[:, :5]
+        assert(np.all(idxs == expected))
+        assert(np.allclose(values, np.sort(self.distances, axis=1)[:, :5]))
+
+    def test_tiled_epilogue(self):
+        stats = {}
+        epilogue = binops.GemmEpilogue(alpha=-2.0, row_bias=self.row_norms, col_bias=self.col_norms,
+                                       reduction="argmin", axis=1)
+        argmins = binops.gemm(self.pwex, self.X_sharded, self.Y_sharded.T, worker_memory=8*16*16*8,
+                              k_splits=2, epilogue=epilogue, stats=stats)
+        assert(np.all(argmins == np.argmin(self.distances, axis=1)))
+        assert(stats["predicted_read_bytes"] == stats["read_bytes"])
+        assert(stats["predicted_write_bytes"] == stats["write_bytes"])
@@ -0,0 +1,100 @@
+from numpywren import local
+from numpywren.matrix import BigMatrix, BigSymmetricMatrix, DEFAULT_BUCKET
+from numpywren import matrix_utils, binops, uops
+from numpywren.matrix_init import shard_matrix
+from tests.local_storage import LocalStorageTestCase
+import numpy as np
+
+
+class GemmTiledTestClass(LocalStorageTestCase):
+    def check_gemm(self, key, m, k, n, shard_size, worker_memory, k_splits=1):
+        np.random.seed(m)
+        X = np.random.randn(m, k)
+        Y = np.random.randn(k, n)
+        X_sharded = BigMatrix(key + "_X", shape=X.shape, shard_sizes=[shard_size, shard_size])
+        Y_sharded = BigMatrix(key + "_Y", shape=Y.shape, shard_sizes=[shard_size, shard_size])
+        shard_matrix(X_sharded, X)
+        shard_matrix(Y_sharded, Y)
+        pwex = local.LocalExecutor(workers=2)
+        stats = {}
+        XY_sharded = binops.gemm(pwex, X_sharded, Y_sharded, worker_memory=worker_memory,
+                                 k_splits=k_splits, min_tasks=4, stats=stats)
+        assert(np.allclose(XY_sharded.numpy(), X.dot(Y)))
+        assert(stats["tile_memory"] <= worker_memory)
+        assert(stats["predicted_read_bytes"] == stats["read_bytes"])
+        assert(stats["predicted_write_bytes"] == stats["write_bytes"])
+        return stats
+
+    def test_gemm_tiled(self):
+        stats = self.check_gemm("gemm_tiled", 100, 70, 90, 16, 8*16*16*8)
+        # every worker holds a 2x2 rectangle of output blocks and streams its inputs
+        assert(stats["tile_shape"] == (2, 2))
+
+    def test_gemm_tiled_reads_less(self):
+        small = self.check_gemm("gemm_tiled_small", 64, 64, 64, 16, 8*16*16*3)
+        large = self.check_gemm("gemm_tiled_large", 64, 64, 64, 16, 8*16*16*8)
+        assert(small["tile_shape"] == (1, 1))
+        assert(large["read_bytes"] < small["read_bytes"])
+
+    def test_gemm_k_split(self):
+        stats = self.check_gemm("gemm_k_split", 64, 96, 48, 16, 8*16*16*20, k_splits=3)
+        assert(stats["k_splits"] == 3)
+        # the partial products and their headers are gone once reduced
+        keys = matrix_utils.list_all_keys(DEFAULT_BUCKET, "numpywren.objects/")
+        assert(len([k for k in keys if "gemm_partial" in k]) == 0)
+
+    def test_gemm_tiled_symmetric(self):
+        X = np.random.randn(80, 40)
+        X_sharded = BigMatrix("gemm_tiled_sym", shape=X.shape, shard_sizes=[16, 16])
+        shard_matrix(X_sharded, X)
+        pwex = local.LocalExecutor(workers=2)
+        stats = {}
+        XXT_sharded = binops.gemm(pwex, X_sharded, X_sharded.T, worker_memory=8*16*16*8, k_splits=2, stats=stats)
+        assert(np.allclose(XXT_sharded.numpy(), X.dot(X.T)))
+        assert(stats["predicted_read_bytes"] == stats["read_bytes"])
+
+    def test_gemm_tiled_no_fit(self):
+        X_sharded = BigMatrix("gemm_tiled_no_fit", shape=(32, 32), shard_sizes=[16, 16])
+        with self.assertRaises(Exception):
+            binops.plan_gemm_tiles(X_sharded, X_sharded, 8*16*16)
+
+    def test_hilbert_groups(self):
+        block_idxs = [(i, j) for i in range(8) for j in range(8)]
+        order = matrix_utils.hilbert_order(block_idxs)
+        assert(sorted(order) == block_idxs)
+        for group in matrix_utils.chunk(order, 4):
+            # every group of 4 blocks is a 2x2 patch
+            assert(len(set([i for i, _ in group])) == 2)
+            assert(len(set([j for _, j in group])) == 2)
+
+    def test_gemm_grouped(self):
+        X = np.random.randn(64, 48)
+        Y = np.random.randn(48, 80)
+        X_sharded = BigMatrix("gemm_grouped_X", shape=X.shape, shard_sizes=[16, 16])
+        Y_sharded = BigMatrix("gemm_grouped_Y", shape=Y.shape, shard_sizes=[16, 16])
+        shard_matrix(X_sharded, X)
+        shard_matrix(Y_sharded, Y)
+        pwex = local.LocalExecutor(workers=2)
+        XY_sharded = binops.gemm(pwex, X_sharded, Y_sharded, tasks_per_job=4)
+        assert(np.allclose(XY_sharded.numpy(), X.dot(Y)))
+
+    def test_gemm_symmetric_lower_triangle(self):
+        X = np.random.randn(64, 96)
+        X_sharded = BigMatrix("gemm_syrk_X", shape=X.shape, shard_sizes=[16, 16])
+        shard_matrix(X_sharded, X)
+        pwex = local.LocalExecutor(workers=2)
+        XXT_sharded = binops.gemm(pwex, X_sharded, X_sharded.T, tasks_per_job=3)
+        assert(np.allclose(XXT_sharded.numpy(), X.dot(X.T)))
+        # only the 10 blocks on and below the diagonal are computed and stored
+        assert(len(XXT_sharded.block_idxs_exist) == 10)
+        assert(all([i >= j for i, j in XXT_sharded.block_idxs_exist]))
+        L_sharded = uops.chol(pwex, XXT_sharded)
+        assert(np.allclose(L_sharded.numpy(), np.linalg.cholesky(X.dot(X.T))))
+
+    def test_symmetric_put_block_upper(self):
+        XXT_sharded = BigSymmetricMatrix("gemm_syrk_put", shape=(32, 32), shard_sizes=[16, 16], write_header=True)
+        block = np.random.randn(16, 16)
+        XXT_sharded.put_block(block, 0, 1)
+        assert(XXT_sharded.block_idxs_exist == [(1, 0)])
+        assert(np.allclose(XXT_sharded.get_block(1, 0), block.T))
+        assert(np.allclose(XXT_sharded.get_block(0, 1), block))
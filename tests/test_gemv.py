@@ -0,0 +1,126 @@
+from numpywren import local
+from numpywren.matrix import BigMatrix
+from numpywren import matrix_utils, binops
+from numpywren.matrix_init import shard_matrix
+from tests.local_storage import LocalStorageTestCase
+import numpy as np
+
+class GemvTestClass(LocalStorageTestCase):
+    def test_single_shard_gemv(self):
+        X = np.random.randn(16,16)
+        Y = np.random.randn(16)
+        X_sharded = BigMatrix("gemv_test_0", shape=X.shape, shard_sizes=X.shape)
+        Y_sharded = BigMatrix("gemv_test_2", shape=Y.shape, shard_sizes=Y.shape)
+        shard_matrix(X_sharded, X)
+        shard_matrix(Y_sharded, Y)
+        pwex = local.LocalExecutor()
+        XY_sharded = binops.gemv(pwex, X_sharded, Y_sharded, X_sharded.bucket, 1)
+        XY_sharded_local = XY_sharded.numpy()
+        XY = X.dot(Y)
+        X_sharded.free()
+        XY_sharded.free()
+        assert(np.all(np.isclose(XY,XY_sharded_local)))
+
+    def test_multiple_shard_gemv(self):
+        X = np.random.randn(16,16)
+        Y = np.random.randn(16)
+        shard_sizes_0 = tuple(map(int, np.array(X.shape)/2))
+        shard_sizes_1 = tuple(map(int, np.array(Y.shape)/2))
+        X_sharded = BigMatrix("gemv_test_1", shape=X.shape, shard_sizes=shard_sizes_0)
+        Y_sharded = BigMatrix("gemv_test_2", shape=Y.shape, shard_sizes=shard_sizes_1)
+        shard_matrix(X_sharded, X)
+        shard_matrix(Y_sharded, Y)
+        pwex = local.LocalExecutor()
+        XY_sharded = binops.gemv(pwex, X_sharded, Y_sharded, X_sharded.bucket, 1)
+        XY_sharded_local = XY_sharded.numpy()
+        XY = X.dot(Y)
+        X_sharded.free()
+        Y_sharded.free()
+        XY_sharded.free()
+        assert(np.all(np.isclose(XY,XY_sharded_local)))
+
+    def test_multiple_shard_matrix_gemv(self):
+        X = np.random.randn(16,16)
+        Y = np.random.randn(16,1)
+        shard_sizes_0 = tuple(map(int, np.array(X.shape)/2))
+        shard_sizes_1 = (Y.shape[0], 1)
+        X_sharded = BigMatrix("gemv_test_1", shape=X.shape, shard_sizes=shard_sizes_0)
+        Y_sharded = BigMatrix("gemv_test_2", shape=Y.shape, shard_sizes=shard_sizes_1)
+        shard_matrix(X_sharded, X)
+        shard_matrix(Y_sharded, Y)
+        pwex = local.LocalExecutor()
+        XY_sharded = binops.gemv(pwex, X_sharded, Y_sharded, X_sharded.bucket, 1)
+        XY_sharded_local = XY_sharded.numpy()
+        XY = X.dot(Y)
+        X_sharded.free()
+        Y_sharded.free()
+        XY_sharded.free()
+        assert(np.all(np.isclose(XY,XY_sharded_local)))
+
+    def test_multi_vector_tree(self):
+        X = np.random.randn(40, 64)
+        Y = np.random.randn(64, 3)
+        X_sharded = BigMatrix("gemv_test_tree", shape=X.shape, shard_sizes=[8, 8])
+        shard_matrix(X_sharded, X)
+        pwex = local.LocalExecutor(workers=2)
+        stats = {}
+        XY = binops.gemv(pwex, X_sharded, Y, arity=2, stats=stats)
+        assert(np.allclose(XY, X.dot(Y)))
+        # 5 row blocks with 8 single block partials each
+        assert(stats["tasks"] == 40)
+        assert(stats["levels"] == 3)
+        XTy = binops.gemv(pwex, X_sharded.T, Y[:40, 0], tasks_per_job=2)
+        assert(np.allclose(XTy, X.T.dot(Y[:40, 0])))
+        many = binops.gemv_many(pwex, X_sharded, [Y[:, 0], Y[:, 1]], tasks_per_job=8)
+        assert(np.allclose(many[1], X.dot(Y[:, 1])))
+
+    def test_cached_gemv(self):
+        X = np.random.randn(32, 32)
+        X_sharded = BigMatrix("gemv_test_cache", shape=X.shape, shard_sizes=[8, 8])
+        shard_matrix(X_sharded, X)
+        pwex = local.LocalExecutor(workers=2)
+        # power iteration, the vector is large enough to be stored as an object.
+        # local runs every task in this process, the long lived worker here
+        y0 = np.random.randn(32)
+        y = y0
+        for it in range(3):
+            stats = {}
+            y = binops.gemv(pwex, X_sharded, y, tasks_per_job=4, local=True, cache=True, inline_bytes=64, stats=stats)
+            if (it > 0):
+                # every block of X comes from the worker cache, only the vector is read
+                assert(stats["cache_hits"] == 16)
+                assert(stats["read_bytes"] == stats["tasks"]*32*8)
+        assert(np.allclose(y, X.dot(X.dot(X.dot(y0)))))
+
+    def test_remote_tree(self):
+        np.random.seed(0)
+        X = np.random.randn(40, 64)
+        Y = np.random.randn(64, 2)
+        X_sharded = BigMatrix("gemv_test_remote_X", shape=X.shape, shard_sizes=[8, 8])
+        Y_sharded = BigMatrix("gemv_test_remote_Y", shape=Y.shape, shard_sizes=[12, 2])
+        shard_matrix(X_sharded, X)
+        shard_matrix(Y_sharded, Y)
+        pwex = local.LocalExecutor(workers=2)
+        stats = {}
+        XY_sharded = binops.gemv(pwex, X_sharded, Y_sharded, arity=3, stats=stats)
+        assert(stats["remote_reduce"])
+        # 8 partials per row block, 8 -> 3 -> 1
+        assert(stats["levels"] == 2)
+        assert(np.allclose(XY_sharded.numpy(), X.dot(Y)))
+        # the partial products and inner tree nodes are deleted
+        keys = matrix_utils.list_all_keys(X_sharded.bucket, "numpywren.objects/")
+        assert(len([k for k in keys if "gemv_partial" in k or "gemv_tree" in k]) == 0)
+        # numpy vectors whose partials do not fit the driver are reduced the same way
+        driver = binops.gemv(pwex, X_sharded, Y[:, 0], arity=3)
+        remote = binops.gemv(pwex, X_sharded, Y[:, 0], arity=3, driver_bytes=0, stats=stats)
+        assert(stats["remote_reduce"])
+        assert(np.array_equal(driver, remote))
+
+if __name__ == "__main__":
+    tests = GemvTestClass()
+    tests.test_single_shard_gemv()
+    tests.test_multiple_shard_gemv()
+    tests.test_multiple_shard_matrix_gemv()
+    tests.test_multi_vector_tree()
+    tests.test_cached_gemv()
+    tests.test_remote_tree()
@@ -0,0 +1,199 @@
+import os
+import time
+from numpywren import local
+from numpywren.matrix import BigMatrix, BigSymmetricMatrix
+from numpywren import matrix_utils, uops, binops, lambdapack as lp
+from numpywren.matrix_init import shard_matrix
+from tests.local_storage import LocalStorageTestCase, InProcessExecutor
+import numpy as np
+from numpy.linalg import cholesky
+from threadpoolctl import threadpool_info
+
+
+def _blas_threads(x):
+    # the thread count the loaded BLAS libraries actually use
+    threads = [pool["num_threads"] for pool in threadpool_info() if pool["user_api"] == "blas"]
+    return os.environ["OMP_NUM_THREADS"], threads
+
+def _fail(x):
+    raise ValueError(x)
+
+
+class LocalExecutorTestClass(LocalStorageTestCase):
+    def test_map(self):
+        pwex = local.LocalExecutor(workers=2)
+        futures = pwex.map(lambda x: x*x, range(16))
+        assert(matrix_utils.wait_all(futures) == [x*x for x in range(16)])
+
+    def test_extra_env(self):
+        pwex = local.LocalExecutor(workers=2)
+        futures = pwex.map(_blas_threads, range(4), extra_env={"OMP_NUM_THREADS": "3"})
+        for env, threads in matrix_utils.wait_all(futures):
+            assert(env == "3")
+            assert(len(threads) > 0 and all([t == 3 for t in threads]))
+        env, threads = pwex.call_async(_blas_threads, 0).result()
+        assert(env == "1")
+        assert(len(threads) > 0 and all([t == 1 for t in threads]))
+
+    def test_exception(self):
+        pwex = local.LocalExecutor(workers=2)
+        with self.assertRaises(ValueError):
+            pwex.call_async(_fail, 1).result()
+
+    def test_local_cholesky(self):
+        np.random.seed(1)
+        X = np.random.randn(256, 256)
+        A = X.dot(X.T) + np.eye(X.shape[0])
+        pwex = local.LocalExecutor(workers=2)
+        A_sharded = BigSymmetricMatrix("local_cholesky_test_A", shape=A.shape, shard_sizes=[64, 64])
+        shard_matrix(A_sharded, A)
+        L_sharded = uops.chol(pwex, A_sharded)
+        assert(np.allclose(L_sharded.numpy(), cholesky(A)))
+
+    def test_local_gemm(self):
+        np.random.seed(1)
+        X = np.random.randn(256, 128)
+        pwex = local.LocalExecutor(workers=2)
+        X_sharded = BigMatrix("local_gemm_test_X", shape=X.shape, shard_sizes=[64, 64])
+        shard_matrix(X_sharded, X)
+        XXT_sharded = binops.gemm(pwex, X_sharded, X_sharded.T, tasks_per_job=2)
+        assert(np.allclose(XXT_sharded.numpy(), X.dot(X.T)))
+
+    def test_in_place_nodes_idempotent(self):
+        # SYRK and GEMM update their first argument in place, running a node
+        # again on a worker whose cache holds that block must give the same result
+        np.random.seed(3)
+        C = np.random.randn(8, 8)
+        A = np.random.randn(8, 8)
+        C_sharded = BigMatrix("local_idempotent_C", shape=C.shape, shard_sizes=[8, 8])
+        A_sharded = BigMatrix("local_idempotent_A", shape=A.shape, shard_sizes=[8, 8])
+        out_sharded = BigMatrix("local_idempotent_out", shape=C.shape, shard_sizes=[8, 8])
+        shard_matrix(C_sharded, C)
+        shard_matrix(A_sharded, A)
+        lp._BLOCK_CACHE.clear()
+        for op, expected in [("syrk", np.tril(C - A.dot(A.T))), ("gemm", C - A.dot(A.T))]:
+            load_C = lp.RemoteLoad(0, C_sharded, 0, 0)
+            load_A = lp.RemoteLoad(1, A_sharded, 0, 0)
+            if (op == "syrk"):
+                update = lp.RemoteSYRK(2, [load_C, load_A])
+            else:
+                update = lp.RemoteGEMM(2, [load_C, load_A, load_A])
+            write = lp.RemoteWrite(3, out_sharded, update, 0, 0)
+            node = lp.InstructionBlock([load_C, load_A, update, write])
+            results = []
+            for run in range(2):
+                node.clear()
+                node()
+                results.append(np.tril(out_sharded.get_block(0, 0)) if op == "syrk" else out_sharded.get_block(0, 0))
+            assert(np.allclose(results[0], expected))
+            assert(np.allclose(results[1], expected))
+            assert(np.allclose(lp._BLOCK_CACHE.get(C_sharded, 0, 0), C))
+
+    def test_inline_depth_limit(self):
+        np.random.seed(4)
+        X = np.random.randn(128, 128)
+        A = X.dot(X.T) + np.eye(X.shape[0])
+        A_sharded = BigSymmetricMatrix("local_inline_test_A", shape=A.shape, shard_sizes=[16, 16])
+        shard_matrix(A_sharded, A)
+        for inline_depth_limit in [0, 2, 64]:
+            instructions, L_sharded, trailing = lp._chol(A_sharded)
+            program = lp.LambdaPackProgram(instructions, executor=local.LocalExecutor, pywren_config={},
+                                           inline_depth_limit=inline_depth_limit)
+            program.start()
+            program.wait(0.1)
+            assert(program.program_status() == lp.EC.SUCCESS)
+            assert(np.allclose(L_sharded.numpy(), cholesky(A)))
+            # every block shows up once, however many ran inline
+            assert([i for i, _ in program.unwind()] == list(range(len(program.inst_blocks))))
+
+    def test_first_incr_race(self):
+        counter = lp.RPS("local_first_incr_test")
+        # another worker increments between this worker's read and its update
+        lp.RPS("local_first_incr_test").incr()
+        reads = [None]
+        counter.get = lambda: reads.pop() if len(reads) > 0 else lp.RPS.get(counter)
+        assert(counter.incr() == 2)
+        assert(lp.RPS("local_first_incr_test").get() == 2)
+
+    def test_speculation_state(self):
+        A = np.eye(32) + 1
+        A_sharded = BigSymmetricMatrix("local_speculation_state_A", shape=A.shape, shard_sizes=[16, 16])
+        shard_matrix(A_sharded, A)
+        instructions, L_sharded, trailing = lp._chol(A_sharded)
+        program = lp.LambdaPackProgram(instructions, executor=local.LocalExecutor, pywren_config={},
+                                       speculation_percentile=90)
+        program._bind_state(program.epoch_status.incr())
+        program._reset_speculation([0, 1], [])
+        # a copy that starts after another one succeeded does not undo the success
+        program.set_inst_block_status(0, lp.EC.SUCCESS)
+        assert(program.set_inst_block_status(0, lp.EC.RUNNING) == lp.EC.SUCCESS)
+        assert(program.inst_block_status(0) == lp.EC.SUCCESS)
+        # stragglers are timed from the worker's start, not from the first poll
+        started = time.time() - 100
+        program.block_start_statuses[1].put(int(1000*started))
+        program.set_inst_block_status(1, lp.EC.RUNNING)
+        program.speculate()
+        assert(abs(program._running_since[1] - started) < 0.01)
+
+    def test_speculative_cholesky(self):
+        np.random.seed(5)
+        X = np.random.randn(128, 128)
+        A = X.dot(X.T) + np.eye(X.shape[0])
+        A_sharded = BigSymmetricMatrix("local_speculation_test_A", shape=A.shape, shard_sizes=[32, 32])
+        shard_matrix(A_sharded, A)
+        instructions, L_sharded, trailing = lp._chol(A_sharded)
+        # every running block is duplicated as soon as one block has finished
+        program = lp.LambdaPackProgram(instructions, executor=local.LocalExecutor, pywren_config={},
+                                       speculation_percentile=0, speculation_min_samples=1)
+        program.start()
+        program.wait(0.01)
+        assert(program.program_status() == lp.EC.SUCCESS)
+        assert(np.allclose(L_sharded.numpy(), cholesky(A)))
+
+    def test_resume_warm_worker(self):
+        np.random.seed(6)
+        X = np.random.randn(64, 64)
+        A = X.dot(X.T) + np.eye(X.shape[0])
+        A_sharded = BigSymmetricMatrix("local_resume_test_A", shape=A.shape, shard_sizes=[16, 16])
+        shard_matrix(A_sharded, A)
+        instructions, L_sharded, trailing = lp._chol(A_sharded)
+        program = lp.LambdaPackProgram(instructions, executor=InProcessExecutor, pywren_config={})
+        program.start()
+        assert(program.program_status() == lp.EC.SUCCESS)
+        first_scope = lp._BLOCK_CACHE.scope
+        # pretend the last block and the exit failed, leaving garbage in the warm cache
+        last = program.parents[-1][0]
+        program.block_return_statuses[last].put(lp.EC.EXCEPTION.value)
+        program.ret_status.put(lp.EC.EXCEPTION.value)
+        for inst in program.inst_blocks[last].instrs:
+            if (isinstance(inst, lp.RemoteLoad)):
+                lp._BLOCK_CACHE.put(np.zeros((16, 16)), inst.matrix, *inst.bidxs)
+        for inst in program.inst_blocks[last].instrs:
+            if (isinstance(inst, lp.RemoteWrite)):
+                inst.matrix.delete_block(*inst.bidxs)
+        program.resume()
+        assert(program.program_status() == lp.EC.SUCCESS)
+        assert(lp._BLOCK_CACHE.scope != first_scope)
+        assert(np.allclose(L_sharded.numpy(), cholesky(A)))
+
+    def test_garbage_collection(self):
+        np.random.seed(2)
+        X = np.random.randn(256, 256)
+        A = X.dot(X.T) + np.eye(X.shape[0])
+        A_sharded = BigSymmetricMatrix("local_gc_test_A", shape=A.shape, shard_sizes=[64, 64])
+        shard_matrix(A_sharded, A)
+        instructions, L_sharded, trailing = lp._chol(A_sharded)
+        program = lp.LambdaPackProgram(instructions, executor=local.LocalExecutor, pywren_config={},
+                                       outputs=[L_sharded])
+        program.start()
+        program.wait(0.1)
+        assert(program.program_status() == lp.EC.SUCCESS)
+        assert(np.allclose(L_sharded.numpy(), cholesky(A)))
+        # only the input is left, every trailing block was deleted by its last reader
+        assert(len(matrix_utils.list_all_keys(A_sharded.bucket, trailing[0].key_base)) > 0)
+        for t in trailing[1:]:
+            assert(len(matrix_utils.list_all_keys(t.bucket, t.key_base)) == 0)
+        stats = program.storage_stats()
+        L_bytes = 10*64*64*8
+        assert(stats["stored_bytes"] == L_bytes)
+        assert(stats["peak_stored_bytes"] < stats["written_bytes"])
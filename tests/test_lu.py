@@ -0,0 +1,45 @@
+from numpywren import local
+from numpywren.matrix import BigMatrix
+from numpywren import matrix_utils, uops, lambdapack as lp
+from numpywren.matrix_init import shard_matrix
+from tests.local_storage import LocalStorageTestCase
+import numpy as np
+import scipy.linalg
+
+
+class LUTestClass(LocalStorageTestCase):
+    def check_lu(self, key, n, shard_size, fusion_granularity=1):
+        np.random.seed(n)
+        A = np.random.randn(n, n)
+        pwex = local.LocalExecutor(workers=2)
+        A_sharded = BigMatrix(key, shape=A.shape, shard_sizes=[shard_size, shard_size])
+        shard_matrix(A_sharded, A)
+        LU_sharded, perm = uops.lu(pwex, A_sharded, fusion_granularity=fusion_granularity)
+        LU = LU_sharded.numpy()
+        L = np.tril(LU, -1) + np.eye(n)
+        U = np.triu(LU)
+        P, L_ref, U_ref = scipy.linalg.lu(A)
+        assert(np.allclose(A[perm], L.dot(U)))
+        # partial pivoting over whole columns picks the same pivots as LAPACK
+        assert(np.allclose(P[perm], np.eye(n)))
+        assert(np.allclose(L, L_ref))
+        assert(np.allclose(U, U_ref))
+        return A_sharded, LU_sharded
+
+    def test_lu(self):
+        self.check_lu("lu_test_A", 128, 32)
+
+    def test_lu_ragged(self):
+        self.check_lu("lu_test_ragged_A", 100, 32)
+
+    def test_lu_single_block(self):
+        self.check_lu("lu_test_single_A", 48, 48)
+
+    def test_lu_fused(self):
+        self.check_lu("lu_test_fused_A", 128, 32, fusion_granularity=2)
+
+    def test_lu_garbage_collection(self):
+        A_sharded, LU_sharded = self.check_lu("lu_test_gc_A", 96, 32)
+        instructions, _, _, intermediates = lp._lu(A_sharded)
+        for t in intermediates:
+            assert(len(matrix_utils.list_all_keys(t.bucket, t.key_base)) == 0)
@@ -0,0 +1,74 @@
+from numpywren import local
+from numpywren.matrix import BigMatrix
+from numpywren import binops
+from numpywren.matrix_init import shard_matrix
+from tests.local_storage import LocalStorageTestCase
+import numpy as np
+
+
+class MixedPrecisionTestClass(LocalStorageTestCase):
+    def shard(self, key, X, shard_sizes, dtype):
+        X_sharded = BigMatrix(key, shape=X.shape, shard_sizes=shard_sizes, dtype=dtype)
+        shard_matrix(X_sharded, X.astype(dtype))
+        return X_sharded
+
+    def tiled_read_bytes(self, key, X, Y, dtype):
+        X_sharded = self.shard(key + "_X", X, [16, 16], dtype)
+        Y_sharded = self.shard(key + "_Y", Y, [16, 16], dtype)
+        pwex = local.LocalExecutor(workers=2)
+        stats = {}
+        XY_sharded = binops.gemm(pwex, X_sharded, Y_sharded, worker_memory=8*16*16*8, stats=stats)
+        XY = XY_sharded.numpy()
+        assert(XY.dtype == np.float64)
+        # inputs are rounded to their storage precision, everything after is float64
+        assert(np.allclose(XY, X.astype(dtype).astype(np.float64).dot(Y.astype(dtype).astype(np.float64)),
+                           rtol=1e-12, atol=1e-12))
+        assert(stats["predicted_read_bytes"] == stats["read_bytes"])
+        return stats["read_bytes"]
+
+    def test_storage_precision(self):
+        np.random.seed(0)
+        X = np.random.randn(64, 48)
+        Y = np.random.randn(48, 32)
+        read_64 = self.tiled_read_bytes("mixed_64", X, Y, np.float64)
+        read_32 = self.tiled_read_bytes("mixed_32", X, Y, np.float32)
+        read_16 = self.tiled_read_bytes("mixed_16", X, Y, np.float16)
+        assert(2*read_32 == read_64)
+        assert(4*read_16 == read_64)
+
+    def test_output_dtype(self):
+        np.random.seed(1)
+        X = np.random.randn(48, 48)
+        X_sharded = self.shard("mixed_out_X", X, [16, 16], np.float32)
+        pwex = local.LocalExecutor(workers=2)
+        XY_sharded = binops.gemm(pwex, X_sharded, X_sharded, dtype=np.float32, compute_dtype=np.float64)
+        assert(XY_sharded.dtype == np.float32)
+        XY = XY_sharded.numpy()
+        assert(XY.dtype == np.float32)
+        X32 = X.astype(np.float32).astype(np.float64)
+        assert(np.allclose(XY, X32.dot(X32), rtol=1e-6))
+
+    def test_compensated(self):
+        # a long reduction of positive blocks in a float32 accumulator
+        np.random.seed(2)
+        X = np.random.rand(8, 1024)
+        Y = np.random.rand(1024, 8)
+        X_sharded = self.shard("mixed_kahan_X", X, [8, 4], np.float32)
+        Y_sharded = self.shard("mixed_kahan_Y", Y, [4, 8], np.float32)
+        X32 = X.astype(np.float32).astype(np.float64)
+        Y32 = Y.astype(np.float32).astype(np.float64)
+        exact = X32.dot(Y32)
+        pwex = local.LocalExecutor(workers=2)
+        errors = []
+        for compensated in [False, True]:
+            XY_sharded = binops.gemm(pwex, X_sharded, Y_sharded, dtype=np.float64, compute_dtype=np.float32,
+                                     compensated=compensated)
+            errors.append(np.max(np.abs(XY_sharded.numpy() - exact)/exact))
+        assert(errors[1] < errors[0]/4)
+
+
+if __name__ == "__main__":
+    tests = MixedPrecisionTestClass()
+    tests.test_storage_precision()
+    tests.test_output_dtype()
+    tests.test_compensated()
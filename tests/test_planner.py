@@ -0,0 +1,67 @@
+import logging
+from numpywren import local, planner
+from numpywren.matrix import BigMatrix
+from numpywren import binops
+from numpywren.matrix_init import shard_matrix
+from tests.local_storage import LocalStorageTestCase
+import numpy as np
+
+
+class PlannerTestClass(LocalStorageTestCase):
+    def test_plan_fits_memory(self):
+        X = BigMatrix("planner_big", shape=(65536, 65536), shard_sizes=[4096, 4096], write_header=True)
+        block_bytes = 4096*4096*8
+        profile = planner.ExecutorProfile(memory=4*block_bytes, workers=100)
+        plan = planner.plan_gemm(X, X, profile)
+        assert(plan.memory <= profile.memory)
+        assert(all([c.memory <= profile.memory for c in plan.candidates]))
+        assert(plan.candidates[0] is plan)
+        predicted = [c.predicted_seconds for c in plan.candidates]
+        assert(predicted == sorted(predicted))
+        # a block and its two inputs do not fit
+        with self.assertRaises(Exception):
+            planner.plan_gemm(X, X, planner.ExecutorProfile(memory=2*block_bytes))
+
+    def test_plan_overlaps_io(self):
+        X = BigMatrix("planner_io", shape=(32768, 32768), shard_sizes=[4096, 4096], write_header=True)
+        # with compute as slow as I/O hiding the downloads behind the multiplies pays off
+        profile = planner.ExecutorProfile(memory=2e9, gbytes_per_second=0.1, gflops_per_second=12.0, workers=64)
+        plan = planner.plan_gemm(X, X, profile)
+        assert(plan.strategy == "prefetch")
+        assert(plan.gemm_kwargs()["gemm_impl"] == 2)
+        # only standalone pywren runs the panel strategy
+        assert("panels" not in [c.strategy for c in plan.candidates])
+
+    def test_plan_shard_sizes(self):
+        X = BigMatrix("planner_shards", shape=(16384, 16384), shard_sizes=[4096, 4096], write_header=True)
+        profile = planner.ExecutorProfile(memory=2e9, workers=1000)
+        plan = planner.plan_gemm(X, X, profile, shard_sizes=[1024, 2048])
+        assert(set([c.shard_sizes for c in plan.candidates]) == set([(4096, 4096, 4096), (1024, 1024, 1024), (2048, 2048, 2048)]))
+
+    def test_gemm_with_plan(self):
+        X = np.random.randn(96, 64)
+        Y = np.random.randn(64, 80)
+        X_sharded = BigMatrix("planner_X", shape=X.shape, shard_sizes=[16, 16])
+        Y_sharded = BigMatrix("planner_Y", shape=Y.shape, shard_sizes=[16, 16])
+        shard_matrix(X_sharded, X)
+        shard_matrix(Y_sharded, Y)
+        pwex = local.LocalExecutor(workers=2)
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        planner.logger.addHandler(handler)
+        planner.logger.setLevel(logging.INFO)
+        try:
+            for memory in [4e4, 1e6]:
+                profile = planner.ExecutorProfile(memory=memory, workers=2, task_overhead=0.0)
+                plan = planner.plan_gemm(X_sharded, Y_sharded, profile)
+                XY_sharded = binops.gemm(pwex, X_sharded, Y_sharded, plan=plan)
+                assert(np.allclose(XY_sharded.numpy(), X.dot(Y)))
+        finally:
+            planner.logger.removeHandler(handler)
+        assert(len(records) == 2)
+        # plans for other shard sizes need the inputs resharded
+        resharded = [c for c in planner.plan_gemm(X_sharded, Y_sharded, profile, shard_sizes=[32]).candidates
+                     if c.shard_sizes == (32, 32, 32)]
+        with self.assertRaises(Exception):
+            binops.gemm(pwex, X_sharded, Y_sharded, plan=resharded[0])
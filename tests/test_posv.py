@@ -0,0 +1,52 @@
+from numpywren import local
+from numpywren.matrix import BigMatrix, BigSymmetricMatrix
+from numpywren import binops, lambdapack as lp
+from numpywren.matrix_init import shard_matrix
+from tests.local_storage import LocalStorageTestCase
+import numpy as np
+import scipy.linalg
+
+
+class PosvTestClass(LocalStorageTestCase):
+    def check_trsm(self, key, lower, transpose):
+        np.random.seed(3)
+        n = 100
+        T = np.random.randn(n, n) + n*np.eye(n)
+        # the other triangle holds garbage, it must never be read
+        B = np.random.randn(n, 24)
+        pwex = local.LocalExecutor(workers=2)
+        T_sharded = BigMatrix(key + "_T", shape=T.shape, shard_sizes=[32, 32])
+        shard_matrix(T_sharded, T)
+        B_sharded = BigMatrix(key + "_B", shape=B.shape, shard_sizes=[32, 16])
+        shard_matrix(B_sharded, B)
+        X_sharded = binops.trsm(pwex, T_sharded, B_sharded, lower=lower, transpose=transpose)
+        X = scipy.linalg.solve_triangular(T, B, lower=lower, trans=int(transpose))
+        assert(np.allclose(X_sharded.numpy(), X))
+
+    def test_trsm_lower(self):
+        self.check_trsm("trsm_test_lower", True, False)
+
+    def test_trsm_lower_transpose(self):
+        self.check_trsm("trsm_test_lower_t", True, True)
+
+    def test_trsm_upper(self):
+        self.check_trsm("trsm_test_upper", False, False)
+
+    def test_trsm_upper_transpose(self):
+        self.check_trsm("trsm_test_upper_t", False, True)
+
+    def test_posv(self):
+        np.random.seed(4)
+        X = np.random.randn(128, 128)
+        A = X.dot(X.T) + np.eye(X.shape[0])
+        Y = np.random.randn(128, 1)
+        pwex = local.LocalExecutor(workers=2)
+        A_sharded = BigSymmetricMatrix("posv_test_A", shape=A.shape, shard_sizes=[32, 32])
+        shard_matrix(A_sharded, A)
+        Y_sharded = BigMatrix("posv_test_Y", shape=Y.shape, shard_sizes=[32, 1])
+        shard_matrix(Y_sharded, Y)
+        Z_sharded = binops.posv(pwex, A_sharded, Y_sharded)
+        assert(np.allclose(Z_sharded.numpy(), np.linalg.solve(A, Y)))
+        # the factor and the forward solve were intermediates of the program
+        _, L_sharded, _ = lp._chol(A_sharded)
+        assert(len(L_sharded.block_idxs_exist) == 0)
@@ -0,0 +1,60 @@
+import threading
+import time
+from numpywren import local
+from numpywren.matrix import BigMatrix
+from numpywren import matrix_utils, binops, uops
+from numpywren.matrix_init import shard_matrix
+from tests.local_storage import LocalStorageTestCase
+import numpy as np
+
+
+class PrefetchTestClass(LocalStorageTestCase):
+    def test_pipeline_order_and_depth(self):
+        lock = threading.Lock()
+        in_flight = [0, 0]
+        consumed = []
+        def fetch(item):
+            with lock:
+                in_flight[0] += 1
+                in_flight[1] = max(in_flight[1], in_flight[0] - len(consumed))
+            time.sleep(0.01)
+            return item*item
+        # more threads than depth, the pipeline itself must bound the fetches
+        with matrix_utils.PrefetchPipeline(fetch, range(10), depth=3, threads=6) as pipeline:
+            for item, result in pipeline:
+                assert(result == item*item)
+                with lock:
+                    consumed.append(item)
+                time.sleep(0.01)
+        assert(consumed == list(range(10)))
+        # never more than depth results alive, the consumer's included
+        assert(in_flight[1] <= 3)
+        stats = pipeline.stats()
+        assert(stats["wait_seconds"] < stats["io_seconds"])
+        assert(0 < stats["overlap_efficiency"] <= 1)
+
+    def test_pipeline_synchronous(self):
+        with matrix_utils.PrefetchPipeline(lambda x: x + 1, [1, 2, 3], depth=1) as pipeline:
+            assert([r for _, r in pipeline] == [2, 3, 4])
+        assert(pipeline.stats()["overlap_efficiency"] == 0.0)
+
+    def test_gemm_prefetch(self):
+        X = np.random.randn(48, 80)
+        Y = np.random.randn(80, 32)
+        X_sharded = BigMatrix("prefetch_X", shape=X.shape, shard_sizes=[16, 16])
+        Y_sharded = BigMatrix("prefetch_Y", shape=Y.shape, shard_sizes=[16, 16])
+        shard_matrix(X_sharded, X)
+        shard_matrix(Y_sharded, Y)
+        pwex = local.LocalExecutor(workers=2)
+        XY_sharded = binops.gemm(pwex, X_sharded, Y_sharded, gemm_impl=2, gemm_chunk_size=2, prefetch_depth=3)
+        assert(np.allclose(XY_sharded.numpy(), X.dot(Y)))
+
+    def test_lambdapack_prefetch(self):
+        np.random.seed(1)
+        X = np.random.randn(64, 64)
+        A = X.dot(X.T) + 64*np.eye(64)
+        A_sharded = BigMatrix("prefetch_A", shape=A.shape, shard_sizes=[16, 16])
+        shard_matrix(A_sharded, A)
+        pwex = local.LocalExecutor(workers=2)
+        L_sharded = uops.chol(pwex, A_sharded, fusion_granularity=2)
+        assert(np.allclose(L_sharded.numpy(), np.linalg.cholesky(A)))
@@ -0,0 +1,66 @@
+from numpywren import local
+from numpywren.matrix import BigMatrix
+from numpywren import uops, trace, lambdapack as lp
+from numpywren.matrix_init import shard_matrix
+from tests.local_storage import LocalStorageTestCase
+import numpy as np
+
+
+class QRTestClass(LocalStorageTestCase):
+    def shard(self, key, m, n, shard_sizes):
+        np.random.seed(m + n)
+        X = np.random.randn(m, n)
+        X_sharded = BigMatrix(key, shape=X.shape, shard_sizes=shard_sizes)
+        shard_matrix(X_sharded, X)
+        return X, X_sharded
+
+    def check_r(self, X, R):
+        # R is unique up to the signs of its rows
+        assert(np.allclose(R, np.triu(R)))
+        assert(np.allclose(R.T.dot(R), X.T.dot(X)))
+        R_ref = np.linalg.qr(X, mode='r')
+        assert(np.allclose(np.abs(R), np.abs(R_ref)))
+
+    def test_qr_tree(self):
+        nodes = lp.qr_tree(list(range(5)), 2)
+        assert([level for level, _ in nodes] == [1, 1, 2, 3])
+        assert(nodes[-1][1] == [("node", 2), ("row", 4)])
+        assert(lp.qr_tree([3], 2) == [(1, [("row", 3)])])
+
+    def test_tsqr(self):
+        X, X_sharded = self.shard("tsqr_test_X", 100, 10, [16, 10])
+        R_sharded = uops.tsqr(local.LocalExecutor(workers=2), X_sharded)
+        self.check_r(X, R_sharded.numpy())
+
+    def test_tsqr_explicit_q(self):
+        X, X_sharded = self.shard("tsqr_test_explicit_X", 100, 10, [16, 10])
+        R_sharded, Q_sharded = uops.tsqr(local.LocalExecutor(workers=2), X_sharded, arity=3, q="explicit")
+        Q = Q_sharded.numpy()
+        assert(np.allclose(Q.dot(R_sharded.numpy()), X))
+        assert(np.allclose(Q.T.dot(Q), np.eye(X.shape[1])))
+
+    def test_tsqr_implicit_q(self):
+        X, X_sharded = self.shard("tsqr_test_implicit_X", 64, 8, [16, 8])
+        pwex = local.LocalExecutor(workers=2)
+        R_sharded, reflectors = uops.tsqr(pwex, X_sharded, q="implicit")
+        Q_sharded = uops.tsqr_q(pwex, X_sharded, reflectors)
+        assert(np.allclose(Q_sharded.numpy().dot(R_sharded.numpy()), X))
+
+    def test_blocked_qr(self):
+        X, X_sharded = self.shard("qr_test_X", 100, 70, [16, 16])
+        R_sharded = uops.qr(local.LocalExecutor(workers=2), X_sharded, arity=3)
+        self.check_r(X, R_sharded.numpy())
+
+    def test_level_timing(self):
+        X, X_sharded = self.shard("tsqr_test_levels_X", 128, 8, [16, 8])
+        instructions, R_sharded, reflectors, intermediates = lp._qr(X_sharded, arity=2)
+        program = lp.LambdaPackProgram(instructions, executor=local.LocalExecutor, pywren_config={},
+                                       outputs=[R_sharded], trace_sink=trace.S3TraceSink(X_sharded.bucket))
+        program.start()
+        program.wait(0.1)
+        assert(program.program_status() == lp.EC.SUCCESS)
+        levels = program.trace().by_level("tsqr")
+        # 8 row blocks reduce in 3 levels of 4, 2 and 1 nodes
+        assert([levels[l]["nodes"] for l in sorted(levels)] == [4, 2, 1])
+        assert(levels[1]["end_time"] <= levels[3]["start_time"])
+        self.check_r(X, R_sharded.numpy())
@@ -0,0 +1,35 @@
+from numpywren import local, matrix_utils
+from numpywren.matrix import BigMatrix
+from numpywren import uops
+from numpywren.matrix_init import shard_matrix
+from tests.local_storage import LocalStorageTestCase
+import numpy as np
+
+
+class RandomizedSVDTestClass(LocalStorageTestCase):
+    def test_normal_parent(self):
+        X = BigMatrix("normal_parent_test", shape=(50, 30), shard_sizes=[20, 30],
+                      parent_fn=matrix_utils.make_normal_parent(7))
+        assert(np.allclose(X.get_block(1, 0), X.get_block(1, 0)))
+        assert(X.get_block(2, 0).shape == (10, 30))
+        assert(not np.allclose(X.get_block(0, 0), X.get_block(1, 0)))
+
+    def test_randomized_svd(self):
+        np.random.seed(0)
+        m, n, k = 200, 120, 5
+        U_ref, _ = np.linalg.qr(np.random.randn(m, n))
+        V_ref, _ = np.linalg.qr(np.random.randn(n, n))
+        s_ref = np.exp(-np.arange(n)/4.0)
+        X = (U_ref*s_ref).dot(V_ref.T)
+        X_sharded = BigMatrix("randomized_svd_test_X", shape=X.shape, shard_sizes=[64, 40])
+        shard_matrix(X_sharded, X)
+        U_sharded, s, V_sharded = uops.randomized_svd(local.LocalExecutor(workers=2), X_sharded, k,
+                                                      oversample=10, power_iters=1)
+        U = U_sharded.numpy()
+        V = V_sharded.numpy()
+        assert(U.shape == (m, k) and V.shape == (n, k))
+        assert(np.allclose(s, s_ref[:k], rtol=1e-6))
+        assert(np.allclose(U.T.dot(U), np.eye(k)))
+        assert(np.allclose(V.T.dot(V), np.eye(k)))
+        # close to the best rank k approximation error
+        assert(np.linalg.norm(X - (U*s).dot(V.T), 2) < 1.01*s_ref[k])
@@ -0,0 +1,36 @@
+from numpywren import simulator
+import numpy as np
+import unittest
+
+
+class SimulatorTestClass(unittest.TestCase):
+    def test_cholesky_flops(self):
+        n = 1024
+        inst_blocks = simulator.cholesky_instructions(n, 128)
+        result = simulator.simulate(inst_blocks)
+        assert(len(result.records) == len(inst_blocks))
+        flops = result.summary()["flops"]
+        assert(abs(flops - n**3/3.0)/(n**3/3.0) < 0.05)
+
+    def test_concurrency_limit(self):
+        inst_blocks = simulator.cholesky_instructions(1024, 128)
+        one = simulator.simulate(inst_blocks, simulator.CostModel(workers=1))
+        many = simulator.simulate(inst_blocks, simulator.CostModel(workers=1000))
+        assert(one.peak_concurrency == 1)
+        assert(many.peak_concurrency > 1)
+        assert(one.makespan > many.makespan)
+        critical_path_seconds, _ = many.aggregator().critical_path()
+        assert(many.makespan >= critical_path_seconds)
+
+    def test_calibrate_from_trace(self):
+        # ragged edge blocks so request latency and bandwidth can be told apart
+        inst_blocks = simulator.cholesky_instructions(1000, 128)
+        cost_model = simulator.CostModel(default_flop_rate=1e9, bandwidth=1e8, request_latency=0.01,
+                                         state_latency=0.001, invoke_overhead=0.5)
+        result = simulator.simulate(inst_blocks, cost_model)
+        fitted = simulator.CostModel.from_trace(result.records)
+        assert(np.isclose(fitted.default_flop_rate, 1e9))
+        assert(np.isclose(fitted.request_latency, 0.01))
+        assert(np.isclose(fitted.bandwidth, 1e8))
+        assert(np.isclose(fitted.state_latency, 0.001))
+        assert(np.isclose(fitted.invoke_overhead, 0.5))
@@ -0,0 +1,97 @@
+from numpywren import local
+from numpywren.matrix import BigMatrix, DEFAULT_BUCKET
+from numpywren import matrix_utils, binops
+from numpywren.matrix_init import shard_matrix
+from tests.local_storage import LocalStorageTestCase
+import numpy as np
+
+
+class _RecordingFuture(local.LocalFuture):
+    def __init__(self, task_id, executor):
+        local.LocalFuture.__init__(self, task_id)
+        self.executor = executor
+
+    def result(self, timeout=None):
+        if (self.executor.gemms_at_first_wait is None):
+            self.executor.gemms_at_first_wait = len(self.executor.gemms)
+        return local.LocalFuture.result(self, timeout=timeout)
+
+class _RecordingExecutor(object):
+    ''' Counts the gemm calls that have submitted jobs when a gemm job is first waited for '''
+    def __init__(self, pwex):
+        self.pwex = pwex
+        self.gemms = []
+        self.gemms_at_first_wait = None
+
+    def map(self, func, iterdata, **kwargs):
+        futures = self.pwex.map(func, iterdata, **kwargs)
+        if (func.__name__ != "pywren_run"):
+            return futures
+        if (func not in self.gemms):
+            self.gemms.append(func)
+        return [_RecordingFuture(f.task_id, self) for f in futures]
+
+
+class StrassenTestClass(LocalStorageTestCase):
+    def shard(self, key, X, shard_size):
+        X_sharded = BigMatrix(key, shape=X.shape, shard_sizes=[shard_size, shard_size])
+        shard_matrix(X_sharded, X)
+        return X_sharded
+
+    def test_strassen(self):
+        np.random.seed(0)
+        X = np.random.randn(64, 64)
+        Y = np.random.randn(64, 64)
+        X_sharded = self.shard("strassen_X", X, 8)
+        Y_sharded = self.shard("strassen_Y", Y, 8)
+        pwex = local.LocalExecutor(workers=2)
+        stats = {}
+        XY_sharded = binops.strassen(pwex, X_sharded, Y_sharded, cutoff=2, stats=stats)
+        assert(np.allclose(XY_sharded.numpy(), X.dot(Y)))
+        # 8 -> 4 -> 2 blocks on a side
+        assert(stats["levels"] == 2)
+        assert(stats["leaf_products"] == 49)
+        # only the output is left, every operand sum and product was freed
+        keys = matrix_utils.list_all_keys(DEFAULT_BUCKET, "numpywren.objects/")
+        assert(len([k for k in keys if "strassen_S" in k or "strassen_T" in k]) == 0)
+        assert(len([k for k in keys if "gemm(" in k]) == 0)
+
+    def test_strassen_products_submitted_together(self):
+        np.random.seed(3)
+        X = np.random.randn(32, 32)
+        Y = np.random.randn(32, 32)
+        X_sharded = self.shard("strassen_together_X", X, 8)
+        Y_sharded = self.shard("strassen_together_Y", Y, 8)
+        pwex = _RecordingExecutor(local.LocalExecutor(workers=2))
+        XY_sharded = binops.strassen(pwex, X_sharded, Y_sharded, cutoff=2)
+        assert(np.allclose(XY_sharded.numpy(), X.dot(Y)))
+        assert(len(pwex.gemms) == 7)
+        assert(pwex.gemms_at_first_wait == 7)
+
+    def test_strassen_transposed(self):
+        np.random.seed(1)
+        X = np.random.randn(32, 32)
+        X_sharded = self.shard("strassen_XT", X, 8)
+        pwex = local.LocalExecutor(workers=2)
+        XXT_sharded = binops.gemm(pwex, X_sharded, X_sharded.T, strassen_cutoff=1, worker_memory=8*8*8*8)
+        assert(np.allclose(XXT_sharded.numpy(), X.dot(X.T)))
+
+    def test_strassen_fallback(self):
+        # 3 blocks on a side can not be split, gemm computes the whole product
+        np.random.seed(2)
+        X = np.random.randn(24, 24)
+        X_sharded = self.shard("strassen_odd", X, 8)
+        pwex = local.LocalExecutor(workers=2)
+        stats = {}
+        XY_sharded = binops.strassen(pwex, X_sharded, X_sharded, cutoff=1, stats=stats)
+        assert(np.allclose(XY_sharded.numpy(), X.dot(X)))
+        assert(stats["levels"] == 0)
+        assert(stats["leaf_products"] == 1)
+
+
+if __name__ == "__main__":
+    tests = StrassenTestClass()
+    tests.test_strassen()
+    tests.test_strassen_products_submitted_together()
+    tests.test_strassen_transposed()
+    tests.test_strassen_fallback()
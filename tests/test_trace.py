@@ -0,0 +1,72 @@
+import json
+import math
+from numpywren import trace, lambdapack as lp
+from numpywren.matrix import BigSymmetricMatrix
+from numpywren.matrix_init import shard_matrix
+from tests.local_storage import LocalStorageTestCase, InProcessExecutor
+import numpy as np
+from numpy.linalg import cholesky
+
+FIELDS = ["node", "opcodes", "worker", "queue_wait", "read_bytes", "write_bytes", "io_seconds",
+          "flops", "state_seconds", "state_requests"]
+
+
+class TraceTestClass(LocalStorageTestCase):
+    def cholesky_program(self, key, trace_sink):
+        np.random.seed(0)
+        X = np.random.randn(64, 64)
+        A = X.dot(X.T) + np.eye(X.shape[0])
+        A_sharded = BigSymmetricMatrix(key, shape=A.shape, shard_sizes=[16, 16])
+        shard_matrix(A_sharded, A)
+        instructions, L_sharded, trailing = lp._chol(A_sharded)
+        # the workers share this process so they can report to a ListTraceSink
+        program = lp.LambdaPackProgram(instructions, executor=InProcessExecutor, pywren_config={},
+                                       trace_sink=trace_sink)
+        program.start()
+        assert(program.program_status() == lp.EC.SUCCESS)
+        assert(np.allclose(L_sharded.numpy(), cholesky(A)))
+        return program
+
+    def test_cholesky_trace(self):
+        program = self.cholesky_program("trace_test_A", trace.ListTraceSink())
+        aggregator = program.trace()
+        records = aggregator.records
+        # every node ran once, the exit block included
+        assert(sorted([r["node"] for r in records]) == list(range(len(program.inst_blocks))))
+        for r in records:
+            for field in FIELDS:
+                assert(field in r)
+            assert(r["worker"] == trace.worker_id())
+            assert(r["queue_wait"] >= 0 and r["io_seconds"] >= 0 and r["state_seconds"] >= 0)
+            assert(r["state_requests"] > 0)
+            assert(not r["replay"])
+            if (r["label"] != "EXIT"):
+                assert(r["write_bytes"] > 0)
+                assert(r["flops"] > 0)
+        assert(sum([r["read_bytes"] for r in records]) > 0)
+
+        summary = aggregator.summary()
+        assert(summary["nodes"] == len(program.inst_blocks))
+        for rate in ["gflops_per_second", "gbytes_per_second"]:
+            assert(summary[rate] > 0 and math.isfinite(summary[rate]))
+        length, path = aggregator.critical_path()
+        assert(0 < length <= aggregator.makespan)
+        # the path follows the edges of the program
+        assert(all([b in program.children[a] for a, b in zip(path, path[1:])]))
+
+        chrome_trace = json.loads(json.dumps(aggregator.to_chrome_trace()))
+        events = [e for e in chrome_trace["traceEvents"] if e["ph"] == "X"]
+        assert(sorted([e["args"]["node"] for e in events]) == list(range(len(program.inst_blocks))))
+
+    def test_logging_sink(self):
+        with self.assertLogs("numpywren.trace", level="INFO") as logs:
+            program = self.cholesky_program("trace_logging_test_A", trace.LoggingTraceSink())
+        records = [json.loads(line.split(":", 2)[2]) for line in logs.output]
+        assert(sorted([r["node"] for r in records]) == list(range(len(program.inst_blocks))))
+        assert(all([r["program_id"] == program.program_id for r in records]))
+
+
+if __name__ == "__main__":
+    tests = TraceTestClass()
+    tests.test_cholesky_trace()
+    tests.test_logging_sink()